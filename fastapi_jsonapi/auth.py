@@ -1,22 +1,35 @@
 import abc
+import json
 import math
-from typing import List
+import time
+import base64
+from collections import defaultdict
+from functools import lru_cache
+from contextvars import ContextVar
+from typing import List, Optional
 from fastapi import Security, routing, Depends, Request
 from pydantic import BaseModel, Field
 from fastapi.security import SecurityScopes, OAuth2PasswordBearer
 from treelib import Tree, Node
-from bitarray import bitarray
+from bitarray import bitarray, frozenbitarray
 from bitarray.util import ba2base, base2ba
-from fastapi_jsonapi.meta import registered_resources
-from fastapi_jsonapi.exception import QureyError
+from fastapi_jsonapi.meta import relationship_graph
+from fastapi_jsonapi.exception import AuthError, QureyError
+from fastapi_jsonapi.query import TTLCache
 from fastapi.dependencies.utils import get_parameterless_sub_dependant
 
 
 class ScopeTree:
+    """
+    scope树。构建时预计算每个scope及其全部子孙的位图(闭包)，
+    scope集合的合并、交集判断都用位运算，token中scope字符串的解析结果缓存
+    """
+
     def __init__(self, project_scopes: List[dict]) -> None:
         self.project_scopes = project_scopes
         self.scope_dict = {}
         self.scope_tree = Tree()
+        children = defaultdict(list)  # {"父scope id": [子scope]}
 
         for scope in project_scopes:
             self.scope_dict[scope["scope"]] = scope["id"]
@@ -25,9 +38,32 @@ class ScopeTree:
                         identifier=scope["id"])
             if scope["pid"] is not None:
                 self.scope_tree.add_node(node, parent=scope["pid"])
+                children[scope["pid"]].append(scope["scope"])
             else:
                 self.scope_tree.add_node(node)
 
+        ba_len = math.ceil(len(self.scope_dict) / 6) * 6
+        max_id = max(self.scope_dict.values(), default=-1)
+        self.ba_len = max(ba_len, math.ceil((max_id + 1) / 6) * 6)  # 位图长度，64进制每位6比特
+        self.descendants = {}  # {"scope": (子孙scope,)} 深度优先顺序
+        self.closure = {}  # {"scope": 自身及子孙的位图}
+        for tag in reversed(self.scope_dict):  # 子scope在父scope之后定义，倒序时先计算子scope
+            descendants = []
+            closure = self._empty()
+            closure[self.scope_dict[tag]] = 1
+            for child in children[self.scope_dict[tag]]:
+                descendants.append(child)
+                descendants.extend(self.descendants[child])
+                closure |= self.closure[child]
+            self.descendants[tag] = tuple(descendants)
+            self.closure[tag] = frozenbitarray(closure)
+        self._scopes_of = lru_cache(maxsize=1024)(self._decode)  # {"64进制字符串": (scope,)}
+
+    def _empty(self) -> bitarray:
+        ba = bitarray(self.ba_len)
+        ba.setall(0)
+        return ba
+
     def scopes(self):
         scopes = {}
         for scope in self.project_scopes:
@@ -35,45 +71,57 @@ class ScopeTree:
         return scopes
 
     def sub(self, tag: str) -> list:
-        sub = []
-        nodeid = self.scope_dict[tag]
-        children = self.scope_tree.children(nodeid)
-        for child in children:
-            childlist = self.sub(child.data)
-            sub.append(child.data)
-            sub = sub + childlist
-        return sub
+        return list(self.descendants[tag])
+
+    def bits(self, tags: list, family: bool = True) -> frozenbitarray:
+        """
+        scope列表转位图，未定义的scope忽略
+        Args:
+            tags: scope列表
+            family: 是否包含子孙scope
+
+        Returns: 位图
+        """
+        ba = self._empty()
+        for tag in tags:
+            if family:
+                closure = self.closure.get(tag)
+                if closure is not None:
+                    ba |= closure
+            elif tag in self.scope_dict:
+                ba[self.scope_dict[tag]] = 1
+        return frozenbitarray(ba)
+
+    def to_list(self, ba: bitarray) -> list:
+        """位图转scope列表"""
+        return [item for item, index in self.scope_dict.items() if index < len(ba) and ba[index]]
+
+    def intersects(self, tags: list, others: list) -> bool:
+        """两个scope列表是否有交集"""
+        return (self.bits(tags, family=False) & self.bits(others, family=False)).any()
+
+    def covers(self, required: bitarray, tags: list) -> bool:
+        """
+        tags及其子孙scope是否包含required的全部scope
+        Args:
+            required: 需要的scope位图
+            tags: 拥有的scope列表
+
+        Returns: bool
+        """
+        return not (required & ~self.bits(tags)).any()
 
     def children(self, tags: list) -> list:
-        family = []
-        for node in tags:
-            family.append(node)
-            family = family + self.sub(node)
-        family = list(set(family))
-        return family
+        return self.to_list(self.bits(tags))
 
     def to_base(self, checked: list) -> str:
-        family = []
-        for node in checked:
-            family.append(node)
-            family = family + self.sub(node)
-        family = list(set(family))
-        ba_len = math.ceil(len(self.scope_dict) / 6) * 6
-        ba = bitarray(ba_len)
-        ba.setall(0)
-        for item in self.scope_dict:
-            if item in family:
-                ba[self.scope_dict[item]] = 1
-        return str(ba2base(64, ba))
+        return str(ba2base(64, self.bits(checked)))
+
+    def _decode(self, ba_str: str) -> tuple:
+        return tuple(self.to_list(base2ba(64, ba_str)))
 
     def to_sope(self, ba_str: str) -> list:
-        ba = base2ba(64, ba_str)
-        scopes = []
-        for item in self.scope_dict:
-            index = self.scope_dict[item]
-            if index <= len(ba) - 1 and ba[index]:
-                scopes.append(item)
-        return scopes
+        return list(self._scopes_of(ba_str))
 
 
 class User(BaseModel):
@@ -84,14 +132,34 @@ class User(BaseModel):
     scope: List[str] = Field(None, title='scope')
 
 
+# 当前请求的用户，每个请求在各自的上下文中，并发请求互不影响
+_current_user = ContextVar('jsonapi_user', default=None)
+
+
+def current_user() -> Optional[User]:
+    """当前请求已验证的用户"""
+    return _current_user.get()
+
+
 class Auth(metaclass=abc.ABCMeta):
     """权限验证基类"""
 
-    def __init__(self, cert, token_url: str = None, scopes: List[dict] = None):
+    def __init__(self, cert, token_url: str = None, scopes: List[dict] = None, token_ttl: float = 0,
+                 token_cache_size: int = 1024):
         self.cert = cert
         self.token_url = token_url
         self.scope_tree = ScopeTree(scopes)
-        self.user = None
+        # 已验证的token，默认不缓存。缓存时吊销的token在token_ttl内仍然有效，可调用revoke
+        self.token_cache = TTLCache(ttl=token_ttl, maxsize=token_cache_size)
+
+    @property
+    def user(self) -> Optional[User]:
+        """当前请求的用户"""
+        return current_user()
+
+    @user.setter
+    def user(self, user: Optional[User]):
+        _current_user.set(user)
 
     def _scopes(self) -> dict:
         # 项目全部的scopes集合
@@ -114,6 +182,44 @@ class Auth(metaclass=abc.ABCMeta):
         """
         return self.scope_tree.to_sope(ba_str)
 
+    async def verify(self, security_scopes: SecurityScopes, token: str) -> User:
+        """
+        带缓存的权限验证，token_ttl大于0时，相同token和scopes在缓存时间内不再验证签名、解析scope。
+        缓存时间不超过token的剩余有效期
+        Args:
+            security_scopes: 接口需要的scopes
+            token: token
+
+        Returns: 用户
+        """
+        key = (token, tuple(sorted(security_scopes.scopes)))
+        user = self.token_cache.get(key)
+        if user is None:
+            user = await self.auth(security_scopes=security_scopes, token=token)  # 验证失败抛出异常，不缓存
+            if self.token_cache.ttl:
+                expires = self.token_expires(token)
+                self.token_cache.put(key, user, ttl=None if expires is None else expires - time.time())
+        return user
+
+    def token_expires(self, token: str) -> Optional[float]:
+        """
+        token的过期时间戳，默认取jwt的exp，非jwt或没有exp时为None。auth验证通过后调用，不再验证签名
+        Args:
+            token: token
+
+        Returns: 过期时间戳(秒)
+        """
+        try:
+            payload = token.split('.')[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+            return float(claims['exp'])
+        except (IndexError, KeyError, TypeError, ValueError):
+            return None
+
+    def revoke(self, token: str) -> None:
+        """token吊销后删除其缓存"""
+        self.token_cache.discard(lambda key: key[0] == token)
+
     @abc.abstractmethod
     async def auth(self, security_scopes: SecurityScopes,
                    token: str) -> User:
@@ -124,9 +230,10 @@ class Auth(metaclass=abc.ABCMeta):
 class SecurityConfig(Auth):
     """权限安全配置"""
 
-    def __init__(self, api_scopes: dict, cert: str, token_url: str = None, scopes: List[dict] = None):
+    def __init__(self, api_scopes: dict, cert: str, token_url: str = None, scopes: List[dict] = None,
+                 token_ttl: float = 0, token_cache_size: int = 1024):
 
-        super().__init__(cert, token_url, scopes)
+        super().__init__(cert, token_url, scopes, token_ttl=token_ttl, token_cache_size=token_cache_size)
         self.api_scopes = api_scopes
         self.res = None
 
@@ -146,6 +253,25 @@ class SecurityConfig(Auth):
         scope = api.get(method, None)
         return scope
 
+    async def authorize(self, request: Request, api_url: str, method: str) -> Optional[User]:
+        """
+        按接口的scope验证当前请求，用于不经过接口路由的操作，如原子操作中的各个操作
+        Args:
+            request: 请求
+            api_url: 接口url，如 /article/{id}
+            method: 接口方法
+
+        Returns: 用户，接口不需要权限时为None
+        """
+        scopes = self.get_scopes(api_url=api_url, method=method)
+        if not scopes:
+            return None
+        token = await self._oauth()(request)
+        user = await self.verify(SecurityScopes(scopes=scopes), token)
+        request.state.user = user
+        _current_user.set(user)
+        return user
+
     async def api_auth(self, api_url, method) -> bool:
         """
         判断用户有没有接口权限
@@ -157,59 +283,65 @@ class SecurityConfig(Auth):
 
         """
         api_scope = self.get_scopes(api_url=api_url, method=method)
-        if self.user and self.user.scope:
-            user_scope = self.user.scope
-        else:
-            user_scope = []
-        if set(api_scope).intersection(set(user_scope)):
-            auth = True
-        else:
-            auth = False
-        return auth
-
-    def _get_auth(self, res):
+        if not api_scope or not self.user or not self.user.scope:
+            return False
+        return self.scope_tree.intersects(api_scope, self.user.scope)
+
+    def include_scopes(self, res) -> dict:
+        """
+        资源各include路径需要的scopes，第二层起每层关系资源都需要其GET接口的scope
+        Args:
+            res: 接口的资源
+
+        Returns: {"include路径": 各层scope合并的位图}，不需要scope的路径为None
+        """
+        table = {}
+        for path in relationship_graph.include_paths(res):
+            scopes = set()
+            resource = res
+            for depth, rel_name in enumerate(path.split('.')):
+                resource = relationship_graph.target(resource, rel_name)
+                if resource is None:
+                    break
+                if depth >= 1:
+                    scopes.update(self.get_scopes(api_url=resource.Meta.link, method='GET') or ())
+            table[path] = self.scope_tree.bits(list(scopes), family=False) if scopes else None
+        return table
+
+    def _get_auth(self, res, include_scopes: dict = None):
         """
         生成权限判断函数
         Args:
             res: 资源
+            include_scopes: 路由各include路径需要的scopes, include_scopes()
 
         Returns:
 
         """
+        include_scopes = include_scopes or {}
+
         async def wrapper(
                 request: Request,
                 security_scopes: SecurityScopes,
                 token: str = Depends(self._oauth())
         ) -> User:
-            # include中关系的关系权限判断
-            if request.query_params.get('include'):
-                for include in request.query_params.get('include').split(','):
-                    if include.count('.') == 1:
-                        rel_name, relrel_name = include.split('.')
-                        path_parma = request.scope.get('path').split('/')
-                        if 'id' in request.path_params and request.path_params.get('id') == path_parma[-2]:
-                            res_temp = res.rel_resources()
-                            rel_res_temp = res_temp[request.scope.get('path').split('/')[-1]]
-                            rel_resource = registered_resources.get(rel_res_temp.rel_resource)
-                            rels = rel_resource.rel_resources()
-                        else:
-                            rels = res.rel_resources()
-                        if rel_name not in rels:
-                            raise QureyError(
-                                detail='include 参数 %s 不存在' % (rel_name))
-                        rel_res = rels[rel_name]
-                        rel_resource = registered_resources.get(rel_res.rel_resource)
-                        rel_rels = rel_resource.rel_resources()
-                        if relrel_name not in rel_rels:
-                            raise QureyError(
-                                detail='include 参数 %s 不存在' % (relrel_name))
-                        relrel_res = registered_resources.get(rel_rels[relrel_name].rel_resource)
-                        scope = self.get_scopes(api_url=relrel_res.Meta.link,
-                                                 method='GET')
-                        await self.auth(security_scopes=SecurityScopes(scopes=scope), token=token)
-
-            user = await self.auth(security_scopes, token)
-            self.user = user
+            user = await self.verify(security_scopes, token)
+            # include中关系的关系权限判断：token只验证一次，各路径需要的scope合并后与用户scope(含子孙)比较
+            include = request.query_params.get('include')
+            if include:
+                required = None
+                for path in include.replace('-', '_').split(','):
+                    if path not in include_scopes:
+                        if path.count('.') >= 1:
+                            raise QureyError(detail='include 参数 %s 不存在' % path)
+                        continue  # 第一层或超过深度的参数由ArgParse验证
+                    scopes = include_scopes[path]
+                    if scopes is not None:
+                        required = scopes if required is None else required | scopes
+                if required is not None and not self.scope_tree.covers(required, user.scope or []):
+                    raise AuthError(detail='没有include %s 的权限' % include)
+            request.state.user = user
+            _current_user.set(user)  # 依赖与接口方法在同一上下文中执行
             return user
         return wrapper
 
@@ -223,15 +355,22 @@ class SecurityConfig(Auth):
         Returns:
 
         """
+        tables = {}  # {资源: include_scopes()}，关系接口以关系资源为主资源
         for route in res.route.routes:
             api_url = route.path_format[len(res.prefix):]  #  route.path_format里有prefix，查找时在前面去除掉
             scopes = self.get_scopes(api_url=api_url,
                                       method=list(route.methods)[0])
             if scopes:
                 if isinstance(route, routing.APIRoute):
+                    base_res = res
+                    rel_name = route.path_format.rsplit('/', 1)[-1]
+                    if route.path_format.endswith('/{id}/' + rel_name):
+                        base_res = relationship_graph.target(res, rel_name) or res
+                    if base_res not in tables:
+                        tables[base_res] = self.include_scopes(base_res)
                     route.dependant.dependencies.insert(
                         0,
-                        get_parameterless_sub_dependant(depends=Security(self._get_auth(res),
+                        get_parameterless_sub_dependant(depends=Security(self._get_auth(res, tables[base_res]),
                                                                          scopes=scopes), path=route.path_format),
                     )
         return res
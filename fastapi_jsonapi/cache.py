@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+响应缓存
+资源设置 response_cache 后，GET接口的响应按 资源、路径、查询参数、用户scope 缓存，
+缓存带有资源和include资源的 type、type:id 标签，post/patch/delete 后按标签失效
+"""
+import abc
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Iterable, List, Optional
+
+# 已创建的缓存后端，写操作时全部按标签失效，include了其他资源的缓存也能失效
+cache_backends: List['CacheBackend'] = []
+
+
+def tag(type_: str, id_: Any = None) -> str:
+    """缓存标签，type_ 为资源列表的标签，type_:id 为单个资源的标签"""
+    return type_ if id_ is None else '%s:%s' % (type_, id_)
+
+
+class CacheBackend(metaclass=abc.ABCMeta):
+    """响应缓存后端基类，可实现redis等进程外的缓存"""
+
+    def __init__(self):
+        cache_backends.append(self)
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[dict]:
+        """取缓存，没有或已过期时返回None"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: dict, ttl: float, tags: Iterable[str]) -> None:
+        """
+        保存缓存
+        Args:
+            key: 缓存键
+            value: {"body": 响应内容, "status_code": 状态码}
+            ttl: 过期秒数
+            tags: 标签
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def invalidate(self, tags: Iterable[str]) -> None:
+        """删除带有任一标签的缓存"""
+        raise NotImplementedError
+
+    async def clear(self) -> None:
+        """清空缓存"""
+        pass
+
+
+class MemoryCache(CacheBackend):
+    """
+    进程内 LRU + 过期时间的缓存
+        Args:
+            maxsize: 最大缓存条数
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        super().__init__()
+        self.maxsize = maxsize
+        self._cache = OrderedDict()  # {key: (value, 过期时间, 标签)}
+        self._tags = defaultdict(set)  # {标签: {key}}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[dict]:
+        item = self._cache.get(key)
+        if item is None or item[1] < time.monotonic():
+            if item is not None:
+                self._delete(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._cache.move_to_end(key)
+        return item[0]
+
+    async def set(self, key: str, value: dict, ttl: float, tags: Iterable[str]) -> None:
+        if not self.maxsize or not ttl:
+            return
+        if key in self._cache:
+            self._delete(key)
+        tags = frozenset(tags)
+        self._cache[key] = (value, time.monotonic() + ttl, tags)
+        for item in tags:
+            self._tags[item].add(key)
+        while len(self._cache) > self.maxsize:
+            self._delete(next(iter(self._cache)))
+
+    async def invalidate(self, tags: Iterable[str]) -> None:
+        for item in tags:
+            for key in self._tags.pop(item, ()):
+                self._delete(key)
+
+    async def clear(self) -> None:
+        self._cache.clear()
+        self._tags.clear()
+
+    def _delete(self, key: str) -> None:
+        item = self._cache.pop(key, None)
+        if item is None:
+            return
+        for item_tag in item[2]:
+            keys = self._tags.get(item_tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[item_tag]
+
+    def info(self) -> dict:
+        """缓存的命中信息"""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._cache), 'maxsize': self.maxsize}
+
+
+async def invalidate(tags: Iterable[str]) -> None:
+    """全部缓存后端按标签失效"""
+    tags = list(tags)
+    for backend in cache_backends:
+        await backend.invalidate(tags)
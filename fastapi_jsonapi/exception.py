@@ -91,6 +91,36 @@ class QureyError(JsonapiException):
         )
 
 
+class PoolTimeout(JsonapiException):
+    """ HTTP 503 error,获取数据库会话超时"""
+    status_code: int = status.HTTP_503_SERVICE_UNAVAILABLE
+    title: str = '服务繁忙'
+
+    def __init__(self, status_code: int = None, detail: str = None, title: str = None, body: Any = None) -> None:
+        super().__init__(
+            status_code if status_code is not None else self.status_code,
+            title=title if title is not None else self.title,
+            detail=detail,
+            errors=None,
+            body=body
+        )
+
+
+class PreconditionFailed(JsonapiException):
+    """ HTTP 412 error,If-Match与资源当前版本不一致"""
+    status_code: int = status.HTTP_412_PRECONDITION_FAILED
+    title: str = '资源已被修改'
+
+    def __init__(self, status_code: int = None, detail: str = None, title: str = None, body: Any = None) -> None:
+        super().__init__(
+            status_code if status_code is not None else self.status_code,
+            title=title if title is not None else self.title,
+            detail=detail,
+            errors=None,
+            body=body
+        )
+
+
 async def serialize_error(exc: BaseException, request: Request, msg: dict=None) -> JsonapiResponse:
     """
     错误处理，将所有错误类型转成json:api，
@@ -94,6 +94,35 @@ class FilterDemo(GenericModel, Generic[OperatorT, ValueT]):
     value: ValueT
 
 
+def filter_operator(type_) -> tuple:
+    """
+    字段类型对应的过滤操作符和值类型
+    Args:
+        type_: 字段类型
+    Returns: (操作符枚举, 值类型)
+    """
+    if type_ == int:
+        return NumberFilter, Union[int, str]
+    elif type_ == float:
+        return FloatFilter, Union[int, str]
+    elif type_ == str:
+        return StringFilter, type_
+    elif type_ == enum or type_.__class__ == enum.EnumMeta:
+        return StringFilter, Union[type_, str]
+    elif type_ == datetime:
+        return DatetimeFilter, Union[datetime, int, str]
+    elif type_ == bool:
+        return BoolFilter, Union[str, type_]
+    elif type_ == bytes:
+        return StringFilter, Union[str, type_]
+    elif type_ == List[str] or type_ == List:
+        return ListFilter, Optional[str]
+    elif type_ == Union[int, str]:
+        return NumberFilter, Union[int, str]
+    else:
+        return StringFilter, Union[type_, str]
+
+
 def create_filter_model(
         model_name: str,
         # fields: Dict[str, ModelField]
@@ -138,26 +167,8 @@ def create_filter_model(
 
         # if hasattr(value.type_, 'Config'):
         #     continue
-        if type_ == int:
-            params[name] = (FilterDemo[NumberFilter, Union[int, str]], None)
-        elif type_ == float:
-            params[name] = (FilterDemo[FloatFilter, Union[int, str]], None)
-        elif type_ == str:
-            params[name] = (FilterDemo[StringFilter, type_], None)
-        elif type_ == enum or type_.__class__ == enum.EnumMeta:
-            params[name] = (FilterDemo[StringFilter, Union[type_, str]], None)
-        elif type_ == datetime:
-            params[name] = (FilterDemo[DatetimeFilter, Union[datetime, int, str]], None)
-        elif type_ == bool:
-            params[name] = (FilterDemo[BoolFilter, Union[str, type_]], None)
-        elif type_ == bytes:
-            params[name] = (FilterDemo[StringFilter, Union[str,type_]], None)
-        elif type_ == List[str] or type_ == List:
-            params[name] = (FilterDemo[ListFilter, Optional[str]], None)
-        elif type_ == Union[int, str]:
-            params[name] = (FilterDemo[NumberFilter, Union[int, str]], None)
-        else:
-            params[name] = (FilterDemo[StringFilter, Union[type_, str]], None)
+        operator, value_type = filter_operator(type_)
+        params[name] = (FilterDemo[operator, value_type], None)
     model = create_model(
         model_name,
         **params
@@ -4,7 +4,6 @@ try:
     from typing import Literal
 except ImportError:
     from typing_extensions import Literal
-import copy
 from typing import Optional, List, Any, Dict, Union, TypeVar, Generic
 from enum import Enum
 from pydantic import BaseModel
@@ -16,6 +15,12 @@ class LinksSelfModel(BaseModel):
     self: str = None
 
 
+class LinksPaginationModel(LinksSelfModel):
+    """jsonapi 分页链接对象"""
+    next: Optional[str] = None
+    prev: Optional[str] = None
+
+
 class LinksRelatedModel(BaseModel):
     """jsonapi 链接资源对象"""
     self: str = None
@@ -176,15 +181,13 @@ class JsonapiAdapter(object):
         """
         if links:
             links = {'self': links}
+        type_fields = fields.get(type_) if fields else None
         if isinstance(attributes, BaseModel):
-            attributes = attributes.dict()
-        new_attributes = copy.deepcopy(attributes)
-        if fields and type_ in tuple(fields.keys()):
-            for key in attributes.keys():
-                if key != 'id' and key not in fields[type_]:
-                    new_attributes.pop(key)
-                    if relationships and key in relationships:
-                        relationships.pop(key)
+            attributes = attributes.dict(include=set(type_fields) if type_fields is not None else None)
+        elif attributes and type_fields is not None:
+            attributes = {key: value for key, value in attributes.items() if key in type_fields}
+        if relationships and type_fields is not None:
+            relationships = {key: value for key, value in relationships.items() if key in type_fields}
 
         return {
             'id': id_,
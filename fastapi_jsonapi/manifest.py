@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+路由和模型清单
+构建时生成一次：资源定义(字段元信息、关系、过滤操作符)的指纹和openapi文档，保存为json文件。
+worker启动时加载，指纹与当前资源定义一致时直接使用其中的openapi文档，
+配合 register_routes(lazy=True)，启动时不再生成模型和openapi。
+清单只保存openapi，不保存关系图和字段、过滤表：这些表在检查指纹时按当前定义计算(开销小，
+不保存才能发现定义变化)，查询计划(QueryPlan)仍在资源第一次请求时生成
+"""
+import json
+import hashlib
+from typing import Dict, Optional
+from fastapi import FastAPI
+from fastapi_jsonapi.meta import registered_resources
+from fastapi_jsonapi.filter import filter_operator
+from fastapi_jsonapi.util import create_custom_openapi
+
+MANIFEST_VERSION = 2
+
+
+def api_resources() -> dict:
+    """已注册的接口资源（有模型的），按名称排序"""
+    return {name: resource for name, resource in sorted(registered_resources.items())
+            if getattr(resource, 'model', None) is not None}
+
+
+def qualified_name(func) -> Optional[str]:
+    """函数的限定名称，各进程一致，用于指纹"""
+    if func is None:
+        return None
+    return '%s.%s' % (getattr(func, '__module__', ''), getattr(func, '__qualname__', repr(func)))
+
+
+def field_manifest(model) -> dict:
+    """
+    模型字段的元信息
+    Args:
+        model: SchemaBase
+    Returns: {"字段名"：{type, required, onlyread, onlywrite, inmany, ishide, isrel, mapping}}
+    """
+    fields = {}
+    for name, field in model.__fields__.items():
+        field_info = field.field_info
+        fields[name] = {
+            'type': field._type_display(),
+            'required': bool(field.required),
+            'onlyread': getattr(field_info, 'onlyread', False),
+            'onlywrite': getattr(field_info, 'onlywrite', False),
+            'inmany': getattr(field_info, 'inmany', True),
+            'ishide': getattr(field_info, 'ishide', False),
+            'isrel': getattr(field_info, 'isrel', False),
+            'mapping': qualified_name(getattr(field_info, 'mapping', None)),
+        }
+    return fields
+
+
+def relationship_manifest(rel) -> dict:
+    """关系的配置"""
+    return {
+        'rel_resource': rel.rel_resource,
+        'mapping_field': rel.mapping_field,
+        'cond_fun': rel.cond_fun,
+        'batch_fun': rel.batch_fun,
+        'one_to_one': rel.one_to_one,
+        'has_data': rel.has_data,
+        'has_self': rel.has_self,
+        'has_related': rel.has_related,
+        'has_api': rel.has_api,
+        'modify': rel.modify,
+        'required': rel.required,
+        'include_limit': rel.include_limit,
+    }
+
+
+def resource_manifest(resource) -> dict:
+    """
+    单个资源的清单
+    Args:
+        resource: 资源类
+    Returns: {type, link, methods, fields, relationships, filters}
+    """
+    return {
+        'type': resource.Meta.type_,
+        'link': resource.Meta.link,
+        'methods': sorted(resource.methods),
+        'fields': field_manifest(resource.model),
+        'relationships': {rel_name: relationship_manifest(rel)
+                          for rel_name, rel in resource.rel_resources().items()},
+        'filters': {name: [op.value for op in filter_operator(type_)[0]]
+                    for name, type_ in resource.filter_fields().items()},
+    }
+
+
+def fingerprint(resources: Dict[str, dict]) -> str:
+    """
+    资源清单的指纹，资源定义(SchemaBase、关系、过滤)变化时指纹变化。
+    清单只能包含json类型的值，不能用str()转换(可能含有内存地址，各进程不同)
+    """
+    content = json.dumps(resources, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def build_manifest(app: FastAPI = None) -> dict:
+    """
+    生成清单
+    Args:
+        app: 已挂载路由的FastAPI，有则包含openapi文档
+    Returns: {version, fingerprint, openapi}
+    """
+    resources = {name: resource_manifest(resource) for name, resource in api_resources().items()}
+    return {
+        'version': MANIFEST_VERSION,
+        'fingerprint': fingerprint(resources),
+        'openapi': app.openapi() if app else None,
+    }
+
+
+def save_manifest(manifest: dict, path: str) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+
+def load_manifest(path: str) -> Optional[dict]:
+    """读取清单，文件不存在时返回None"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def is_stale(manifest: Optional[dict]) -> bool:
+    """清单是否过期：版本不同或资源定义已变化，按当前资源定义计算字段、关系、过滤表的指纹比较"""
+    if not manifest or manifest.get('version') != MANIFEST_VERSION:
+        return True
+    resources = {name: resource_manifest(resource) for name, resource in api_resources().items()}
+    return manifest.get('fingerprint') != fingerprint(resources)
+
+
+def apply_manifest(app: FastAPI, manifest: Optional[dict]) -> bool:
+    """
+    worker启动时使用清单，清单未过期时直接使用其中的openapi文档
+    Args:
+        app: FastAPI
+        manifest: load_manifest 读取的清单
+    Returns: 是否使用了清单，过期时返回False, 照常生成
+    """
+    if is_stale(manifest):
+        return False
+    if manifest.get('openapi'):
+        create_custom_openapi(app, manifest['openapi'])
+    return True
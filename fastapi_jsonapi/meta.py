@@ -6,6 +6,81 @@ from typing import Any, Type, Dict
 registered_resources = {}  # type: Dict[str, Type[Any]]
 
 
+class RelationshipGraph(object):
+    """
+    已注册资源的关系图。关系只扫描一次，关系资源名只解析一次为类，查询解析、序列化和权限中按资源O(1)查找。
+    注册新资源时清空，按需重建。返回的字典是共用的，只读
+    """
+
+    def __init__(self):
+        self._relationships = {}  # {资源类: {"关系名"：Relationship对象}}
+        self._targets = {}  # {资源类: {"关系名"：关系资源类}}
+        self._include_paths = {}  # {(资源类, 最大深度): 关系路径集合}
+
+    def clear(self) -> None:
+        self._relationships.clear()
+        self._targets.clear()
+        self._include_paths.clear()
+
+    def relationships(self, resource) -> dict:
+        """资源的关系 {"关系名"：Relationship对象}"""
+        rels = self._relationships.get(resource)
+        if rels is None:
+            rels = resource.scan_rel_resources()
+            self._relationships[resource] = rels
+        return rels
+
+    def targets(self, resource) -> dict:
+        """资源的关系资源 {"关系名"：关系资源类}，关系资源未注册时为None"""
+        targets = self._targets.get(resource)
+        if targets is None:
+            targets = {rel_name: registered_resources.get(rel.rel_resource)
+                       for rel_name, rel in self.relationships(resource).items()}
+            self._targets[resource] = targets
+        return targets
+
+    def target(self, resource, rel_name: str):
+        """关系名对应的关系资源类，关系不存在时为None"""
+        return self.targets(resource).get(rel_name)
+
+    def resolve(self, resource, path: str):
+        """
+        多层关系路径对应的关系资源类
+        Args:
+            resource: 资源类
+            path: 关系路径，例：pubscene.journey
+        Returns: 关系资源类，路径不存在时为None
+        """
+        for rel_name in path.split('.'):
+            resource = self.target(resource, rel_name)
+            if resource is None:
+                return None
+        return resource
+
+    def include_paths(self, resource, max_depth: int = 3) -> frozenset:
+        """资源可以include的全部关系路径，例：pubscene.journey.journeycls"""
+        key = (resource, max_depth)
+        paths = self._include_paths.get(key)
+        if paths is None:
+            collected = set()
+
+            def walk(res, prefix, depth):
+                for rel_name, rel_resource in self.targets(res).items():
+                    path = prefix + rel_name
+                    collected.add(path)
+                    if rel_resource and depth < max_depth:
+                        walk(rel_resource, path + '.', depth + 1)
+
+            walk(resource, '', 1)
+            paths = frozenset(collected)
+            self._include_paths[key] = paths
+        return paths
+
+
+# 关系图
+relationship_graph = RelationshipGraph()
+
+
 class RegisteredResourceMeta(type):
     """
     在字典中注册资源类，使其可访问动态地通过类名。
@@ -17,4 +92,5 @@ class RegisteredResourceMeta(type):
         # 默认注册类，除非在类级别指定“register_resource=False”
         if attrs.get('register_resource', True):
             registered_resources[name] = klass
+            relationship_graph.clear()  # 关系资源名可能解析为新注册的类
         return klass
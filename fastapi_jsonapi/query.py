@@ -4,13 +4,21 @@
 """查询 模块
 """
 from typing import Dict, Any, List, Union, Optional
+import os
 import ast
+import json
+import time
+import hmac
+import base64
+import hashlib
+from collections import OrderedDict
 from uuid import UUID
 from fastapi import Request
 from fastapi_jsonapi.url_parse import query_parse
 from fastapi_jsonapi.exception import QureyError
-from fastapi_jsonapi.meta import registered_resources
-from fastapi_jsonapi.util import get_default_args
+from fastapi_jsonapi.meta import relationship_graph
+from fastapi_jsonapi.util import get_query_params
+from fastapi_jsonapi.responses import encode_default
 
 
 class Sort():
@@ -46,6 +54,11 @@ class Filter():
         self.op = op
         self.value = value
 
+    def copy(self) -> 'Filter':
+        """复制条件，list类型的值一并复制"""
+        value = list(self.value) if isinstance(self.value, list) else self.value
+        return Filter(field=self.field, op=self.op, value=value)
+
 
 class Filters():
     filters: Union[List['Filters'], List[Filter]]
@@ -55,6 +68,10 @@ class Filters():
         """过滤模型基类"""
         self.filters = filters
 
+    def copy(self) -> 'Filters':
+        """复制条件树"""
+        return self.__class__(filters=[filter.copy() for filter in self.filters])
+
     def pop_and_filter(self, field) -> Optional[Filter]:
         """
         去除field对应的条件并返回结果，仅仅适用于当前数据是Filter组成的and条件数据，并且field在条件中唯一；
@@ -144,6 +161,93 @@ class FilterOr(Filters):
     op = 'or'
 
 
+class Cursor():
+    sort: List[Sort]
+    values: Optional[list]
+    before: bool
+    limit: int
+
+    def __init__(self, sort: List[Sort], values: list = None, before: bool = False, limit: int = 100):
+        """
+        游标分页的定位条件(seek predicate)
+        Args:
+            sort: 请求的排序，最后一个为id
+            values: 定位数据各排序字段的值，为None时是第一页
+            before: 是否取定位数据之前的一页(上一页)
+            limit: 每页条数
+        """
+        self.sort = sort
+        self.values = values
+        self.before = before
+        self.limit = limit
+
+    def filter(self) -> Optional[FilterOr]:
+        """
+        定位条件转过滤条件，取排在定位数据之后(before时之前)的数据，get_many与filter一起使用
+        例：sort=-a,id 时为 (a lt va) or (a eq va and id gt vid)
+        """
+        if self.values is None:
+            return None
+        filters = []
+        for i, sort in enumerate(self.sort):
+            and_filters = [Filter(field=prev.field, op='eq', value=value)
+                           for prev, value in zip(self.sort[:i], self.values[:i])]
+            op = 'gt' if sort.asc != self.before else 'lt'
+            and_filters.append(Filter(field=sort.field, op=op, value=self.values[i]))
+            filters.append(FilterAnd(filters=and_filters))
+        return FilterOr(filters=filters)
+
+    def sort_key(self) -> str:
+        """排序参数的字符串，例：-a,id"""
+        return ','.join(sort.field if sort.asc else '-' + sort.field for sort in self.sort)
+
+    def copy(self) -> 'Cursor':
+        return Cursor(sort=[Sort(field=sort.field, asc=sort.asc) for sort in self.sort],
+                      values=list(self.values) if self.values is not None else None,
+                      before=self.before, limit=self.limit)
+
+
+def cursor_secret(resource_model) -> bytes:
+    """
+    游标签名密钥：资源的cursor_secret > 环境变量JSONAPI_CURSOR_SECRET。
+    多进程和重启后游标需要继续有效，未配置时抛出异常
+    """
+    secret = getattr(resource_model, 'cursor_secret', None) or os.environ.get('JSONAPI_CURSOR_SECRET')
+    if not secret:
+        raise Exception('%s 使用游标分页，需配置cursor_secret或环境变量JSONAPI_CURSOR_SECRET' % resource_model.__name__)
+    return secret.encode('utf-8')
+
+
+def _cursor_sign(message: bytes, secret: bytes) -> str:
+    digest = hmac.new(secret, message, hashlib.sha256).digest()[:16]
+    return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+
+def encode_cursor(payload: dict, secret: bytes, type_: str = '') -> str:
+    """
+    生成签名的游标
+    Args:
+        payload: 游标内容
+        secret: 签名密钥
+        type_: 资源类型，游标只能用于同一资源
+    Returns: 不透明的游标字符串
+    """
+    body = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':'), default=encode_default)
+                                    .encode('utf-8')).decode().rstrip('=')
+    return body + '.' + _cursor_sign((type_ + '.' + body).encode(), secret)
+
+
+def decode_cursor(token: str, secret: bytes, type_: str = '') -> dict:
+    """验证签名并解析游标，无效时抛出QureyError"""
+    body, _, sign = token.partition('.')
+    if not sign or not hmac.compare_digest(sign, _cursor_sign((type_ + '.' + body).encode(), secret)):
+        raise QureyError(detail='page[cursor] 无效')
+    try:
+        return json.loads(base64.urlsafe_b64decode(body + '=' * (-len(body) % 4)))
+    except ValueError:
+        raise QureyError(detail='page[cursor] 无效')
+
+
 class ArgsModel():
     """
         查询参数模型
@@ -154,6 +258,7 @@ class ArgsModel():
            limit: 分页limit
            include: include包含资源类型
            fields: 稀疏字段
+           cursor: 游标分页的定位条件
     """
     filter: Union[Filter, Filters] = None
     sort: List[Sort]
@@ -164,6 +269,7 @@ class ArgsModel():
     fields: Dict[str, List[str]]
     q_data: List[str] = None
     warings: List[str] = None
+    cursor: Cursor = None
 
     def __init__(self,
                  filter: Union[Filter, Filters] = None,
@@ -174,7 +280,8 @@ class ArgsModel():
                  include: List[str] = [],
                  fields: Dict[str, List[str]] = None,
                  q_data: List[str] = [],
-                 warnings: List[str] = []):
+                 warnings: List[str] = [],
+                 cursor: Cursor = None):
 
         self.filter = filter
         self.sort = sort
@@ -185,6 +292,7 @@ class ArgsModel():
         self.q_data = q_data if q_data else []
         self.fields = fields
         self.warings = warnings if warnings else []
+        self.cursor = cursor
 
     def add_filter_to_and(self, field, op, value) -> 'ArgsModel':
         """添加and条件"""
@@ -196,6 +304,29 @@ class ArgsModel():
             self.filter = FilterAnd(filters=[Filter(field=field, op=op, value=value)])
         return self
 
+    def filter_key(self) -> Optional[tuple]:
+        """过滤条件的可哈希表示，用于按条件缓存结果（如总条数）"""
+        def parse_filter(filter):
+            if filter is None:
+                return None
+            if hasattr(filter, 'filters'):
+                return filter.op, tuple(parse_filter(f) for f in filter.filters)
+            return filter.field, filter.op, repr(filter.value)
+        return parse_filter(self.filter)
+
+    def cache_key(self) -> tuple:
+        """查询参数的可哈希表示，用于响应缓存"""
+        return (
+            self.filter_key(),
+            tuple((sort.field, sort.asc) for sort in self.sort or ()),
+            self.skip,
+            self.limit,
+            tuple(self.include or ()),
+            tuple(sorted((obj, tuple(fields)) for obj, fields in (self.fields or {}).items())),
+            tuple(self.q_data or ()),
+            (repr(self.cursor.values), self.cursor.before, self.cursor.limit) if self.cursor else None,
+        )
+
     def and_filters(self, filter: Union[Filters, Filter]) -> 'ArgsModel':
         """添加and条件"""
         if isinstance(self.filter, FilterOr):
@@ -260,6 +391,23 @@ class ArgsModel():
         else:
             raise Exception('filter必须是FilterAnd 或者Filter')
 
+    def copy(self) -> 'ArgsModel':
+        """
+        复制查询参数。缓存中的参数模板不可修改，每个请求使用复制后的参数，
+        可修改的容器(include、q_data等)均复制，请求中修改不影响缓存
+        Returns: ArgsModel
+        """
+        return ArgsModel(
+            filter=self.filter.copy() if self.filter else self.filter,
+            sort=[Sort(field=sort.field, asc=sort.asc) for sort in self.sort] if self.sort else self.sort,
+            skip=self.skip,
+            limit=self.limit,
+            include=list(self.include),
+            fields={obj: list(fields) for obj, fields in self.fields.items()} if self.fields else self.fields,
+            q_data=list(self.q_data),
+            warnings=list(self.warings),
+            cursor=self.cursor.copy() if self.cursor else self.cursor)
+
     def __str__(self):
         def parse_filter(filter):
             if hasattr(filter, 'filters'):
@@ -282,6 +430,205 @@ class ArgsModel():
         return args_str
 
 
+class QueryPlan(object):
+    """
+    资源的查询计划，注册路由时按资源类生成一次，ArgParse 只在其中查找，不再每个请求重新生成。
+    模型被 SchemaBase.add_fields 修改后(字段版本号变化)，计划过期并重新生成。
+        Args:
+            resource_model: 资源类
+        Attributes:
+            rel: 关系映射 {"关系名"：Relationship对象}
+            rel_resources: 关系资源映射 {"关系名"：关系资源类}
+            filter_model: 过滤模型
+            sort_fields: 可排序字段，主资源属性和 关系名.关系资源属性
+            include_paths: include 支持的全部关系路径，最深3层， 例：pubscene.journey.journeycls
+            type_fields: 稀疏字段支持的资源类型及其字段（属性和关系），主资源和include可达的资源
+            args_cache: 解析后的查询参数缓存
+            count_cache: 按过滤条件缓存的总条数
+            related_ids_cache: 关系接口中，按(id, 关系名, token)缓存的关系ids
+    """
+    max_include_depth = 3
+
+    def __init__(self, resource_model):
+        self.resource_model = resource_model
+        self.model = resource_model.model
+        self.rel = resource_model.rel_resources()
+        self.rel_resources = relationship_graph.targets(resource_model)
+        self.versions = self._model_versions()
+        self.filter_model = resource_model.filter_model()
+        self.sort_fields = self._sort_fields()
+        self.include_paths = self._include_paths()
+        self.type_fields = self._type_fields()
+        self.args_cache = ArgsCache(maxsize=getattr(resource_model, 'args_cache_size', 0))
+        self.count_cache = TTLCache(ttl=getattr(resource_model, 'count_cache_ttl', 0))
+        self.related_ids_cache = TTLCache(ttl=getattr(resource_model, 'related_ids_ttl', 0))
+
+    def _model_versions(self) -> dict:
+        # 计划依赖的模型及其字段版本号
+        versions = {self.model: self.model.fields_version()}
+        for rel_resource in self.rel_resources.values():
+            if rel_resource and rel_resource.model:
+                versions[rel_resource.model] = rel_resource.model.fields_version()
+        return versions
+
+    def _sort_fields(self) -> frozenset:
+        sort_fields = set(self.model.__fields__)
+        for rel_name, rel_resource in self.rel_resources.items():
+            if rel_resource and rel_resource.model:
+                sort_fields.update(rel_name + '.' + field for field in rel_resource.model.__fields__)
+        return frozenset(sort_fields)
+
+    def _include_paths(self) -> frozenset:
+        return relationship_graph.include_paths(self.resource_model, self.max_include_depth)
+
+    def _type_fields(self) -> dict:
+        type_fields = {}
+
+        def add(resource):
+            if not resource or not resource.model or resource.Meta.type_ in type_fields:
+                return
+            fields = set(resource.model.response_fields())
+            fields.update(resource.rel_resources())
+            type_fields[resource.Meta.type_] = frozenset(fields)
+
+        add(self.resource_model)
+        for path in self.include_paths:
+            add(relationship_graph.resolve(self.resource_model, path))
+        return type_fields
+
+    def is_stale(self) -> bool:
+        """模型字段是否已被修改"""
+        for model, version in self.versions.items():
+            if model.fields_version() != version:
+                return True
+        return False
+
+
+class ArgsCache(object):
+    """
+    解析后的查询参数缓存（LRU），键为接口和规范化后的查询字符串，值为不可修改的参数模板
+        Args:
+            maxsize: 最大缓存条数，为0时不缓存
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    @staticmethod
+    def make_key(request: Request) -> tuple:
+        """
+        缓存键。按参数名排序，同名参数(如多个filter)保持原有顺序
+        Args:
+            request: 请求
+        Returns: (接口方法, 查询参数)
+        """
+        query_items = sorted(request.query_params.multi_items(), key=lambda item: item[0])
+        return request.scope.get('endpoint'), tuple(query_items)
+
+    def get(self, key) -> Optional[ArgsModel]:
+        """取参数模板，命中时返回复制的参数"""
+        if not self.maxsize:
+            return None
+        template = self._cache.get(key)
+        if template is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._cache.move_to_end(key)
+        return template.copy()
+
+    def put(self, key, args: ArgsModel) -> None:
+        """保存参数模板，超过最大条数时删除最久未使用的"""
+        if not self.maxsize:
+            return
+        self._cache[key] = args.copy()
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self) -> dict:
+        """命中信息，用于调整缓存大小"""
+        return {'hits': self.hits, 'misses': self.misses, 'maxsize': self.maxsize, 'currsize': len(self._cache)}
+
+
+class TTLCache(object):
+    """
+    LRU + 过期时间的缓存，用于不需要实时准确的结果，如总条数、关系接口中父资源的关系ids
+        Args:
+            ttl: 过期秒数，为0时不缓存
+            maxsize: 最大缓存条数
+    """
+
+    def __init__(self, ttl: float = 60, maxsize: int = 256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+
+    def get(self, key) -> Any:
+        """取值，没有或已过期时返回None"""
+        if not self.ttl:
+            return None
+        item = self._cache.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return value
+
+    def put(self, key, value: Any, ttl: float = None) -> None:
+        """
+        保存值，None不缓存
+        Args:
+            key: 键
+            value: 值
+            ttl: 本条的过期秒数，不超过缓存的ttl，小于等于0时不缓存
+        """
+        ttl = self.ttl if ttl is None else min(self.ttl, ttl)
+        if not self.ttl or ttl <= 0 or value is None:
+            return
+        self._cache[key] = (value, time.monotonic() + ttl)
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def discard(self, predicate) -> None:
+        """删除键满足条件的缓存"""
+        for key in [key for key in self._cache if predicate(key)]:
+            del self._cache[key]
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+# 资源类和查询计划的映射
+query_plans = {}  # type: Dict[Any, QueryPlan]
+
+
+def get_query_plan(resource_model) -> QueryPlan:
+    """
+    获取资源的查询计划，不存在或已过期时生成
+    Args:
+        resource_model: 资源类
+    Returns: QueryPlan
+    """
+    plan = query_plans.get(resource_model)
+    if plan is None or plan.is_stale():
+        plan = QueryPlan(resource_model)
+        query_plans[resource_model] = plan
+    return plan
+
+
 class ArgParse(object):
 
     """参数解析和验证
@@ -302,18 +649,24 @@ class ArgParse(object):
     def __init__(self, resource_model):
         self.resource_model = resource_model
         self.model = resource_model.model
-        self.rel = resource_model.rel_resources()
-        self.res_filter = resource_model.filter_model()
+        self.plan = get_query_plan(resource_model)
+        self.rel = self.plan.rel
+        self.res_filter = self.plan.filter_model
         self.list_warnings = []  # warning 类信息。
         self.args = ArgsModel()
 
     def _verify_arg(self, request):
         # 验证查询参数
-        full_arg = get_default_args(request.scope.get('endpoint'))
-        query_params = list(request.query_params.keys())  # 获取前端查询参数
-        for param in query_params:
-            if param not in full_arg:  # 判断是否在接口参数内
-                raise QureyError(detail='参数 [%s] 错误' % param)
+        endpoint = request.scope.get('endpoint')
+        full_arg = getattr(endpoint, 'query_params', None)  # 注册路由时已计算
+        if full_arg is None:
+            full_arg = get_query_params(endpoint)
+        unknown = request.query_params.keys() - full_arg  # 不在接口参数内的参数
+        if 'fields' in full_arg:  # 稀疏字段 fields[type]
+            unknown = {param for param in unknown if not param.startswith('fields[')}
+        if unknown:
+            param = next(param for param in request.query_params.keys() if param in unknown)
+            raise QureyError(detail='参数 [%s] 错误' % param)
         return True
 
     async def _parse_rel_filter(self, filter: Filter):
@@ -445,30 +798,14 @@ class ArgParse(object):
                 else:
                     asc = True
 
-                if '.' in sort:
-                    # relsort = True
-                    if sort.count('.') > 1:
-                        raise QureyError(
-                            detail='只支持主资源属性排序和主资源的关系属性排序')
-
-                    rel_name, rel_field = sort.split('.')
-                    if rel_name not in self.rel:
-                        raise QureyError(
-                            detail='字段不存在，%s不能作为排序参数' %
-                                   (sort))
-                    rel_resource = registered_resources.get(self.rel[rel_name].rel_resource)
-                    if rel_field not in rel_resource.model.__fields__:
-                        raise QureyError(
-                            detail='字段不存在，%s不能作为排序参数' %
-                                   (sort))
-                    else:
-                        sortby.append(Sort(field=sort, asc=asc))
-                else:
-                    if sort not in self.model.__fields__:
-                        raise QureyError(
-                            detail='字段不存在，%s不能作为排序参数' %
-                                   (sort))
-                    sortby.append(Sort(field=sort, asc=asc))
+                if sort.count('.') > 1:
+                    raise QureyError(
+                        detail='只支持主资源属性排序和主资源的关系属性排序')
+                if sort not in self.plan.sort_fields:
+                    raise QureyError(
+                        detail='字段不存在，%s不能作为排序参数' %
+                               (sort))
+                sortby.append(Sort(field=sort, asc=asc))
             # if relsort:
             #     self.args.relsort = sortby
             # else:
@@ -485,6 +822,8 @@ class ArgParse(object):
         Returns:
             None
          """
+        if 'page[cursor]' in request.query_params:
+            raise QureyError(detail='不支持游标分页page[cursor]')
         offset_params = request.query_params.get(
             'page[offset]', self.resource_model.offset)
         limit_parmas = request.query_params.get(
@@ -510,6 +849,49 @@ class ArgParse(object):
 
         return (self.args.skip, self.args.limit)
 
+    def verify_cursor(self, request) -> Cursor:
+        """游标分页解析验证，按排序字段和id定位，get_many多取一条用于判断是否有下一页
+        Args:
+            request: 响应
+        Returns:
+            Cursor
+        """
+        if 'page[offset]' in request.query_params:
+            raise QureyError(detail='游标分页不支持page[offset]')
+        limit = request.query_params.get('page[limit]', self.resource_model.limit)
+        try:
+            limit = int(limit)
+        except BaseException:
+            raise QureyError(detail='page[limit] 必须为数值型整数')
+        sort = self.args.sort or [Sort(field='id', asc=True)]
+        for item in sort:
+            if '.' in item.field:
+                raise QureyError(detail='游标分页只支持主资源属性排序')
+        cursor = Cursor(sort=sort, limit=limit)
+
+        token = request.query_params.get('page[cursor]')
+        if token:
+            payload = decode_cursor(token, cursor_secret(self.resource_model), self.resource_model.Meta.type_)
+            if payload.get('s') != cursor.sort_key() or len(payload.get('v') or ()) != len(sort):
+                raise QureyError(detail='page[cursor] 与排序参数不一致')
+            values = []
+            for item, value in zip(sort, payload['v']):
+                field = self.model.__fields__.get(item.field)
+                if field is not None and value is not None:  # 按模型字段类型还原，如datetime
+                    value, error = field.validate(value, {}, loc=item.field)
+                    if error:
+                        raise QureyError(detail='page[cursor] 无效')
+                values.append(value)
+            cursor.values = values
+            cursor.before = bool(payload.get('b'))
+            if cursor.before:  # 上一页倒序取数，响应时恢复正序
+                self.args.sort = [Sort(field=item.field, asc=not item.asc) for item in sort]
+
+        self.args.cursor = cursor
+        self.args.skip = 0
+        self.args.limit = limit + 1
+        return cursor
+
     def _verify_fields(self, request) -> None:
         """稀疏字段 解析验证
         Args:
@@ -517,21 +899,31 @@ class ArgParse(object):
         Returns:
             None
         """
-        # self.args['fields'] = dict()
-        fields = {}
+        # 支持 fields[type]=a,b 和 deepobject形式的 fields=type=a,b
+        fields_params_dict = {}
         fields_params_str = request.query_params.get('fields')
         if fields_params_str:
-            fields_params_dict = query_parse(fields_params_str)
-            for obj, field in fields_params_dict.items():
-                fields_list = field.split(',')
-                model = self.res.get(obj)
-                if not model:
-                    raise QureyError(detail='资源不存在：%s ' % (obj))
-                for field in fields_list:
-                    if not model.__fields__.get(field, None):
-                        raise QureyError(detail='资源字段不存在：%s.%s' %
-                                         (obj, field))
-                fields[obj] = fields_list
+            try:
+                fields_params_dict.update(query_parse(fields_params_str))
+            except Exception as e:
+                raise QureyError(detail='参数解析失败,%s' % e)
+        for param, value in request.query_params.items():
+            if param.startswith('fields[') and param.endswith(']'):
+                fields_params_dict[param[len('fields['):-1]] = value
+
+        fields = {}
+        for obj, field in fields_params_dict.items():
+            if not isinstance(field, str):
+                raise QureyError(detail='稀疏字段格式错误：%s' % (obj))
+            fields_list = [item for item in field.split(',') if item]
+            type_fields = self.plan.type_fields.get(obj)
+            if type_fields is None:
+                raise QureyError(detail='资源不存在：%s ' % (obj))
+            for field in fields_list:
+                if field not in type_fields:
+                    raise QureyError(detail='资源字段不存在：%s.%s' %
+                                     (obj, field))
+            fields[obj] = fields_list
         self.args.fields = fields
 
     def verify_include(self, request) -> tuple:
@@ -547,28 +939,10 @@ class ArgParse(object):
                 include_params_str.replace(
                     '-', '_').split(','))
             for include in include_fields:
-                rel_name_list = include.split('.')
-                if len(rel_name_list) > 3:
+                if include.count('.') >= self.plan.max_include_depth:
                     raise QureyError(
                         detail='include 最深支持 3层 关系查询')
-
-                if rel_name_list[0] not in self.rel:
-                    raise QureyError(
-                        detail='include 参数 %s 不存在' % (include))
-                if len(rel_name_list) == 1:
-                    continue
-
-                rel_resource = registered_resources.get(self.rel[rel_name_list[0]].rel_resource)
-                relrel_source = rel_resource.rel_resources()
-                if rel_name_list[1] not in relrel_source:
-                    raise QureyError(
-                        detail='include 参数 %s 不存在' % (include))
-                if len(rel_name_list) == 2:
-                    continue
-
-                relrel_resource = registered_resources.get(relrel_source[rel_name_list[1]].rel_resource)
-                relrelrel_source = relrel_resource.rel_resources()
-                if rel_name_list[2] not in relrelrel_source:
+                if include not in self.plan.include_paths:
                     raise QureyError(
                         detail='include 参数 %s 不存在' % (include))
 
@@ -588,28 +962,10 @@ class ArgParse(object):
                 params_str.replace(
                     '-', '_').split(','))
             for q_data in q_data_fields:
-                rel_name_list = q_data.split('.')
-                if len(rel_name_list) > 3:
+                if q_data.count('.') >= self.plan.max_include_depth:
                     raise QureyError(
                         detail='include 最深支持 3层 关系查询')
-
-                if rel_name_list[0] not in self.rel:
-                    raise QureyError(
-                        detail='include 参数 %s 不存在' % (q_data))
-                if len(rel_name_list) == 1:
-                    continue
-
-                rel_resource = registered_resources.get(self.rel[rel_name_list[0]].rel_resource)
-                relrel_source = rel_resource.rel_resources()
-                if rel_name_list[1] not in relrel_source:
-                    raise QureyError(
-                        detail='include 参数 %s 不存在' % (q_data))
-                if len(rel_name_list) == 2:
-                    continue
-
-                relrel_resource = registered_resources.get(relrel_source[rel_name_list[1]].rel_resource)
-                relrelrel_source = relrel_resource.rel_resources()
-                if rel_name_list[2] not in relrelrel_source:
+                if q_data not in self.plan.include_paths:
                     raise QureyError(
                         detail='include 参数 %s 不存在' % (q_data))
 
@@ -617,16 +973,26 @@ class ArgParse(object):
         return self.args.q_data
 
     async def get_args(self, request: Request) -> ArgsModel:
+        # 相同的查询参数直接使用缓存，跳过解析和验证
+        cache_key = self.plan.args_cache.make_key(request)
+        args = self.plan.args_cache.get(cache_key)
+        if args is not None:
+            return args
+
         self.args_default = {}   # 参数默认值
         if not self._verify_arg(request):  # 验证查询参数
             return self.args
         await self.verify_filter(request)  # 验证filter参数
         self.verify_sortby(request)
-        self.verify_page(request)
+        if getattr(self.resource_model, 'cursor_pagination', False):
+            self.verify_cursor(request)
+        else:
+            self.verify_page(request)
         self._verify_fields(request)
         self.verify_include(request)
         self.verify_data(request)
 
+        self.plan.args_cache.put(cache_key, self.args)
         return self.args
 
 
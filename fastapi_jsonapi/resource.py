@@ -2,31 +2,62 @@
 # -*- coding: utf-8 -*-
 import os
 import json
+import copy
+import time
+import hashlib
+import inspect
+import asyncio
+import itertools
 from collections import defaultdict
-from typing import Any, Dict, List, Optional, Type, Union
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Type, Union
 from pydantic import create_model
 from treelib import Tree
 from fastapi import FastAPI, APIRouter, Query, Request, Path, Body, Form, UploadFile, File, Response
+from fastapi.responses import StreamingResponse
 from fastapi.exceptions import RequestValidationError, ValidationError
-from fastapi_jsonapi.meta import RegisteredResourceMeta, registered_resources
-from fastapi_jsonapi.exception import serialize_error, ResourceNotFound, QureyError, JsonapiException
+from starlette.routing import BaseRoute, Match, NoMatchFound
+from fastapi_jsonapi.meta import RegisteredResourceMeta, registered_resources, relationship_graph
+from fastapi_jsonapi.exception import serialize_error, ResourceNotFound, QureyError, JsonapiException, \
+    PreconditionFailed
 from fastapi_jsonapi.schema import SchemaBase, Relationship, CreatModel
 from fastapi_jsonapi.jsonapi import JsonApiModel, RelationshipModel, JsonapiAdapter
 from fastapi_jsonapi.responses import JsonapiResponse
 from fastapi_jsonapi.filter import create_filter_model
-from fastapi_jsonapi.query import ArgParse, ArgsModel
-from fastapi_jsonapi.util import InferInfo, SessionMangerBase
-from fastapi_jsonapi.auth import User, SecurityConfig
+from fastapi_jsonapi.query import ArgParse, ArgsModel, Cursor, get_query_plan, encode_cursor, cursor_secret
+from fastapi_jsonapi.util import InferInfo, SessionMangerBase, SessionPool, IdentityMap, get_query_params, \
+    expand_lazy_routes, session_scope, parse_etags
+from fastapi_jsonapi.auth import User, SecurityConfig, current_user
+from fastapi_jsonapi.cache import CacheBackend, cache_backends, invalidate, tag
+
+# 资源生成模型和路由的耗时(秒) {"资源类名"：耗时}
+build_times = {}
 
 
 class _BaseApiHandler:
-    # 支持的接口方法。
-    methods = {'GET', 'GETS', 'PATCH', 'POST', 'DELETE', 'ATOMIC'}
+    # 支持的接口方法。原子操作接口需在资源的methods中加入'ATOMIC'开启
+    methods = {'GET', 'GETS', 'PATCH', 'POST', 'DELETE'}
     relapi = True  # 是否有关系接口
     versions = {}  # 全部版本
     version = 1  # 当前版本
     required = []
     allow_all_pages = False  # 是否支持page[limit]=null, 获取全部数据
+    args_cache_size = 256  # 解析后查询参数的缓存条数, 为0时不缓存
+    trusted_rows = False  # get_many等返回的数据已是验证过的模型数据，序列化attribute时不再验证
+    include_concurrency = None  # include同一层关系并发取数的最大数量, 为0时不限制。未配置时会话为SessionPool才并发取数，单例会话逐个取数
+    concurrent_count = False  # 列表接口count与get_many并发执行，各自获取session。count使用get_many执行前的查询参数，需要数据库支持并发会话
+    count_mode = 'exact'  # 总条数计算方式：exact 每次count; estimate 优先用estimate_count; cached 按过滤条件和用户缓存count
+    count_cache_ttl = 60  # count_mode为cached时，总条数缓存的过期秒数
+    related_ids_ttl = 0  # 关系接口(/{id}/rel_name)中父资源关系ids的缓存秒数，翻页时不再查询父资源，为0时不缓存
+    prerender_response = False  # 直接返回渲染好的JsonapiResponse，跳过fastapi响应模型验证，openapi不变
+    skip_response_model = False  # 本次请求的响应不经过响应模型(预渲染、响应缓存、ETag、流式输出)，由接口方法设置
+    cursor_pagination = False  # 游标分页page[cursor]替代page[offset]，get_many需使用args.cursor.filter()定位
+    cursor_secret = None  # 游标签名密钥，未配置时使用环境变量JSONAPI_CURSOR_SECRET，都未配置时注册路由抛出异常
+    stream_chunk_size = 500  # get_many为异步生成器且page[limit]=null时流式输出，每批序列化的条数
+    response_cache: CacheBackend = None  # 响应缓存后端，设置后GET接口的响应直接渲染并缓存，写操作后按标签失效
+    response_cache_ttl = 60  # 响应缓存的过期秒数
+    response_cache_per_user = True  # 响应缓存和count缓存是否按用户区分。get_many不按用户过滤时可设为False，相同scope的用户共用缓存
+    etag = False  # GET响应带ETag，If-None-Match匹配时返回304；patch/delete支持If-Match，需实现data_version钩子，没有版本时不验证If-Match
 
     def __init__(
             self,
@@ -95,6 +126,44 @@ class _BaseApiHandler:
         else:
             return response
 
+    @classmethod
+    def prerender(cls, request: Request, response) -> JsonapiResponse:
+        """
+        渲染响应，fastapi收到Response后不再验证和编码响应模型
+        Args:
+            request: 请求
+            response: jsonapi 数据
+
+        Returns: JsonapiResponse
+
+        """
+        endpoint = request.scope.get('endpoint') if request else None
+        status_code = getattr(endpoint, 'status_code', None) or 200  # 注册路由时记录
+        return JsonapiResponse(content=response, status_code=status_code)
+
+    @classmethod
+    def with_etag(cls, request: Request, response, etag: str = None) -> Response:
+        """
+        响应加上ETag，If-None-Match匹配时返回304
+        Args:
+            request: 请求
+            response: jsonapi 数据或已渲染的响应
+            etag: data_version钩子生成的ETag，为None时按响应内容计算
+
+        Returns: Response
+        """
+        if not isinstance(response, Response):
+            response = cls.prerender(request, response)
+        if response.status_code != 200:
+            return response
+        if etag is None:
+            etag = '"%s"' % hashlib.blake2b(response.body, digest_size=16).hexdigest()
+        if_none_match = parse_etags(request.headers.get('if-none-match'))
+        if etag in if_none_match or '*' in if_none_match:
+            return Response(status_code=304, headers={'ETag': etag})
+        response.headers['ETag'] = etag
+        return response
+
     @classmethod
     async def _version(cls, request) -> int:
         # TODO
@@ -129,6 +198,11 @@ class _BaseApiHandler:
             args = ArgsModel()
         return args
 
+    @classmethod
+    def args_cache_info(cls) -> dict:
+        """查询参数缓存的命中信息"""
+        return get_query_plan(cls).args_cache.info()
+
     @classmethod
     async def handle_request(
             cls,
@@ -139,6 +213,7 @@ class _BaseApiHandler:
             extract_params: dict = None,
             request_context: dict = None,
             query_args: ArgsModel = None,
+            cache_tags: tuple = None,
             *args,
             **kwargs):
         """
@@ -151,6 +226,7 @@ class _BaseApiHandler:
             extract_params:
             request_context:
             query_args: 查询参数
+            cache_tags: 响应缓存的额外标签，默认为路径中id对应的资源
             *args:
             **kwargs:
 
@@ -167,38 +243,70 @@ class _BaseApiHandler:
         except BaseException as before_request_exc:
             response: JsonapiResponse = await cls.handle_error(request, exc=before_request_exc)
         else:
-            try:
-                # 选择版本
-                request_resource = await cls._get_version(request)
-
-                # 接口方法运行
-                # if request and request.method not in cls.methods and not (
-                #         request.method == 'GET' and 'GETS' in cls.methods):
-                #     raise JsonapiException(status_code=405, title='接口没有%s访问方法' % request.method)
-
-                if query_args:
-                    query_args = query_args
-                else:
-                    query_args = await cls._prase_args(request=request)
-                resource = request_resource(
-                    request=request,
-                    request_context=request_context,
-                    extract_params=extract_params,
-                    query_args=query_args,
-                    *args,
-                    **kwargs)
-
-                data_func = getattr(resource, handler_data)
-                # data = await data_func(*args, **kwargs)  # 获取数据
-                data = await resource.connect_data(func=data_func, *args, **kwargs)
-                handle_res = getattr(resource, handler_response)  # 转换jsonapi 的方法
-                response = await handle_res(data)  # json:api 通过fastapi的response_model转换成response json
-                # response = await cls.handle_response(response, response_model)
-                del resource
-                del data
-
-            except BaseException as e:
-                response: JsonapiResponse = await cls.handle_error(request, exc=e)
+            async with session_scope():  # 一次请求内各connect_data复用数据库会话
+                try:
+                    # 选择版本
+                    request_resource = await cls._get_version(request)
+
+                    # 接口方法运行
+                    # if request and request.method not in cls.methods and not (
+                    #         request.method == 'GET' and 'GETS' in cls.methods):
+                    #     raise JsonapiException(status_code=405, title='接口没有%s访问方法' % request.method)
+
+                    if query_args:
+                        query_args = query_args
+                    else:
+                        query_args = await cls._prase_args(request=request)
+                    resource = request_resource(
+                        request=request,
+                        request_context=request_context,
+                        extract_params=extract_params,
+                        query_args=query_args,
+                        *args,
+                        **kwargs)
+
+                    data_func = getattr(resource, handler_data)
+                    use_etag = cls.etag and handler_data == 'get_many' and request is not None \
+                        and request.method == 'GET'
+                    etag = await resource.precondition(handler_data)  # If-Match不一致时抛出PreconditionFailed
+                    not_modified = etag is not None and etag in parse_etags(request.headers.get('if-none-match'))
+                    cache_key = None if not_modified else resource.response_cache_key(handler_data)
+                    resource.skip_response_model = bool(cache_key) or cls.prerender_response or use_etag
+                    cached = await cls.response_cache.get(cache_key) if cache_key else None
+                    if not_modified:  # 版本未变化，不再取数和序列化
+                        response = Response(status_code=304, headers={'ETag': etag})
+                    elif cached is not None:  # 命中响应缓存
+                        response = Response(content=cached['body'], status_code=cached['status_code'],
+                                            media_type=JsonapiResponse.media_type)
+                    elif inspect.isasyncgenfunction(data_func) and handler_response == 'handler_many_data' \
+                            and resource.args.limit is None:  # 全部数据，流式输出
+                        response = resource.stream_response(data_func, *args, **kwargs)
+                    else:
+                        if inspect.isasyncgenfunction(data_func):
+                            data_func = resource.collector(data_func)
+                        if handler_response == 'handler_many_data' and resource.concurrent_count:
+                            resource.count_task = asyncio.ensure_future(resource.copy().total())  # 总条数与数据并发获取
+                        try:
+                            # data = await data_func(*args, **kwargs)  # 获取数据
+                            data = await resource.connect_data(func=data_func, *args, **kwargs)
+                            handle_res = getattr(resource, handler_response)  # 转换jsonapi 的方法
+                            response = await handle_res(data)  # json:api 通过fastapi的response_model转换成response json
+                            if cache_key and not isinstance(response, Response):
+                                response = await resource.cache_response(cache_key, response, cache_tags)
+                            elif cls.prerender_response and not isinstance(response, Response):
+                                response = cls.prerender(request, response)
+                            if handler_data in ('post', 'patch', 'delete'):
+                                await resource.invalidate_cache()
+                            # response = await cls.handle_response(response, response_model)
+                            del data
+                        finally:
+                            await cls.finish_task(resource.count_task)  # 出错时总条数任务也要结束并释放会话
+                        del resource
+                    if use_etag and not not_modified and not isinstance(response, StreamingResponse):
+                        response = cls.with_etag(request, response, etag)
+
+                except BaseException as e:
+                    response: JsonapiResponse = await cls.handle_error(request, exc=e)
         finally:
             # 运行接口方法后处理
             try:
@@ -208,6 +316,15 @@ class _BaseApiHandler:
         # gc.collect()
         return response
 
+    @staticmethod
+    async def finish_task(task: Optional[asyncio.Future]) -> None:
+        """结束并发任务：未完成的取消并等待退出(归还会话)，已完成的取出结果，避免未获取的异常警告"""
+        if task is None:
+            return
+        if not task.done():
+            task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
     @classmethod
     async def before_request(cls, request: Request = None, extract_params: dict = None):
         for res in cls.required:
@@ -233,7 +350,7 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
     # 默认版本。
     default_version = None
 
-    session: SessionMangerBase = None
+    session: Union[SessionMangerBase, SessionPool] = None  # SessionPool时，一次请求内复用会话
 
     # 关系
     class RelResources:
@@ -337,6 +454,8 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
             *args,
             **kwargs)
         self.db = None
+        self.identity_map = IdentityMap()  # 本次请求已获取的资源，include共享
+        self.count_task = None  # 与get_many并发执行的总条数任务
         # 查询参数
         if query_args:
             self.args = query_args
@@ -372,6 +491,29 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
         """获取查询参数"""
         return self.args
 
+    def sparse_fields(self) -> Optional[set]:
+        """当前资源类型请求的稀疏字段（属性和关系），没有请求稀疏字段时为None"""
+        if not self.args.fields or self.Meta.type_ not in self.args.fields:
+            return None
+        return set(self.args.fields[self.Meta.type_])
+
+    def select_fields(self) -> Optional[List[str]]:
+        """
+        get_many 需要从数据层查询的模型字段，数据层可据此只查询部分字段
+        Returns: 字段列表，包含id、请求的属性和全部关系的mapping_field; 没有请求稀疏字段时为None，查询全部字段
+        """
+        fields = self.sparse_fields()
+        if fields is None:
+            return None
+        select = ['id']
+        for name in self.model.__fields__:
+            if name in fields and name not in select:
+                select.append(name)
+        for rel in self.rel_resources().values():
+            if rel.mapping_field and rel.mapping_field not in select:
+                select.append(rel.mapping_field)  # 关系数据和include需要
+        return select
+
     def get_path(self):
         """当前资源的根路径"""
         return self.Meta.link
@@ -381,11 +523,23 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
         path_url = self.request.scope.get('path')
         return path_url
 
+    def path_id(self) -> Any:
+        """路径中本资源的id。关系资源接口(/{id}/rel_name)中的id是父资源的，为None"""
+        id_ = self.request.path_params.get('id') if self.request is not None else None
+        if id_ is None:
+            return None
+        path = self.request_path_url().rstrip('/')
+        if path.endswith('/%s' % id_) or '/%s/relationships/' % id_ in path:
+            return id_
+        return None
+
     def rel_request_method(self) -> tuple:
         """
         关系数据请求方法
         Returns: 关系，对应方法
         """
+        if self.extract_params and self.extract_params.get('atomic'):  # 原子操作中的关系操作
+            return (self.extract_params.get('rel_name'), self.extract_params.get('method'))
         path_url = self.request_path_url()
         if 'relationships' in path_url:  # 关系的增删改
             rel_name = path_url.split('/')[-1]
@@ -410,6 +564,13 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
     def filter_model(cls):
         """生成过滤模型"""
         filter_model_name = cls.__name__ + 'Filter'
+        return create_filter_model(
+            model_name=filter_model_name,
+            fields=cls.filter_fields())
+
+    @classmethod
+    def filter_fields(cls) -> Dict[str, type]:
+        """可过滤的字段及其类型，包含关系的id，如 user.id"""
         models = cls.rel_resources()
         fields = {}
         fields.update(cls.model.filter_fields())
@@ -426,22 +587,115 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
             #     # print(4444,rel_name + '.' + name, cls.model.__fields__.get(rel.mapping_field), value)
             #     value = cls.model.__fields__.get(rel.mapping_field)
             #     fields[rel_name + '.' + name] = value
-        return create_filter_model(
-            model_name=filter_model_name,
-            fields=fields)
-
-    async def connect_data(self, func, *args, **kwargs):
-        """取数"""
+        return fields
+
+    @asynccontextmanager
+    async def connect(self):
+        """取数期间持有数据库会话"""
+        if isinstance(self.session, SessionPool):
+            async with self.session.session() as db:
+                self.db = db
+                yield db
+            return
         try:
             # session 等于 None  无需在数据库取数
             if self.session:
                 self.db = self.session.get()
-            data = await func(*args, **kwargs)
-            return data
+            yield self.db
         finally:
             if self.session:
                 self.session.close()
 
+    async def connect_data(self, func, *args, **kwargs):
+        """取数"""
+        async with self.connect():
+            return await func(*args, **kwargs)
+
+    @staticmethod
+    def collector(func):
+        """异步生成器的取数方法转为返回列表"""
+        async def collect(*args, **kwargs) -> list:
+            return [data async for data in func(*args, **kwargs)]
+        return collect
+
+    async def chunks(self, datas) -> AsyncIterator[list]:
+        """异步生成器的数据按stream_chunk_size分批"""
+        chunk = []
+        async for data in datas:
+            chunk.append(data)
+            if len(chunk) >= self.stream_chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def stream_response(self, func, *args, **kwargs) -> StreamingResponse:
+        """
+        流式响应。请求头Accept为application/x-ndjson时每行一个资源对象，否则为data数组流式输出的jsonapi文档
+        Args:
+            func: 异步生成器的get_many
+
+        Returns: StreamingResponse
+        """
+        ndjson = 'application/x-ndjson' in (self.request.headers.get('accept') or '') if self.request else False
+        return StreamingResponse(self.stream_data(func, ndjson, *args, **kwargs),
+                                 media_type='application/x-ndjson' if ndjson else JsonapiResponse.media_type)
+
+    async def stream_data(self, func, ndjson: bool = False, *args, **kwargs) -> AsyncIterator[bytes]:
+        """
+        分批序列化并输出，内存占用只与每批条数有关。included在各批之间去重，
+        jsonapi文档中included放在data之后输出
+        Args:
+            func: 异步生成器的get_many
+            ndjson: 是否每行一个资源对象
+
+        Returns: 编码后的字节
+        """
+        encode = JsonapiResponse.encoder
+        rels = self.rel_resources()
+        serialized = set()  # 已输出的included
+        included = []  # jsonapi文档的included，已编码
+        self.skip_response_model = True
+        async with session_scope():  # 流式输出在请求处理结束后进行，单独获取会话
+            count_task = asyncio.ensure_future(self.copy().total()) if self.concurrent_count else None
+            try:
+                async with self.connect():
+                    if not ndjson:
+                        yield b'{"data":['
+                    first = True
+                    async for chunk in self.chunks(func(*args, **kwargs)):
+                        self.identity_map = IdentityMap()  # 每批重新建立，只保留已输出的included
+                        self.identity_map.serialized = serialized
+                        api_datas = await self.serialize_api(datas=chunk, rels=rels, include=self.args.include,
+                                                             q_data=self.args.q_data)
+                        lines = [encode(api_data) for api_data in api_datas]
+                        if self.args.include:
+                            chunk_included = [encode(item) for item in await self.serialize_include(
+                                datas=chunk, rels=rels, include_res=self.args.include, q_data=self.args.q_data)]
+                            if ndjson:
+                                lines.extend(chunk_included)
+                            else:
+                                included.extend(chunk_included)
+                        if ndjson:
+                            yield b''.join(line + b'\n' for line in lines)
+                        elif lines:
+                            yield (b'' if first else b',') + b','.join(lines)
+                            first = False
+                if ndjson:
+                    return
+                count = await count_task if count_task else await self.total()
+                meta = {}
+                if count:
+                    meta.update(await JsonapiAdapter.pagination(total=count, limit=None, offset=self.args.skip))
+                if self.args.warings:
+                    meta.update({'filter_warings': self.args.warings})
+                tail = b']'
+                if self.args.include:
+                    tail += b',"included":[' + b','.join(included) + b']'
+                yield tail + b',"meta":' + encode(meta) + b'}'
+            finally:
+                await self.finish_task(count_task)
+
     async def get_many(self, *args, **kwargs) -> List['model']:
         # 资源集合数据
         pass
@@ -462,6 +716,118 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
         # 删除
         pass
 
+    async def post_many(self, operations: list) -> Optional[List['model']]:
+        # 批量新增，原子操作中连续的新增一次调用，operations[i].data为新增数据，返回None时逐个调用post
+        return None
+
+    async def patch_many(self, operations: list) -> Optional[List['model']]:
+        # 批量更新，operations[i].data.id为资源id，返回None时逐个调用patch
+        return None
+
+    async def delete_many(self, operations: list) -> Optional[list]:
+        # 批量删除，operations[i].ref.id为资源id，返回None时逐个调用delete
+        return None
+
+    async def atomic_begin(self):
+        # 原子操作开始，如开启事务。全部操作使用同一个self.db
+        pass
+
+    async def atomic_commit(self):
+        # 原子操作全部成功，如提交事务
+        pass
+
+    async def atomic_rollback(self):
+        # 原子操作失败，如回滚事务
+        pass
+
+    def atomic_resources(self) -> dict:
+        """原子操作可以操作的资源 {"资源type"：资源类}，本资源和关系资源"""
+        resources = {target.Meta.type_: target for target in relationship_graph.targets(self.__class__).values()
+                     if target is not None}
+        resources[self.Meta.type_] = self.__class__
+        return resources
+
+    def operation_key(self, operation) -> tuple:
+        """
+        原子操作的分组依据
+        Args:
+            operation: 原子操作
+
+        Returns: (资源类, 操作方法, 接口方法, 关系名)
+        """
+        op = getattr(operation.op, 'value', operation.op)
+        ref = getattr(operation, 'ref', None)
+        rel_name = getattr(ref, 'relationship', None)
+        type_ = ref.type if ref is not None else operation.data.type
+        resource = self.atomic_resources().get(type_)
+        if resource is None:
+            raise QureyError(detail='原子操作不支持资源 %s' % type_)
+        method = {'add': 'POST', 'update': 'PATCH', 'remove': 'DELETE'}[op]
+        if rel_name:  # 与关系接口相同，由patch处理
+            return resource, 'patch', method, rel_name
+        return resource, {'POST': 'post', 'PATCH': 'patch', 'DELETE': 'delete'}[method], method, None
+
+    @staticmethod
+    def operation_id(operation) -> Any:
+        """原子操作的资源id，新增时可能没有"""
+        ref = getattr(operation, 'ref', None)
+        if ref is not None:
+            return ref.id
+        return getattr(getattr(operation, 'data', None), 'id', None)
+
+    def operation_resource(self, resource, method: str, rel_name: str = None, operation=None) -> 'BaseResource':
+        """
+        执行原子操作的资源实例，与本实例共用db。request_body为操作，资源id在request_context中
+        """
+        request_context = {'request_body': operation}
+        id_ = self.operation_id(operation) if operation is not None else None
+        if id_ is not None:
+            request_context['id'] = id_
+        obj = resource(request=self.request, request_context=request_context, host=self.host,
+                       extract_params={'atomic': True, 'method': method, 'rel_name': rel_name})
+        obj.db = self.db
+        return obj
+
+    async def atomic(self, *args, **kwargs) -> list:
+        """
+        执行原子操作。连续的同资源、同操作合并调用post_many/patch_many/delete_many，未实现时逐个执行，
+        全部操作在connect_data的同一个会话中，任一操作失败时回滚
+        Returns: [(资源实例, 操作方法, 结果)]
+        """
+        groups = [(key, list(group)) for key, group in
+                  itertools.groupby(self.request_body.operations, key=self.operation_key)]
+        for resource, handler, method, rel_name in {key for key, _ in groups}:  # 各操作的接口权限
+            auth = resource.Auth or self.Auth
+            if auth:
+                api_url = resource.Meta.link + ('' if method == 'POST' and not rel_name else '/{id}')
+                await auth.authorize(self.request, api_url + ('/relationships/%s' % rel_name if rel_name else ''),
+                                     method)
+        results = []
+        written = defaultdict(set)  # {资源类: {资源id}}
+        await self.atomic_begin()
+        try:
+            for (resource, handler, method, rel_name), operations in groups:
+                datas = None
+                if not rel_name:
+                    bulk = self.operation_resource(resource, method)
+                    datas = await getattr(bulk, handler + '_many')(operations)
+                    if datas is not None:
+                        results.extend((bulk, handler, data) for data in
+                                       (datas if handler != 'delete' else [None] * len(operations)))
+                if datas is None:
+                    for operation in operations:
+                        obj = self.operation_resource(resource, method, rel_name, operation)
+                        results.append((obj, handler, await getattr(obj, handler)()))
+                written[resource].update(self.operation_id(operation) for operation in operations
+                                         if self.operation_id(operation) is not None)
+            await self.atomic_commit()
+        except BaseException:
+            await self.atomic_rollback()
+            raise
+        for resource, ids in written.items():
+            await self.operation_resource(resource, 'PATCH').invalidate_cache(ids=list(ids))
+        return results
+
     async def rel_post(self, *args, **kwargs) -> SchemaBase:
         # 新增关系
         pass
@@ -478,6 +844,48 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
         # 总条数
         pass
 
+    async def estimate_count(self, *args, **kwargs) -> Optional[int]:
+        # 估算的总条数，如数据库统计信息中的行数。count_mode为estimate时使用，返回None时仍然count
+        return None
+
+    def copy(self) -> 'BaseResource':
+        """复制资源实例，查询参数独立，db由connect_data单独获取，可与原实例并发取数"""
+        resource = copy.copy(self)
+        resource.args = self.args.copy()
+        resource.db = None
+        resource.count_task = None
+        return resource
+
+    async def total(self) -> int:
+        """
+        分页总条数，按count_mode计算
+        Returns: 总条数
+        """
+        if self.count_mode == 'estimate':
+            estimate = await self.connect_data(func=self.estimate_count)
+            if estimate is not None:
+                return estimate
+        if self.count_mode != 'cached':
+            return await self.connect_data(func=self.count)
+        count_cache = get_query_plan(self.__class__).count_cache
+        key = self.count_cache_key()
+        count = count_cache.get(key)
+        if count is None:
+            count = await self.connect_data(func=self.count)
+            count_cache.put(key, count)
+        return count
+
+    def count_cache_key(self) -> tuple:
+        """count_mode为cached时总条数的缓存键：过滤条件、路径(含路径参数)、用户scope、用户、cache_vary"""
+        user = self.user
+        return (
+            self.args.filter_key(),
+            self.request.url.path if self.request else None,
+            tuple(sorted(user.scope or ())) if user else None,
+            user.id if user and self.response_cache_per_user else None,
+            self.cache_vary(),
+        )
+
     @classmethod
     def use_get(cls, response_model):
         """get操作"""
@@ -485,6 +893,7 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
         async def wrapper(
                 request: Request = None,
                 id: Any = Path(..., ),
+                fields: str = Query(None),
                 include: str = Query(None),
                 _data: str = Query(None)
 
@@ -507,7 +916,8 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
         # filter = Query(None, properties=m_schema, filter=m_definitions)
         filter = Query(None)
         limit = Query(cls.limit, alias='page[limit]')
-        offset = Query(cls.offset, alias='page[offset]')
+        offset = Query(cls.offset, alias='page[offset]', include_in_schema=not cls.cursor_pagination)
+        cursor = Query(None, alias='page[cursor]', include_in_schema=cls.cursor_pagination)
         sortby = Query(cls.sortby)
 
         async def wrapper(
@@ -515,6 +925,7 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
                 filter: List[str] = filter,
                 page_offset: int = offset,
                 page_limit: Union[int, str] = limit,
+                page_cursor: str = cursor,
                 sort: str = sortby,
                 fields: str = Query(None),
                 include: str = Query(None),
@@ -589,15 +1000,18 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
     @classmethod
     def use_atomic_post(cls):
         """原子操作"""
-        requset_model = cls.schema_model.create_atomic_operation_model()
+        requset_model = cls.schema_model.create_atomic_operation_model(ops=cls.methods)
 
         async def wrapper(
                 request: Request = None,
                 request_body: requset_model = Body(..., media_type='application/vnd.api+json')
         ):
-            pass
-            # return await cls(request).post(request_body=request_body)
-            return
+            request_context = {'request_body': request_body}
+            response = await cls.handle_request(handler_data='atomic',
+                                                handler_response='handler_atomic',
+                                                request=request,
+                                                request_context=request_context)
+            return response
 
         return wrapper
 
@@ -612,6 +1026,7 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
     ):
         """
         默认取related数据的条件，默认取relationships数据的id.特殊实例重写此方法
+        mapping_field关系只需父资源的id和mapping_field，get_many可通过select_fields()只查询这些字段
         :param rel_class:
         :param id:
         :return:
@@ -619,26 +1034,39 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
 
         obj = cls(request_context={'id': id},
                   extract_params={'related': True, 'rel_name': rel_name, 'rel': rel_class}, host=host)
-        mdata = await obj.connect_data(func=obj.get_many)
-        if not mdata:
-            raise ResourceNotFound
         if rel_class.mapping_field:  # mapping_field中取条件
-            ids = mdata[0].__getattribute__(rel_class.mapping_field)
+            ids_cache = get_query_plan(cls).related_ids_cache
+            cache_key = (str(id), rel_name, request.headers.get('authorization') if request else None)
+            ids = ids_cache.get(cache_key)
+            if ids is None:
+                obj.args.fields = {cls.Meta.type_: [rel_class.mapping_field]}  # 只取标识
+                mdata = await obj.connect_data(func=obj.get_many)
+                if not mdata:
+                    raise ResourceNotFound
+                ids = mdata[0].__getattribute__(rel_class.mapping_field)
+                ids_cache.put(cache_key, ids)
             if ids is None:
                 return None
             else:
-                request_context = {'request_context': {'id': ids}}
+                request_context = {'request_context': {'id': list(ids) if isinstance(ids, list) else ids}}
                 return request_context
-        else:
-            cond_func = getattr(cls(), rel_class.cond_fun)
-            cond = cond_func(datas=mdata)
-            return cond
+        mdata = await obj.connect_data(func=obj.get_many)
+        if not mdata:
+            raise ResourceNotFound
+        if rel_class.batch_fun:
+            ids = await obj.batch_rel_ids(rel_name=rel_name, rel=rel_class, datas=mdata[:1])
+            return obj.batch_condition(ids, mdata[:1])
+        cond_func = getattr(cls(), rel_class.cond_fun)
+        cond = cond_func(datas=mdata)
+        return cond
 
     @classmethod
     def use_related(cls, rel_name, rel_class, response_model):
         """"""
         limit = Query(cls.limit, alias='page[limit]')
-        offset = Query(cls.offset, alias='page[offset]')
+        cursor_pagination = getattr(registered_resources.get(rel_class.rel_resource), 'cursor_pagination', False)
+        offset = Query(cls.offset, alias='page[offset]', include_in_schema=not cursor_pagination)
+        cursor = Query(None, alias='page[cursor]', include_in_schema=cursor_pagination)
         filter = Query(None)
         sortby = Query(cls.sortby)
 
@@ -646,14 +1074,20 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
                 request: Request = None,
                 id: Any = Path(..., ),
                 filter: List[str] = filter,
+                fields: str = Query(None),
                 include: str = Query(None),
                 _data: str = Query(None),
                 sort: str = sortby,
                 page_offset: int = offset,
                 page_limit: Union[int, str] = limit,
+                page_cursor: str = cursor,
         ):
             rel_resource = registered_resources.get(rel_class.rel_resource)
             host = request.base_url._url
+            async with session_scope():  # 父资源和关系资源的取数复用会话
+                return await related(request, id, rel_resource, host)
+
+        async def related(request, id, rel_resource, host):
             cond = await cls.related_cond(request=request, rel_name=rel_name, rel_class=rel_class, id=id, host=host)
 
             if not cond:
@@ -669,12 +1103,14 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
                                                                  response_model=response_model,
                                                                  handler_response=handler_response_method,
                                                                  request=request,
+                                                                 cache_tags=(tag(cls.Meta.type_, id),),  # 随父资源失效
                                                                  **cond)
                 else:
                     response = await rel_resource.handle_request(handler_data='get_many',
                                                                  response_model=response_model,
                                                                  handler_response=handler_response_method,
                                                                  request=request,
+                                                                 cache_tags=(tag(cls.Meta.type_, id),),  # 随父资源失效
                                                                  query_args=cond)
 
                 return response
@@ -785,10 +1221,171 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
 
         # data = await self.sort(data)
 
-        count = await self.connect_data(func=self.count)
+        if self.count_task:
+            count = await self.count_task
+        else:
+            count = await self.total()
+        if self.args.cursor:
+            data, links = self.cursor_page(data)
+            response = await self._jsonapi(data, self.rel_resources(), pages=count)
+            response['links'] = links
+            return response
         response = await self._jsonapi(data, self.rel_resources(), pages=count)
         return response
 
+    def cursor_page(self, data: List[SchemaBase]) -> tuple:
+        """
+        游标分页：去掉多取的一条，上一页恢复正序，生成上一页、下一页链接
+        Args:
+            data: get_many的数据，比每页条数多取一条
+        Returns: (当前页数据, links)
+        """
+        cursor = self.args.cursor
+        data = list(data or [])
+        has_more = len(data) > cursor.limit
+        data = data[:cursor.limit]
+        if cursor.before:
+            data.reverse()
+        has_next = True if cursor.before else has_more
+        has_prev = has_more if cursor.before else cursor.values is not None
+
+        links = {'self': self.page_url(self.request.query_params.get('page[cursor]'))}
+        if data:
+            first = [getattr(data[0], sort.field, None) for sort in cursor.sort]
+            last = [getattr(data[-1], sort.field, None) for sort in cursor.sort]
+        else:  # 空页时以请求的游标定位反方向
+            first = last = cursor.values
+        if has_next and last is not None:
+            links['next'] = self.page_url(self.encode_cursor(Cursor(sort=cursor.sort, values=last)))
+        if has_prev and first is not None:
+            links['prev'] = self.page_url(self.encode_cursor(Cursor(sort=cursor.sort, values=first, before=True)))
+        return data, links
+
+    def encode_cursor(self, cursor: Cursor) -> str:
+        """签名的游标字符串"""
+        payload = {'s': cursor.sort_key(), 'v': cursor.values, 'b': cursor.before}
+        return encode_cursor(payload, cursor_secret(self.__class__), self.Meta.type_)
+
+    def page_url(self, token: Optional[str]) -> str:
+        """当前请求替换page[cursor]后的链接"""
+        query = self.request.url.query
+        if token is not None:
+            query = self.request.url.include_query_params(**{'page[cursor]': token}).query
+        url = self.host[:-1] + self.request.scope.get('path')
+        return url + '?' + query if query else url
+
+    def response_cache_key(self, handler_data: str) -> Optional[str]:
+        """
+        响应缓存的键：资源、host、路径(含路径参数)、查询参数、用户、cache_vary
+        Args:
+            handler_data: 获取数据的方法，只缓存get_many
+
+        Returns: 不缓存时为None
+        """
+        if not self.response_cache or handler_data != 'get_many' or not self.request \
+                or self.request.method != 'GET':
+            return None
+        return self.Meta.type_ + ':' + hashlib.sha256(repr(self.request_variant()).encode('utf-8')).hexdigest()
+
+    def request_variant(self) -> tuple:
+        """同一资源不同的响应：host(响应中的链接)、路径(含路径参数)、查询参数、用户scope、用户、cache_vary"""
+        user = self.user
+        return (
+            self.host,
+            self.request.url.path,
+            self.args.cache_key(),
+            tuple(sorted(user.scope or ())) if user else None,
+            user.id if user and self.response_cache_per_user else None,
+            self.cache_vary(),
+        )
+
+    def cache_vary(self) -> Any:
+        """
+        响应还与哪些请求状态有关(如租户请求头)，返回值加入缓存键和ETag，需可repr
+        """
+        return None
+
+    async def data_version(self, id: Any = None) -> Optional[Any]:
+        """
+        资源版本钩子，用于ETag。如资源列表的max(uptime)和条数，单个资源的uptime，
+        include的关系资源需要一并体现在版本中。返回None时ETag按响应内容计算，patch/delete不验证If-Match
+        Args:
+            id: 路径中的资源id，资源列表时为None
+        """
+        return None
+
+    @staticmethod
+    def version_tag(version: Any) -> str:
+        return hashlib.blake2b(repr(version).encode('utf-8'), digest_size=8).hexdigest()
+
+    async def precondition(self, handler_data: str) -> Optional[str]:
+        """
+        条件请求。patch/delete验证If-Match，与data_version钩子的版本不一致时抛出PreconditionFailed。
+        data_version钩子返回None时，GET的ETag按响应内容计算，与请求参数有关，不能验证，If-Match不生效
+        Args:
+            handler_data: 获取数据的方法
+
+        Returns: GET时data_version钩子生成的ETag "版本.请求"，没有钩子时为None
+        """
+        if not self.etag or self.request is None or type(self).data_version is BaseResource.data_version:
+            return None  # 没有data_version钩子时不取版本，不占用会话
+        id_ = self.path_id()
+        if handler_data in ('patch', 'delete'):
+            if_match = parse_etags(self.request.headers.get('if-match'))
+            if if_match and '*' not in if_match:
+                version = await self.connect_data(func=self.data_version, id=id_)
+                versions = [etag.strip('"').split('.')[0] for etag in if_match]
+                if version is not None and self.version_tag(version) not in versions:
+                    raise PreconditionFailed(detail='If-Match与资源当前版本不一致')
+            return None
+        if handler_data != 'get_many' or self.request.method != 'GET':
+            return None
+        version = await self.connect_data(func=self.data_version, id=id_)
+        if version is None:
+            return None
+        variant = hashlib.blake2b(repr(self.request_variant()).encode('utf-8'), digest_size=8).hexdigest()
+        return '"%s.%s"' % (self.version_tag(version), variant)
+
+    async def cache_response(self, cache_key: str, response: dict, cache_tags: tuple = None) -> Response:
+        """
+        渲染并缓存响应。标签为响应中资源和included资源的 type:id，资源列表加上 type
+        Args:
+            cache_key: response_cache_key
+            response: jsonapi 数据
+            cache_tags: 额外的标签，默认为路径中id对应的资源
+
+        Returns: 渲染后的响应
+        """
+        rendered = self.prerender(self.request, response)
+        tags = set(cache_tags) if cache_tags is not None else set()
+        if cache_tags is None and 'id' in self.request.path_params:
+            tags.add(tag(self.Meta.type_, self.request.path_params['id']))
+        data = response.get('data')
+        if not isinstance(data, dict):  # 资源列表，同类型的新增、修改都会影响
+            tags.add(tag(self.Meta.type_))
+        items = data if isinstance(data, list) else [data] if data else []
+        for item in items + list(response.get('included') or []):
+            if isinstance(item, dict) and item.get('type'):
+                tags.add(tag(item['type'], item.get('id')))
+        await self.response_cache.set(cache_key, {'body': rendered.body, 'status_code': rendered.status_code},
+                                      ttl=self.response_cache_ttl, tags=tags)
+        return rendered
+
+    async def invalidate_cache(self, ids: list = None) -> None:
+        """
+        写操作后，使本资源列表和id对应资源的响应缓存、关系接口中缓存的关系ids失效
+        Args:
+            ids: 修改的资源id，默认路径中的id
+        """
+        if ids is None:
+            ids = [self.request.path_params['id']] if self.request is not None and 'id' in \
+                self.request.path_params else []
+        if cache_backends:
+            await invalidate([tag(self.Meta.type_)] + [tag(self.Meta.type_, id_) for id_ in ids])
+        if ids:
+            ids = {str(id_) for id_ in ids}
+            get_query_plan(self.__class__).related_ids_cache.discard(lambda key: key[0] in ids)
+
     async def handler_single_data(self, data: Union[List[SchemaBase], SchemaBase]) -> JsonApiModel:
         """
         单个资源jsonapi生成
@@ -829,6 +1426,23 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
 
         return response
 
+    async def handler_atomic(self, results: list) -> dict:
+        """
+        原子操作结果，删除操作为{}
+        Args:
+            results: atomic() 的结果
+
+        Returns: {"atomic:results": [{"data": 资源对象}]}
+        """
+        atomic_results = []
+        for resource, handler, data in results:
+            if handler == 'delete' or not data:
+                atomic_results.append({})
+            else:
+                response = await resource._jsonapi(data, resource.rel_resources())
+                atomic_results.append({'data': response['data']})
+        return {'atomic:results': atomic_results}
+
     async def handler_relationships(self, data: List[SchemaBase]) -> RelationshipModel:
         """
         生成关系数据， 对应接口  /articles/1/relationships/author
@@ -852,11 +1466,16 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
     @classmethod
     def rel_resources(cls) -> Dict[str, Relationship]:
         """
-        关系资源
+        关系资源，由关系图缓存，只读
         Args:
         Returns: 关系资源字典{"关系名"：Relationship对象}
 
         """
+        return relationship_graph.relationships(cls)
+
+    @classmethod
+    def scan_rel_resources(cls) -> Dict[str, Relationship]:
+        """扫描RelResources中的关系"""
         rel_resources = {}
         for item, rel in cls.RelResources.__dict__.items():
             if isinstance(rel, Relationship):
@@ -980,6 +1599,47 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
         """
         pass
 
+    async def batch_rel_ids(self, rel_name, rel, datas: List[SchemaBase]) -> dict:
+        """
+        batch_fun关系的关系ids。一次请求内按(资源类, 关系名, 父资源id)缓存，
+        关系标识符和include共用，每个关系只批量取一次
+        Args:
+            rel_name: 关系名
+            rel: Relationship
+            datas: 父资源数据
+
+        Returns: {父资源id(str): 关系ids}
+
+        """
+        batch = self.identity_map.batches.setdefault((self.__class__, rel_name), {})
+        missing = [data for data in datas if str(data.id) not in batch]
+        if missing:
+            loader = self.copy()  # include同一层并发取数，db独立
+            batch_func = getattr(loader, rel.batch_fun)
+            result = await loader.connect_data(batch_func, missing) or {}
+            result = {str(pid): ids for pid, ids in result.items()}
+            for data in missing:
+                batch[str(data.id)] = result.get(str(data.id))
+        return batch
+
+    @staticmethod
+    def batch_condition(batch: dict, datas: List[SchemaBase]) -> Optional[dict]:
+        """由batch_rel_ids的结果生成关系资源的查询条件，没有关系数据时为None"""
+        relid = []
+        for data in datas:
+            rel_ids = batch.get(str(data.id))
+            if rel_ids is not None:
+                relid.extend(rel_ids) if isinstance(rel_ids, list) else relid.append(rel_ids)
+        if not relid:
+            return None
+        return {'request_context': {'id': list(dict.fromkeys(relid))}}
+
+    def rel_identifier(self, type_, id_, meta) -> dict:
+        """资源标识符，没有meta时由identity_map共用"""
+        if meta is None:
+            return self.identity_map.identifier(type_, id_)
+        return {'type': type_, 'id': id_, 'meta': meta}
+
     async def serialize_identifier(self, data, rel_name, rel):
         rel_resource = registered_resources.get(rel.rel_resource)
         rel_type = rel_resource.Meta.type_
@@ -989,7 +1649,7 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
             resources = None
             if rel_ids is not None:
                 identifier_meta = self.identifier_meta(rel=rel, rel_name=rel_name, data=data, relid=rel_ids)
-                resources = await JsonapiAdapter.resource_identifier(type_=rel_type, id_=rel_ids, meta=identifier_meta)
+                resources = self.rel_identifier(rel_type, rel_ids, identifier_meta)
             # total = 1 if rel_ids else 0    # meta total
         elif rel.mapping_field and not rel.one_to_one:
             # 去重
@@ -997,9 +1657,9 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
                 rel.mapping_field) else None
             resources = []
             if rel_ids:
-                for id_ in rel_ids:
+                for id_ in dict.fromkeys(rel_ids):
                     identifier_meta = self.identifier_meta(rel=rel, rel_name=rel_name, data=data, relid=id_)
-                    resource = await JsonapiAdapter.resource_identifier(type_=rel_type, id_=id_, meta=identifier_meta)
+                    resource = self.rel_identifier(rel_type, id_, identifier_meta)
                     resources.append(resource)
             # total = len(rel_ids) if rel_ids else 0  # meta total
         elif rel.cond_fun and self.args.include and rel_name in self.args.include:  # 没有mapping.则在有inlcude时再显示relationships的data
@@ -1011,16 +1671,31 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
                 resources = None
                 if rel_ids is not None:
                     identifier_meta = self.identifier_meta(rel=rel, rel_name=rel_name, data=data, relid=rel_ids)
-                    resources = await JsonapiAdapter.resource_identifier(type_=rel_type, id_=rel_ids[0])
+                    resources = self.rel_identifier(rel_type, rel_ids[0], identifier_meta)
             else:
                 resources = []
                 if rel_ids:
                     for id_ in rel_ids:
                         identifier_meta = self.identifier_meta(rel=rel, rel_name=rel_name, data=data, relid=rel_ids)
-                        resource = await JsonapiAdapter.resource_identifier(type_=rel_type, id_=id_,
-                                                                            meta=identifier_meta)
+                        resource = self.rel_identifier(rel_type, id_, identifier_meta)
                         resources.append(resource)
             # total = rel_resource(request_context=rel_cond).count()
+        elif rel.batch_fun:  # 批量获取的关系ids, 同一请求只取一次
+            rel_ids = (await self.batch_rel_ids(rel_name=rel_name, rel=rel, datas=[data])).get(str(data.id))
+            if rel.one_to_one:
+                if isinstance(rel_ids, list):
+                    rel_ids = rel_ids[0] if rel_ids else None
+                resources = None
+                if rel_ids is not None:
+                    identifier_meta = self.identifier_meta(rel=rel, rel_name=rel_name, data=data, relid=rel_ids)
+                    resources = self.rel_identifier(rel_type, rel_ids, identifier_meta)
+            else:
+                resources = []
+                if rel_ids:
+                    for id_ in dict.fromkeys(rel_ids if isinstance(rel_ids, list) else [rel_ids]):
+                        identifier_meta = self.identifier_meta(rel=rel, rel_name=rel_name, data=data, relid=id_)
+                        resource = self.rel_identifier(rel_type, id_, identifier_meta)
+                        resources.append(resource)
         else:
             resources = None
 
@@ -1109,14 +1784,16 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
     async def serialize_attr(self,
                              data: SchemaBase,
                              attr_model: SchemaBase):
+        fields = self.sparse_fields()
+        if self.trusted_rows and hasattr(attr_model, 'pick'):  # 数据已验证，直接取值
+            return attr_model.pick(data, fields)
         attr = attr_model(**data.dict())
+        if fields is not None:
+            return attr.dict(include=fields)
         return attr
 
     async def attr_model(self, many: bool = False):
-        attr_model = create_model('attr_model')
-        attr_field = self.model.response_fields(many=many)
-        attr_model.__fields__ = attr_field
-        return attr_model
+        return self.model.response_attr_model(many=many)
 
     async def serialize_api(self,
                             datas: Union[List[SchemaBase],
@@ -1135,8 +1812,15 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
         Returns: JsonapiDataModel
 
         """
-        # fields_prams = self.args.fields if self.args else {}
+        # 没有关系的资源，响应模型中也没有relationships，不经过响应模型时在这里去掉
+        strip_rels = self.skip_response_model and not self.rel_resources()
+        fields = self.sparse_fields()
+        if fields is not None:  # 稀疏字段，只保留请求的关系
+            rels = {rel_name: rel for rel_name, rel in rels.items() if rel_name in fields}
         if isinstance(datas, list):  # 资源列表
+            for rel_name, rel in rels.items():  # batch_fun关系一次取全部数据的关系ids
+                if rel.batch_fun and (rel_name in include or rel_name in q_data):
+                    await self.batch_rel_ids(rel_name=rel_name, rel=rel, datas=datas)
             api_datas = []
             attr_model = await self.attr_model(many=True)
             for data in datas:
@@ -1153,8 +1837,9 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
                     links=self.host[:-1] + self.Meta.link + '/' + str(
                         data.id),
                     meta=meta,
-                    # fields=fields_prams
                 )
+                if strip_rels:
+                    del api_data['relationships']
                 api_datas.append(api_data)
         else:  # 单个资源
             data = datas
@@ -1170,19 +1855,22 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
                                                                                                  q_data=q_data),
                                                       links=self.host[:-1] + self.Meta.link + '/' + str(data.id),
                                                       meta=meta,
-                                                      # fields=fields_prams
                                                       )
+            if strip_rels:
+                del api_datas['relationships']
         return api_datas
 
     async def include_condit(self,
                              datas: Union[List[SchemaBase],
                                           SchemaBase],
                              rel_name,
-                             rel):
+                             rel,
+                             owner: Type['BaseResource'] = None):
         """
         获取关系资源的条件，为生成富文本文档做准备
         :param datas:
         :param rels:
+        :param owner: 关系所属的资源类，默认当前资源
         :return:
         """
 
@@ -1195,68 +1883,130 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
                 if rel_ids is not None:
                     relid.extend(rel_ids) if isinstance(rel_ids, List) else relid.append(rel_ids)
             condition = {'request_context': {
-                'id': list(set(relid))}}
+                'id': list(dict.fromkeys(relid))}}  # 去重并保持顺序
+        elif rel.batch_fun:
+            if owner is None or owner is self.__class__:
+                loader = self
+            else:
+                loader = self.include_resource(owner)
+            batch = await loader.batch_rel_ids(rel_name=rel_name, rel=rel, datas=datas)
+            condition = self.batch_condition(batch, datas)
         else:
             cond_func = getattr(self, rel.cond_fun)
             condition = cond_func(datas)  # 查询条件
         return condition
 
-    async def get_rel_data(self, datas, rel_name, rel):
+    def include_resource(self, resource: Type['BaseResource']) -> 'BaseResource':
+        """
+        include中序列化、批量取关系ids的资源实例。与本实例共用请求、extract_params、
+        请求上下文(不作为查询条件)和identity_map, batch_fun在各层include中可读取请求状态
+        """
+        obj = resource(request=self.request, extract_params=self.extract_params, host=self.host,
+                       query_args=ArgsModel(fields=self.args.fields))
+        obj.request_context = self.request_context
+        obj.identity_map = self.identity_map
+        obj.skip_response_model = self.skip_response_model
+        return obj
+
+    async def get_rel_data(self, datas, rel_name, rel, owner: Type['BaseResource'] = None):
         """
         获取关系数据
         Args:
             datas: api_data
             rel_name: 关系名
             rel: Relationship类
+            owner: 关系所属的资源类，默认当前资源
 
         Returns: 关系资源模型数据
 
         """
         rel_resource = registered_resources.get(rel.rel_resource)
-        rel_condition = await self.include_condit(datas, rel_name, rel)  # 关系ids
+        rel_condition = await self.include_condit(datas, rel_name, rel, owner=owner)  # 关系ids
+        if rel_condition is None:  # batch_fun 没有关系数据
+            return []
+        rel_ids = None
+        if rel.mapping_field or rel.batch_fun:  # 其它路径已由同一资源查询过的id不再查询
+            rel_ids = rel_condition['request_context']['id']
+            if rel.include_limit:  # 条数限制与整组ids有关，按整组缓存
+                rel_datas = self.identity_map.get(rel_resource, rel_ids, rel.include_limit)
+                if rel_datas is not None:
+                    return rel_datas
+            else:
+                missing = self.identity_map.missing(rel_resource, rel_ids)
+                if not missing:
+                    return self.identity_map.rows_of(rel_resource, rel_ids)
+                rel_condition['request_context']['id'] = missing  # 只查询缺少的id
         if isinstance(rel_condition, dict):
             rel_class = rel_resource(request=None, host=self.host, **rel_condition)
         else:
             # rel_condition.limit = rel.include_limit
             rel_class = rel_resource(request=None, host=self.host, query_args=rel_condition)
         rel_class.args.limit = rel.include_limit
+        rel_class.args.fields = self.args.fields  # 稀疏字段，数据层可只查询需要的字段
         rel_datas = await rel_class.connect_data(func=rel_class.get_many)
         # rel_datas =await rel_resource(
         #     request=None, host=self.host, **rel_condition).get_many()  # 关系数据
         # await rel.after_request()
+        if rel_ids is not None:
+            if rel.include_limit:
+                self.identity_map.add(rel_resource, rel_ids, rel_datas, rel.include_limit)
+            else:
+                self.identity_map.add_rows(rel_resource, missing, rel_datas)
+                rel_datas = self.identity_map.rows_of(rel_resource, rel_ids)
         return rel_datas
 
-    async def get_include_data(self, include_tree, q_data_tree, pid_node, node, exist_included_dict):
+    async def fetch_include_data(self, include_tree, pid_node, node):
         """
-        获取每一层的include数据
+        获取一个include节点的关系数据，存入tree中供下一层使用。同一层的节点只依赖上一层数据，可以并发获取
         Args:
             include_tree: 关系tree
             pid_node: 本层关系的上层 例： pubscene.journey
             node: 本层关系 例：pubscene.journey.journeycls
 
-        Returns:
+        Returns: 本层关系的全部数据
 
         """
         rel_name = include_tree[node].tag
-        include_child = [node.tag for node in include_tree.children(node)]
-        q_data_child = [node.tag for node in q_data_tree.children(node)] if q_data_tree.contains(node) else []
         rels = include_tree[pid_node].data.get('rel')  # 第n层关系的全部关系
         datas = include_tree[pid_node].data.get('data')  # 第n层关系的全部数据
         rel = rels[rel_name]  # 第n层关系对象
         rel_resource = registered_resources.get(rel.rel_resource)  # 第n层关系的关系资源
-        type_ = rel_resource.Meta.type_
         relrels = rel_resource.rel_resources()  # 第n层关系的全部关系
         rel_datas_all = await self.get_rel_data(datas=datas,
                                                 rel_name=rel_name,
-                                                rel=rel)  # 第n层关系数据（pubscene）
+                                                rel=rel,
+                                                owner=include_tree[pid_node].data.get('resource'))  # 第n层关系数据（pubscene）
+        include_tree[node].data = {'rel': relrels, 'data': rel_datas_all,
+                                   'resource': rel_resource}   # 构造tree需要全量数据，因为还有下一层需要取
+        return rel_datas_all
+
+    async def get_include_data(self, include_tree, q_data_tree, pid_node, node):
+        """
+        获取每一层的include数据，已输出到included的资源由identity_map排除
+        Args:
+            include_tree: 关系tree
+            pid_node: 本层关系的上层 例： pubscene.journey
+            node: 本层关系 例：pubscene.journey.journeycls
+
+        Returns:
+
+        """
+        rel_name = include_tree[node].tag
+        include_child = [node.tag for node in include_tree.children(node)]
+        q_data_child = [node.tag for node in q_data_tree.children(node)] if q_data_tree.contains(node) else []
+        rels = include_tree[pid_node].data.get('rel')  # 第n层关系的全部关系
+        rel = rels[rel_name]  # 第n层关系对象
+        rel_resource = registered_resources.get(rel.rel_resource)  # 第n层关系的关系资源
+        type_ = rel_resource.Meta.type_
+        if include_tree[node].data is None:  # 未预先获取
+            await self.fetch_include_data(include_tree=include_tree, pid_node=pid_node, node=node)
+        relrels = include_tree[node].data.get('rel')
+        rel_datas_all = include_tree[node].data.get('data')
 
-        include_tree[node].data = {'rel': relrels, 'data': rel_datas_all}   # 构造tree需要全量数据，因为还有下一层需要取
-        rel_datas = []
-        for data in rel_datas_all:     # 已有数据排除
-            if data.id not in exist_included_dict[type_]:
-                rel_datas.append(data)
-                exist_included_dict[type_].append(data.id)
-        return await rel_resource(host=self.host).serialize_api(rel_datas, relrels, include_child, q_data_child), exist_included_dict
+        rel_datas = [data for data in rel_datas_all
+                     if self.identity_map.mark_serialized(type_, data.id)]  # 已有数据排除
+        serializer = self.include_resource(rel_resource)
+        return await serializer.serialize_api(rel_datas, relrels, include_child, q_data_child)
 
     async def serialize_include(
             self,
@@ -1276,7 +2026,7 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
         included = []
         include_tree = Tree()
         include_tree.create_node('main', 'main')
-        include_tree['main'].data = {'rel': rels, 'data': datas}  # 主资源
+        include_tree['main'].data = {'rel': rels, 'data': datas, 'resource': self.__class__}  # 主资源
         for inc in include_res:
             inc_list = inc.split('.')
             if not include_tree.contains(inc_list[0]):
@@ -1304,29 +2054,31 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
                 continue
             q_data_tree.create_node(inc_list[2], '.'.join(inc_list), parent='.'.join(inc_list[:2]))
 
-        exist_included_dict = defaultdict(list)
+        # 按层分组，同一层的关系并发取数
+        levels = defaultdict(list)
         for node in include_tree.expand_tree(mode=Tree.WIDTH, sorting=False):  # 层序遍历, 确保父级先获取数据
             if node == 'main':
                 continue
-            # include_child = [node.tag for node in include_tree.children(node)]
-            # rel_name = include_tree[node].tag
-            if node.count('.') == 0:  # 第一层关系
-                rel_pid = 'main'
-                include_data, exist_included_dict = await self.get_include_data(include_tree=include_tree, q_data_tree=q_data_tree,
-                                                                                node=node, pid_node=rel_pid, exist_included_dict=exist_included_dict)
-
-                included.extend(include_data)
-            elif node.count('.') == 1:  # 第二层关系
-                rel_pid, _ = node.split('.')  # 父节点id
-                include_data, exist_included_dict = await self.get_include_data(include_tree=include_tree, q_data_tree=q_data_tree,
-                                                                                node=node, pid_node=rel_pid, exist_included_dict=exist_included_dict)
-
-                included.extend(include_data)
-            elif node.count('.') == 2:  # 第三层关系
-                rel_pid = '.'.join(node.split('.')[:2])  # 父节点id
-                include_data, exist_included_dict = await self.get_include_data(include_tree=include_tree, q_data_tree=q_data_tree,
-                                                                                node=node, pid_node=rel_pid, exist_included_dict=exist_included_dict)
-
+            levels[node.count('.')].append(node)
+
+        concurrency = self.include_concurrency
+        if concurrency is None:  # 单例会话并发时，先结束的取数会关闭其它取数正在使用的连接
+            concurrency = 8 if isinstance(self.session, SessionPool) else 1
+        semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+
+        async def fetch(node, pid_node):
+            if semaphore is None:
+                return await self.fetch_include_data(include_tree=include_tree, pid_node=pid_node, node=node)
+            async with semaphore:
+                return await self.fetch_include_data(include_tree=include_tree, pid_node=pid_node, node=node)
+
+        for depth in sorted(levels):
+            nodes = levels[depth]
+            pid_nodes = ['main' if depth == 0 else node.rsplit('.', 1)[0] for node in nodes]  # 父节点id
+            await asyncio.gather(*[fetch(node, pid_node) for node, pid_node in zip(nodes, pid_nodes)])
+            for node, pid_node in zip(nodes, pid_nodes):  # 按层序顺序合并，输出顺序不变
+                include_data = await self.get_include_data(include_tree=include_tree, q_data_tree=q_data_tree,
+                                                           node=node, pid_node=pid_node)
                 included.extend(include_data)
 
         return included
@@ -1363,7 +2115,11 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
             meta.update({'filter_warings': self.args.warings})
 
         # 分页放在meta里
-        if pages:
+        if pages and self.args.cursor:  # 游标分页没有offset
+            pagination_kwargs = await JsonapiAdapter.pagination(
+                total=pages, limit=self.args.cursor.limit, offset=None)
+            meta.update(pagination_kwargs)
+        elif pages:
             pagination_kwargs = await JsonapiAdapter.pagination(
                 total=pages, limit=self.args.limit, offset=self.args.skip)
             meta.update(pagination_kwargs)
@@ -1398,6 +2154,8 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
             included=included,
             meta=meta
         )
+        if self.skip_response_model and not self.rel_resources():  # 没有关系的资源，响应模型中也没有included
+            del response_data['included']
         return response_data
 
     @classmethod
@@ -1429,11 +2187,14 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
 
     @property
     def user(self) -> Optional[User]:
-        """获取用户"""
-        if self.Auth:
-            return self.Auth.user
-        else:
+        """获取当前请求的用户"""
+        if not self.Auth:
             return None
+        if self.request is not None:
+            user = getattr(self.request.state, 'user', None)
+            if user is not None:
+                return user
+        return current_user()
 
     @classmethod
     def _api(cls, has_response_model: bool = True, **kwargs):
@@ -1450,11 +2211,16 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
 
         """
         print(cls.model)
+        build_start = time.perf_counter()
 
         cls.route = cls.router()
 
         cls.schema_model = CreatModel(cls, exits_model=cls._response_models)
 
+        get_query_plan(cls)  # 查询计划, 请求时 ArgParse 直接使用
+        if cls.cursor_pagination:
+            cursor_secret(cls)  # 注册时检查游标签名密钥已配置
+
         cls._relationships_model = cls.schema_model.rel_identifier_model
         cls._relationships_model_response = cls.schema_model.rel_identifier_model_response
 
@@ -1509,13 +2275,12 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
 
             )
 
-        # if 'ATOMIC' in cls.methods:
-        #     router.add_api_route(
-        #         endpoint=cls.use_atomic_post(),
-        #         methods=['POST'],
-        #         # response_model=cls.atomic_response_model(),
-        #         **cls.AtomicInfo.dict()
-        #     )
+        if 'ATOMIC' in cls.methods:
+            cls.route.add_api_route(
+                endpoint=cls.use_atomic_post(),
+                methods=['POST'],
+                **cls.AtomicInfo.dict()
+            )
 
         cls._response_models.update(cls.schema_model._exits)
         if cls.relapi:  # 是否有关系接口
@@ -1583,19 +2348,32 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
                         **cls.RelatedGetInfo.dict()
                     )
 
+        # 接口支持的查询参数，请求时验证参数直接使用
+        for route in cls.route.routes:
+            route.endpoint.query_params = get_query_params(route.endpoint)
+            route.endpoint.status_code = route.status_code  # prerender_response时使用
+
         # 权限添加
         if cls.Auth:
             cls.Auth.run(cls)
 
+        build_times[cls.__name__] = time.perf_counter() - build_start
         return cls.route
 
     @classmethod
-    def _register_sub_routes(cls, child, has_response_model: bool = True):
+    def build_report(cls) -> dict:
+        """已生成的资源的模型和路由耗时(秒)，按耗时倒序"""
+        return dict(sorted(build_times.items(), key=lambda item: item[1], reverse=True))
+
+    @classmethod
+    def _register_sub_routes(cls, child, has_response_model: bool = True, lazy: bool = False, router=None):
         """
         挂载所有下级路由
         Args:
             route: APIRouter 挂载的上级路由
             child: Rescoure
+            lazy: 是否懒加载，只记录资源，第一次请求或生成openapi时才生成模型和路由
+            router: 懒加载路由所在的Router
 
         Returns:
 
@@ -1605,6 +2383,8 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
                 child = child.default_version  # 版本
             else:
                 child = child
+            if lazy:
+                return [LazyResourceRoute(resource=child, router=router, has_response_model=has_response_model)]
             router = child._api(has_response_model=has_response_model)
             return router.routes
         else:
@@ -1612,29 +2392,100 @@ class BaseResource(_BaseApiHandler, metaclass=RegisteredResourceMeta):
             for child in child.childs:
                 child.prefix += cls.prefix  # 上级路由添加到下一级，做下级的路由
                 routes = cls._register_sub_routes(child=child,
-                                                  has_response_model=has_response_model)
+                                                  has_response_model=has_response_model,
+                                                  lazy=lazy,
+                                                  router=router)
                 # router.include_router(route)
                 routers.extend(routes)
         return routers
 
     @classmethod
-    def register_routes(cls, app: FastAPI, has_response_model: bool = True, **kwargs):
+    def register_routes(cls, app: FastAPI, has_response_model: bool = True, lazy: bool = False, **kwargs):
         """
         向api挂载路由
         Args:
             api: FastAPI
+            lazy: 是否懒加载。资源多时可缩短启动时间，模型和路由在第一次请求该资源或生成openapi时生成
             **kwargs: FastAPI.include_router 参数
 
         Returns:
 
         """
-        routers = cls._register_sub_routes(cls, has_response_model)
+        routers = cls._register_sub_routes(cls, has_response_model, lazy=lazy, router=app.router)
         # app.include_router(router)
         # app.router = router
         app.router.routes.extend(routers)
+        if lazy:
+            openapi = app.openapi
+
+            def lazy_openapi():
+                if not app.openapi_schema:  # 已有openapi文档(如从清单加载)时无需生成路由
+                    expand_lazy_routes(app)  # openapi需要全部路由
+                return openapi()
+
+            app.openapi = lazy_openapi
         return cls
 
 
+class LazyResourceRoute(BaseRoute):
+    """
+    懒加载的资源路由，注册时只记录资源和路由前缀。
+    第一次匹配到请求或生成openapi时，生成资源的模型和路由，并在router中替换自身
+        Args:
+            resource: 资源类
+            router: 所在的Router
+            has_response_model: 是否有响应模型
+    """
+
+    def __init__(self, resource: Type[BaseResource], router, has_response_model: bool = True):
+        self.resource = resource
+        self.router = router
+        self.has_response_model = has_response_model
+        self.path_prefix = resource.prefix + resource.Meta.link
+        self._routes = None
+
+    @property
+    def routes(self) -> list:
+        """资源的真正路由，第一次使用时生成"""
+        if self._routes is None:
+            self._routes = self.resource._api(has_response_model=self.has_response_model).routes
+        return self._routes
+
+    def expand(self) -> list:
+        """生成路由并在router中替换自身"""
+        routes = self.routes
+        if self.router is not None and self in self.router.routes:
+            index = self.router.routes.index(self)
+            self.router.routes[index:index + 1] = routes
+        return routes
+
+    def matches(self, scope) -> tuple:
+        path = scope.get('path', '')
+        if scope['type'] != 'http' or not (path == self.path_prefix or path.startswith(self.path_prefix + '/')):
+            return Match.NONE, {}
+        partial = None
+        for route in self.routes:
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                return match, dict(child_scope, lazy_route=route)
+            if match == Match.PARTIAL and partial is None:
+                partial = match, dict(child_scope, lazy_route=route)
+        return partial or (Match.NONE, {})
+
+    async def handle(self, scope, receive, send) -> None:
+        route = scope.pop('lazy_route')
+        self.expand()  # Router遍历路由时不能修改，在handle中替换，之后的请求直接匹配真正的路由
+        await route.handle(scope, receive, send)
+
+    def url_path_for(self, name: str, **path_params: Any):
+        for route in self.routes:
+            try:
+                return route.url_path_for(name, **path_params)
+            except NoMatchFound:
+                pass
+        raise NoMatchFound(name, path_params)
+
+
 class FileResponse(Response):
     media_type = "application/octet-stream"
 
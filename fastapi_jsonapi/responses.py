@@ -1,26 +1,97 @@
-from typing import Any
+from typing import Any, Callable
 import json
+import datetime
+import decimal
+from enum import Enum
+from uuid import UUID
+from pydantic import BaseModel
 from fastapi.responses import JSONResponse
 
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # 可选依赖
+    ujson = None
+
+
+def encode_default(obj: Any) -> Any:
+    """
+    json编码器不支持的类型转换，与 fastapi jsonable_encoder 的结果一致
+    Args:
+        obj: 值
+    Returns: 可编码的值
+    """
+    if isinstance(obj, BaseModel):
+        return obj.dict(by_alias=True)
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, UUID):
+        return str(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode()
+    raise TypeError('Object of type %s is not JSON serializable' % type(obj).__name__)
+
+
+def json_dumps(content: Any) -> bytes:
+    """标准库json编码"""
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+        default=encode_default,
+    ).encode("utf-8")
+
+
+def orjson_dumps(content: Any) -> bytes:
+    """orjson编码，原生支持UUID、datetime、enum"""
+    return orjson.dumps(content, default=encode_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def ujson_dumps(content: Any) -> bytes:
+    """ujson编码"""
+    return ujson.dumps(content, ensure_ascii=False, default=encode_default).encode("utf-8")
+
+
+def fast_encoder() -> Callable[[Any], bytes]:
+    """
+    已安装的最快的编码器：orjson > ujson > json。需要时手动启用，
+    orjson/ujson 对NaN、非字符串键、大整数的处理与标准库json不同
+    """
+    if orjson is not None:
+        return orjson_dumps
+    if ujson is not None:
+        return ujson_dumps
+    return json_dumps
+
 
 class JsonapiResponse(JSONResponse):
     """
     Base response class for json:api requests, sets `Content-Type: application/vnd.api+json`.
 
+    The encoder defaults to the stdlib json and can be replaced,
+    e.g. `JsonapiResponse.encoder = staticmethod(fast_encoder())` to opt in to orjson/ujson.
+
     For detailed information, see `Starlette responses <https://www.starlette.io/responses/>`_.
     """
     media_type = 'application/vnd.api+json'
+    encoder = staticmethod(json_dumps)  # content -> bytes
 
     def render(self, content: Any) -> bytes:
         if content is None:
             return b''
 
-        return json.dumps(
-            content,
-            ensure_ascii=False,
-            allow_nan=False,
-            indent=None,
-            separators=(",", ":"),
-            # default=lambda obj: str(obj) if isinstance(obj, UUID) else obj.__dict__
-        ).encode("utf-8")
-
+        return self.encoder(content)
@@ -3,16 +3,17 @@
 from typing import Optional, List, Any, Dict, Union, Type, Set, Tuple
 
 try:
-    from typing import Literal
+    from typing import Literal, Annotated
 except ImportError:
-    from typing_extensions import Literal
+    from typing_extensions import Literal, Annotated
 from typing import Callable
 import copy
 from pydantic import create_model, BaseModel
+from pydantic import Field as PydanticField
 from pydantic.fields import ModelField
 from fastapi_jsonapi.field import Field
-from fastapi_jsonapi.jsonapi import LinksSelfModel, LinksRelatedModel, Op, RefRel, ApiDataModelRequest, ResourcesRemoveModel
-from fastapi_jsonapi.meta import registered_resources
+from fastapi_jsonapi.jsonapi import LinksSelfModel, LinksPaginationModel, LinksRelatedModel, Op, RefRel, ApiDataModelRequest, ResourcesRemoveModel
+from fastapi_jsonapi.meta import registered_resources, relationship_graph
 
 
 class DataMeta(BaseModel):
@@ -133,6 +134,34 @@ def field_mapping(field):
     return dec
 
 
+def _plain_value(value):
+    # 嵌套模型转成dict, 其他值原样返回
+    if isinstance(value, BaseModel):
+        return value.dict()
+    if isinstance(value, list):
+        return [_plain_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _plain_value(item) for key, item in value.items()}
+    return value
+
+
+def create_attr_picker(fields: Dict[str, ModelField]) -> Callable[[BaseModel], dict]:
+    """
+    生成 attribute 取值函数，直接从已验证的模型数据中按字段取值，不再做pydantic验证
+    Args:
+        fields: 响应字段
+    Returns: 取值函数，参数为模型数据和可选的稀疏字段，返回attribute字典
+    """
+    defaults = tuple((name, field.get_default()) for name, field in fields.items())
+
+    def picker(data: BaseModel, include: Set[str] = None) -> dict:
+        # include: 稀疏字段，只取其中的字段
+        return {name: _plain_value(getattr(data, name, default)) for name, default in defaults
+                if include is None or name in include}
+
+    return picker
+
+
 class SchemaBase(BaseModel):
     """属性对象基类，重写资源属性
     """
@@ -179,13 +208,19 @@ class SchemaBase(BaseModel):
                 config=cls.__config__)
         cls.__fields__.update(new_fields)
         cls.__annotations__.update(new_annotations)
+        cls._fields_version = cls.fields_version() + 1  # 模型已修改，依赖模型字段生成的缓存失效
+        cls._response_attr_models = {}
         return cls
 
+    @classmethod
+    def fields_version(cls) -> int:
+        """模型字段版本号，每次 add_fields 修改模型后加 1，用来判断按模型字段生成的缓存是否过期"""
+        return cls.__dict__.get('_fields_version', 0)
+
     @classmethod
     def filter_fields(cls):  # 资源筛选字段（不包含关系的）
         model_fields = {}
-        fields = copy.deepcopy(cls.__fields__)
-        for key, item in fields.items():
+        for key, item in cls.__fields__.items():  # 只读字段信息，无需deepcopy
             if not item.field_info.isrel and not item.field_info.ishide:
                 model_fields[key] = cls.__annotations__.get(key)
         return model_fields
@@ -222,6 +257,20 @@ class SchemaBase(BaseModel):
 
         return model_fields
 
+    @classmethod
+    def response_attr_model(cls, many=False) -> Type[BaseModel]:
+        """序列化 attribute 所用模型。单个资源和资源列表各生成一次并缓存在模型类上，add_fields 修改模型时清除"""
+        attr_models = cls.__dict__.get('_response_attr_models')
+        if attr_models is None:
+            attr_models = {}
+            cls._response_attr_models = attr_models
+        if many not in attr_models:
+            attr_model = create_model(cls.__name__ + ('AttrMany' if many else 'AttrSingle'))
+            attr_model.__fields__ = cls.response_fields(many=many)
+            attr_model.pick = create_attr_picker(attr_model.__fields__)  # 已验证数据的取值函数
+            attr_models[many] = attr_model
+        return attr_models[many]
+
 
 class Relationship(object):
     """
@@ -229,7 +278,9 @@ class Relationship(object):
         Args:
             rel_resource: 资源模型类名。通过名称找类对象
             mapping_field: 关系在资源模型中对应的字段, 取字段的值作为获取关系资源的id. 有值,则有data, 为None, data为空当relationships中没有data'
-            cond_fun: 方法名，获取关系资源的条件。 mapping_field 和cond必须有一个不为空,
+            cond_fun: 方法名，获取关系资源的条件。 mapping_field 、cond_fun和batch_fun有且仅有一个不为空,
+            batch_fun: 异步方法名，批量获取关系ids。参数为一次请求中全部的父资源数据，返回{父资源id: 关系ids}，
+                       一次请求内缓存，关系标识符和include共用一次取数
             has_data: 默认有，没有data 时，接口不能使用include参数
             has_self: 是否显示self, 默认true; 当为False时,relationships中没有self链接, 接口中也没有source/{id}/relationships/rel_name 接口
             has_related: 是否显示related, 默认true; 当为False时,relationships中没有related链接, 接口中也没有'source/{id}/rel_name' 接口
@@ -251,6 +302,7 @@ class Relationship(object):
             rel_resource: str,
             mapping_field: str = None,
             cond_fun: str = None,
+            batch_fun: str = None,
             has_data: bool = True,
             has_self: bool = True,
             has_related: bool = True,
@@ -260,11 +312,12 @@ class Relationship(object):
             required: bool = False,
             inlcude_limit: int = None,
             **kwargs):
-        if (mapping_field and cond_fun) or (not mapping_field and not cond_fun):
-            raise Exception("mapping_field和cond_fun 有且仅有一个不为None")
+        if len([item for item in (mapping_field, cond_fun, batch_fun) if item]) != 1:
+            raise Exception("mapping_field、cond_fun和batch_fun 有且仅有一个不为None")
         self.rel_resource = rel_resource
         self.mapping_field = mapping_field
         self.cond_fun = cond_fun
+        self.batch_fun = batch_fun
         self.has_data = has_data
         self.has_self = has_self
         self.has_related = has_related
@@ -337,7 +390,11 @@ class CreatModel(object):
             return self._exits.get(attr_model_name)
 
         attr_model = create_model(attr_model_name)
-        attr_field = resource_model.model.response_fields(many=many)
+        attr_field = {}
+        for name, field in resource_model.model.response_fields(many=many).items():
+            field = copy.copy(field)
+            field.required = False  # 稀疏字段时响应中可以没有此属性
+            attr_field[name] = field
         # attr_field = self._clear_rel_field(
         #     resource_model=resource_model, attr_field=attr_field)
         attr_model.__fields__ = attr_field
@@ -418,7 +475,7 @@ class CreatModel(object):
         return model
 
     def create_relationship_model(self, resource_model, rel_identifier_model, tag):
-        rel_model = copy.deepcopy(rel_identifier_model)
+        rel_model = dict(rel_identifier_model or {})  # 只删除键，值是共用的模型，无需深拷贝
         model_name = resource_model.__name__ + 'Relationship' + tag
         if self._exits and self._exits.get(model_name):
             return self._exits.get(model_name)
@@ -513,6 +570,7 @@ class CreatModel(object):
         model_name = rel_resource.__name__ + 'ApiData' + 'ManyResponse'
         if self._exits and self._exits.get(model_name):
             include_model.append(self._exits.get(model_name))
+            return include_model
 
         include_model.append(
             self.creat_response_apidata_model(
@@ -533,30 +591,37 @@ class CreatModel(object):
         if not resource_model.rel_resources():
             return []
 
-        for field, rel in resource_model.rel_resources().items():
-            rel_resource = registered_resources.get(rel.rel_resource)  # 关系的资源模型
+        for rel_resource in relationship_graph.targets(resource_model).values():  # 关系的资源模型
             self.single_include_model(rel_resource, include_model)
 
-            if not rel_resource.rel_resources():   # 关系下是否还有关系
-                continue
-
-            for field, rel in rel_resource.rel_resources().items():
-                relrel_resource = registered_resources.get(rel.rel_resource)  # 关系的关系资源模型
+            for relrel_resource in relationship_graph.targets(rel_resource).values():  # 关系的关系资源模型
                 if relrel_resource == resource_model:        # 如果关系的关系模型等于主资源，不再包含在include中
                     continue
                 self.single_include_model(relrel_resource, include_model)
 
-                if not relrel_resource.rel_resources():  # 关系下是否还有关系
-                    continue
-
-                for field, rel in relrel_resource.rel_resources().items():
-                    relrelrel_resource = registered_resources.get(rel.rel_resource)  # 关系的关系资源模型
+                for relrelrel_resource in relationship_graph.targets(relrel_resource).values():
                     if relrelrel_resource == resource_model:  # 如果关系的关系的关系模型等于主资源，不再包含在include中
                         continue
                     self.single_include_model(relrelrel_resource, include_model)
 
         return include_model
 
+    def create_included_type(self):
+        """
+        included 的类型。按type去重，有多个模型时以type为鉴别字段，每个资源只用对应type的模型验证。
+        type相同的不同资源模型不同，鉴别字段不能区分，使用原来的Union逐个尝试
+        Returns: List[模型]、List[Annotated[Union[模型...], type鉴别]] 或 List[Union[模型...]]
+        """
+        type_models = {}
+        for model in dict.fromkeys(self.includes_model):
+            type_models.setdefault(model.__fields__['type'].default, []).append(model)
+        if any(len(models) > 1 for models in type_models.values()):
+            return List[Union[tuple(dict.fromkeys(self.includes_model))]]
+        models = tuple(models[0] for models in type_models.values())
+        if len(models) == 1:
+            return List[models[0]]
+        return List[Annotated[Union[models], PydanticField(discriminator='type')]]
+
     def create_response_model(
             self,
             many: bool = False
@@ -599,12 +664,13 @@ class CreatModel(object):
             'data': (data, None),
             'meta': (Optional[Any], None),
             'jsonapi': (Optional[str], None),
-            'links': (Optional[LinksSelfModel], None),
+            'links': (Optional[LinksPaginationModel if many and getattr(self.resource_model, 'cursor_pagination', False)
+                                else LinksSelfModel], None),
         }
         # 没有include 不显示
         if self.includes_model:
             model_field.update(
-                {'included': (List[Union[tuple(self.includes_model)]], None)})
+                {'included': (self.create_included_type(), None)})
 
         model = create_model(
             model_name,
@@ -661,81 +727,85 @@ class CreatModel(object):
     ) -> Type[BaseModel]:
         """生成原子操作jsonapi请求模型
         Args:
-            model_name: 模型名称
-            data_attributes_model: 属性对象模型
-            ops: 操作符
-            remove_res: 排除资源类型列表
+            ops: 支持的操作
         Returns:
-            BaseModel
+            BaseModel {"atomic:operations": [操作]}
         """
         tag = 'Atomic'
         model_name = self.resource_model.__name__ + tag
-        model = []  # 所有支持的模型
-        # 主资源 update,add
-
+        if self._exits and self._exits.get(model_name):
+            return self._exits.get(model_name)
+        model = []  # 所有支持的模型，关系操作在前，有ref.relationship的操作先匹配
+        resource_type = self.resource_model.Meta.type_
+        resources_model = []
         for field, rel in self.resource_model.rel_resources().items():
-            rel_model = rel.rel_resource.model
-            rel_resource = rel.rel_resource
-            if rel.one_to_one:
-                rel_data = create_model(self.resource_model.__name__ +
-                                        field.capitalize() +
-                                        'OvmRelData',
-                                        id=(rel_model.__annotations__.get('id'), None),
-                                        type=Field(default=rel_resource.Meta.type_))
-            else:
-                rel_data = create_model(self.resource_model.__name__ +
-                                        field.capitalize() +
-                                        'OvmRelData',
-                                        id=(rel_model.__annotations__.get('id'), None),
-                                        type=Field(default=rel_resource.Meta.type_))
+            rel_resource = relationship_graph.target(self.resource_model, field)
+            if rel_resource is None:
+                continue
+            rel_model = rel_resource.model
+            rel_data = create_model(self.resource_model.__name__ +
+                                    field.capitalize() +
+                                    'OvmRelData',
+                                    id=(rel_model.__annotations__.get('id'), None),
+                                    type=Field(default=rel_resource.Meta.type_))
 
             # 单独更新关系模型
             # 关系模型名称=关系+操作符+资源类型+关系类型+这部分可自定义用来区分不同模型+关系命名方式（文档说明。修改需和前端讨论）
             model.append(create_model(
-                'relationship_' + 'op[add,update,remove]_' + self.resource_model.Meta.type_ +
+                'relationship_' + 'op[add,update,remove]_' + resource_type +
                 '_' + rel_resource.Meta.type_ + '_' + field + tag,
-                op=(Op, ...),
-                ref=(RefRel[Literal[self.resource_model.Meta.type_], Literal[rel_resource.Meta.type_]], ...),
-                data=(rel_data, ...)
+                op=(Literal['add', 'update', 'remove'], ...),
+                ref=(RefRel[Literal[resource_type], Literal[field]], ...),
+                data=(Optional[rel_data] if rel.one_to_one else List[rel_data], ...)
             ))
 
             # 相关资源
             if not rel.modify:  # 如果关系资源不允许在这里被修改，则不生成schema
                 continue
-            rel_data = ApiDataModelRequest[Literal[rel_resource.Meta.type_],
-                                           Dict, rel_model]
+            rel_api_data = ApiDataModelRequest[Literal[rel_resource.Meta.type_],
+                                               Dict, rel_model]
             # 模型名称 = 资源+操作符 + 资源类型 +关系无定义+这部分可自定义用来区分不同模型(主资源+关系资源属性名)+资源命名方式
-            model.append(create_model('resources_' +
-                                      'op[add,update]_' +
-                                      rel_resource.Meta.type_ +
-                                      '_any' +
-                                      '_' +
-                                      self.resource_model.Meta.type_ +
-                                      field +
-                                      '_' +
-                                      tag, op=(Op, ...), data=(rel_data, ...,)))
-        # rel_identifier_model = self.create_rel_identifier_model()
-        data = ApiDataModelRequest[Literal[self.resource_model.Meta.type_],
-                                   self.relationship_model, self.create_resquest_attribute_model()]
-        # 模型名称= 资源+ 操作符  + 资源类型+关系无定义 +这部分可自定义用来区分不同模型
-        model.append(create_model(
-
-            'resources_' + 'op[add,update]_' +
-            self.resource_model.Meta.type_ + '_any' + '_' + tag,  # 资源命名方式
-            op=(Op, ...),
-            data=(
-                data,
-                ...,
-            )
-        ))
+            resources_model.append(create_model('resources_' +
+                                                'op[add,update]_' +
+                                                rel_resource.Meta.type_ +
+                                                '_any' +
+                                                '_' +
+                                                resource_type +
+                                                field +
+                                                '_' +
+                                                tag, op=(Op, ...), data=(rel_api_data, ...,)))
+        # 主资源，新增和更新的数据模型与post、patch接口相同
+        if 'POST' in ops:
+            post_data = self.creat_resquest_apidata_model(
+                resource=self.resource_model,
+                attribute=self.create_resquest_attribute_model(tag='Post'),
+                relationships=self.create_relationship_model(self.resource_model, self.rel_identifier_model,
+                                                             tag='Post'),
+                post=True)
+            # 模型名称= 资源+ 操作符  + 资源类型+关系无定义 +这部分可自定义用来区分不同模型
+            model.append(create_model('resources_' + 'op[add]_' + resource_type + '_any' + '_' + tag,
+                                      op=(Literal['add'], ...), data=(post_data, ...)))
+        if 'PATCH' in ops:
+            patch_data = self.creat_resquest_apidata_model(
+                resource=self.resource_model,
+                attribute=self.create_resquest_attribute_model(tag='Patch'),
+                relationships=self.create_relationship_model(
+                    self.resource_model, self.create_rel_identifier_model(self.resource_model, tag='Patch'),
+                    tag='Patch'),
+                post=False)
+            model.append(create_model('resources_' + 'op[update]_' + resource_type + '_any' + '_' + tag,
+                                      op=(Literal['update'], ...), data=(patch_data, ...)))
+        model.extend(resources_model)
         # 删除模型
         if 'DELETE' in ops:
             model.append(ResourcesRemoveModel[Literal['remove']])
 
-        return create_model(
+        model = create_model(
             model_name,
-            operations=(List[Union[tuple(model)]], None)
+            operations=(List[Union[tuple(model)]], PydanticField(..., alias='atomic:operations'))
         )
+        self._exits[model_name] = model
+        return model
 
     def validation(self):
         for rel in self.resource_model.rel_resources().values():
@@ -1,6 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import inspect
+import asyncio
+import sqlite3
+from collections import deque, defaultdict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from typing import Optional, Dict, Sequence, Union, Any, List, Type
 from pydantic.fields import FieldInfo
 from fastapi.datastructures import Default
@@ -11,7 +16,7 @@ from fastapi.params import Depends
 from fastapi.exceptions import RequestValidationError
 from fastapi.openapi.utils import get_openapi
 from pydantic.schema import model_process_schema, get_model_name_map, get_flat_models_from_fields
-from fastapi_jsonapi.exception import serialize_error
+from fastapi_jsonapi.exception import serialize_error, PoolTimeout
 from fastapi_jsonapi.responses import JsonapiResponse
 from fastapi.openapi.constants import REF_PREFIX
 
@@ -99,6 +104,7 @@ class CustomOpenapi():
     def openapi(self):
         if self.app.openapi_schema:
             return self.app.openapi_schema
+        expand_lazy_routes(self.app)  # openapi需要全部路由
         openapi_schema = get_openapi(
             title=self.app.title,
             version=self.app.version,
@@ -129,6 +135,13 @@ class CustomOpenapi():
         return self.app.openapi_schema
 
 
+def expand_lazy_routes(app):
+    """生成懒加载(register_routes(lazy=True))的资源路由"""
+    for route in list(app.router.routes):
+        if hasattr(route, 'expand'):
+            route.expand()
+
+
 def create_custom_openapi(app, openapi_schema: dict = None):
     if openapi_schema:
         app.openapi_schema = openapi_schema
@@ -155,6 +168,108 @@ def get_default_args(func):
     return args
 
 
+def parse_etags(header: Optional[str]) -> List[str]:
+    """
+    If-None-Match/If-Match 请求头中的ETag列表，去掉弱ETag的W/前缀
+    Args:
+        header: 请求头
+    Returns: ETag列表
+    """
+    if not header:
+        return []
+    etags = []
+    for etag in header.split(','):
+        etag = etag.strip()
+        if etag.startswith('W/'):
+            etag = etag[2:]
+        if etag:
+            etags.append(etag)
+    return etags
+
+
+def get_query_params(func) -> frozenset:
+    """
+    接口方法支持的查询参数名称（别名优先，如page[limit]），注册路由时计算一次
+    Args:
+        func: 接口方法
+    Returns: 参数名称集合
+    """
+    return frozenset(get_default_args(func))
+
+
+class IdentityMap:
+    """
+    一次请求内已获取的include数据，include各层及各路径共享。
+    关系数据按(关系资源类, id)逐条登记，其它路径只查询缺少的id；type相同的不同资源各自查询。
+    有include_limit的关系按(关系资源类, 关系ids, include_limit)整体缓存；已输出到included的资源按(type, id)去重
+    """
+
+    def __init__(self):
+        self.rows = defaultdict(dict)  # {资源类: {id: 数据}}，按get_many返回的顺序
+        self.fetched = defaultdict(set)  # {资源类: 已查询的id}，查询不到的id也不再查询
+        self.results = {}  # {(资源类, 关系ids, include_limit): 关系数据}
+        self.serialized = set()  # 已输出到included的(type, id)
+        self.identifiers = {}  # 没有meta的资源标识符 {(type, id): 资源标识符}，relationships中共用
+        self.batches = {}  # batch_fun关系的结果 {(资源类, 关系名): {父资源id: 关系ids}}
+
+    @staticmethod
+    def key(type_, id_) -> tuple:
+        return type_, str(id_)  # id统一为字符串，mapping_field与数据id类型不一致时也能命中
+
+    def missing(self, resource, ids) -> list:
+        """关系ids中还未由该资源查询过的id，保持顺序"""
+        fetched = self.fetched[resource]
+        return [id_ for id_ in ids if str(id_) not in fetched]
+
+    def add_rows(self, resource, ids, datas):
+        """登记已查询的ids及get_many返回的数据"""
+        self.fetched[resource].update(str(id_) for id_ in ids)
+        rows = self.rows[resource]
+        for data in datas:
+            rows[str(data.id)] = data
+
+    def rows_of(self, resource, ids) -> list:
+        """已获取的关系数据，按get_many返回的顺序"""
+        wanted = {str(id_) for id_ in ids}
+        return [data for id_, data in self.rows[resource].items() if id_ in wanted]
+
+    @staticmethod
+    def result_key(resource, ids, limit=None) -> tuple:
+        return resource, tuple(str(id_) for id_ in ids), limit
+
+    def get(self, resource, ids, limit=None) -> Optional[list]:
+        """
+        取有include_limit的关系数据
+        Args:
+            resource: 关系资源类
+            ids: 关系ids，顺序不同时重新查询
+            limit: include_limit
+
+        Returns: 关系数据，未获取时为None
+        """
+        return self.results.get(self.result_key(resource, ids, limit))
+
+    def add(self, resource, ids, datas, limit=None):
+        """登记有include_limit的关系数据"""
+        self.results[self.result_key(resource, ids, limit)] = datas
+
+    def identifier(self, type_, id_) -> dict:
+        """没有meta的资源标识符，相同(type, id)共用"""
+        key = (type_, id_)  # 保留id原类型，输出与未共用时相同
+        identifier = self.identifiers.get(key)
+        if identifier is None:
+            identifier = self.identifiers[key] = {'type': type_, 'id': id_, 'meta': None}
+        return identifier
+
+    def mark_serialized(self, type_, id_) -> bool:
+        """标记资源已序列化，首次标记返回True"""
+        key = self.key(type_, id_)
+        if key in self.serialized:
+            return False
+        self.serialized.add(key)
+        return True
+
+
 class SessionMangerBase:
     """数据库链接管理基类"""
     _instance = None
@@ -174,6 +289,162 @@ class SessionMangerBase:
         pass
 
 
+# 当前请求已获取的会话 {会话池: [空闲会话]}
+_session_scope = ContextVar('jsonapi_session_scope', default=None)
+
+
+@asynccontextmanager
+async def session_scope():
+    """
+    请求范围的会话复用。范围内各次connect_data复用已获取的会话，并发取数时才从池中获取新的会话，
+    范围结束时全部归还会话池。嵌套时使用最外层范围
+    """
+    if _session_scope.get() is not None:
+        yield
+        return
+    scope = {}
+    token = _session_scope.set(scope)
+    try:
+        yield
+    finally:
+        _session_scope.reset(token)
+        for pool, sessions in scope.items():
+            for session in sessions:
+                await pool.release(session)
+
+
+class SessionPool:
+    """
+    异步会话池基类，替代单例的SessionMangerBase。子类实现create，按需实现dispose和reset。
+    池大小有界，获取会话超时抛出PoolTimeout，metrics()返回池的统计
+        Args:
+            maxsize: 最大会话数
+            timeout: 获取会话的超时秒数
+    """
+
+    def __init__(self, maxsize: int = 10, timeout: float = 10):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._idle = deque()
+        self._size = 0  # 已创建的会话数
+        self._condition = None  # 第一次获取时创建，绑定运行中的事件循环
+        self.in_use = 0
+        self.waiting = 0
+        self.created = 0
+        self.acquired = 0
+        self.timeouts = 0
+
+    async def create(self):
+        """创建会话"""
+        raise NotImplementedError
+
+    async def dispose(self, session) -> None:
+        """关闭会话"""
+        pass
+
+    async def reset(self, session) -> None:
+        """会话归还前的清理，如回滚未提交的事务"""
+        pass
+
+    def _get_condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self):
+        """从池中获取会话，没有空闲会话且已达最大数时等待，超时抛出PoolTimeout"""
+        condition = self._get_condition()
+        async with condition:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(condition.wait_for(lambda: self._idle or self._size < self.maxsize),
+                                       self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise PoolTimeout(detail='获取数据库会话超时')
+            finally:
+                self.waiting -= 1
+            session = self._idle.pop() if self._idle else None
+            if session is None:
+                self._size += 1
+        if session is None:
+            try:
+                session = await self.create()
+            except BaseException:
+                async with condition:
+                    self._size -= 1
+                    condition.notify()
+                raise
+            self.created += 1
+        self.in_use += 1
+        self.acquired += 1
+        return session
+
+    async def release(self, session) -> None:
+        """归还会话"""
+        self.in_use -= 1
+        condition = self._get_condition()
+        try:
+            await self.reset(session)
+        except BaseException:
+            await self.dispose(session)
+            async with condition:
+                self._size -= 1
+                condition.notify()
+            raise
+        async with condition:
+            self._idle.append(session)
+            condition.notify()
+
+    @asynccontextmanager
+    async def session(self):
+        """connect_data中使用。在session_scope内时复用本次请求的会话"""
+        scope = _session_scope.get()
+        idle = scope.setdefault(self, []) if scope is not None else None
+        session = idle.pop() if idle else await self.acquire()
+        try:
+            yield session
+        finally:
+            if idle is not None:
+                idle.append(session)
+            else:
+                await self.release(session)
+
+    async def close(self) -> None:
+        """关闭全部空闲会话"""
+        while self._idle:
+            await self.dispose(self._idle.pop())
+            self._size -= 1
+
+    def metrics(self) -> dict:
+        """会话池统计"""
+        return {'maxsize': self.maxsize, 'size': self._size, 'idle': len(self._idle), 'in_use': self.in_use,
+                'waiting': self.waiting, 'created': self.created, 'acquired': self.acquired,
+                'timeouts': self.timeouts}
+
+
+class SQLiteSessionPool(SessionPool):
+    """
+    SQLite会话池，参考实现，可用于测试。默认共享的内存数据库
+        Args:
+            database: 数据库，sqlite3.connect的uri
+    """
+
+    def __init__(self, database: str = 'file:jsonapi?mode=memory&cache=shared', maxsize: int = 10,
+                 timeout: float = 10):
+        super().__init__(maxsize=maxsize, timeout=timeout)
+        self.database = database
+
+    async def create(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.database, uri=True, check_same_thread=False)
+
+    async def dispose(self, session: sqlite3.Connection) -> None:
+        session.close()
+
+    async def reset(self, session: sqlite3.Connection) -> None:
+        session.rollback()
+
+
 if __name__ == '__main__':
     a = {'a': {'b': {'c': 2}, 'd': {'c': 3}}}
     update_dict(a, {'c': 's'})
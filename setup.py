@@ -14,6 +14,7 @@ setup(
     author_email="socar@so.car",
     description="Api架构框架",
     install_requires=['fastapi==0.92.0', 'jquery-unparam', 'PyYAML', 'treelib', 'bitarray', 'python-multipart'],
+    extras_require={'orjson': ['orjson'], 'ujson': ['ujson']},  # 可选的快速json编码器
 
     # 项目主页
     url="https://gitee.com/socar/api_frame",
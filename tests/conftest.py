@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试用的资源：文章(作者、标签)、人员(朋友)、标签，数据保存在内存中
+"""
+import copy
+import sys
+import os
+from typing import List
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi_jsonapi import BaseResource, SchemaBase, Relationship  # noqa: E402
+from fastapi_jsonapi.field import Field  # noqa: E402
+
+PEOPLE = {str(i): dict(id=str(i), name='p%s' % i, friend=str((i + 1) % 5)) for i in range(5)}
+TAGS = {str(i): dict(id=str(i), label='t%s' % i) for i in range(10)}
+ARTICLES = {str(i): dict(id=str(i), title='a%s' % i, views=i * 10, author=str(i % 5),
+                         tags=[str(i % 10), str((i + 1) % 10)]) for i in range(30)}
+DATA = {'person': PEOPLE, 'tag': TAGS, 'article': ARTICLES}
+CALLS = []  # get_many/count 的调用记录
+
+
+def ids_of(args) -> List[str]:
+    value = args.get_field_value('id')
+    if value is None:
+        return None
+    return [str(v) for v in value] if isinstance(value, (list, tuple)) else [str(value)]
+
+
+class PersonModel(SchemaBase):
+    id: str = Field(None)
+    name: str = Field(None)
+    friend: str = Field(None, isrel=True)
+
+
+class TagModel(SchemaBase):
+    id: str = Field(None)
+    label: str = Field(None)
+
+
+class ArticleModel(SchemaBase):
+    id: str = Field(None)
+    title: str = Field(None)
+    views: int = Field(None, inmany=False)
+    author: str = Field(None, isrel=True)
+    tags: List[str] = Field(None, isrel=True)
+
+
+def make_get_many(type_, model):
+    async def get_many(self, *args, **kwargs):
+        CALLS.append(type_)
+        ids = ids_of(self.args)
+        rows = [row for id_, row in DATA[type_].items() if ids is None or id_ in ids]
+        for sort in reversed(self.args.sort or []):
+            rows.sort(key=lambda row: row[sort.field], reverse=not sort.asc)
+        if self.args.limit:
+            skip = int(self.args.skip or 0)
+            rows = rows[skip: skip + int(self.args.limit)]
+        return [model(**row) for row in rows]
+    return get_many
+
+
+async def count(self):
+    CALLS.append('count')
+    return len(DATA[self.Meta.type_])
+
+
+class Person(BaseResource):
+    model = PersonModel
+
+    class Meta:
+        type_ = 'person'
+        link = '/person'
+
+    class RelResources:
+        friend = Relationship(rel_resource='Person', mapping_field='friend')
+
+    get_many = make_get_many('person', PersonModel)
+    count = count
+
+
+class Tag(BaseResource):
+    model = TagModel
+
+    class Meta:
+        type_ = 'tag'
+        link = '/tag'
+
+    get_many = make_get_many('tag', TagModel)
+    count = count
+
+
+class Article(BaseResource):
+    model = ArticleModel
+    allow_all_pages = True
+
+    class Meta:
+        type_ = 'article'
+        link = '/article'
+
+    class RelResources:
+        author = Relationship(rel_resource='Person', mapping_field='author')
+        tags = Relationship(rel_resource='Tag', mapping_field='tags', one_to_one=False)
+
+    get_many = make_get_many('article', ArticleModel)
+    count = count
+
+
+class Root(BaseResource):
+    childs = [Article, Person, Tag]
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+    Root.register_routes(app)
+    return app
+
+
+@pytest.fixture(autouse=True)
+def data():
+    """每个测试使用原始数据"""
+    saved = copy.deepcopy(DATA)
+    CALLS.clear()
+    yield DATA
+    for type_, rows in saved.items():
+        DATA[type_].clear()
+        DATA[type_].update(rows)
+
+
+@pytest.fixture
+def client() -> TestClient:
+    return TestClient(make_app())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import DATA, Article, ArticleModel, make_app
+
+EVENTS = []
+
+
+def add(id_):
+    return {'op': 'add', 'data': {'type': 'article', 'id': id_, 'attributes': {'title': 'n' + id_}}}
+
+
+def remove(id_):
+    return {'op': 'remove', 'ref': {'type': 'article', 'id': id_}}
+
+
+@pytest.fixture
+def atomic_client(monkeypatch):
+    """文章资源开启原子操作接口，post/delete修改内存数据，事务事件记录在EVENTS"""
+    EVENTS.clear()
+
+    async def post(self, *args, **kwargs):
+        data = self.request_body.data
+        if data.id == 'bad':
+            raise ValueError('bad')
+        DATA['article'][data.id] = dict(id=data.id, title=data.attributes.title, views=0, author=None, tags=[])
+        EVENTS.append(('post', data.id))
+        return ArticleModel(**DATA['article'][data.id])
+
+    async def delete(self, *args, **kwargs):
+        id_ = self.request_context['id']
+        EVENTS.append(('delete', id_))
+        return ArticleModel(**DATA['article'].pop(id_))
+
+    for name in ('begin', 'commit', 'rollback'):
+        async def hook(self, name=name):
+            EVENTS.append(name)
+        monkeypatch.setattr(Article, 'atomic_' + name, hook)
+    monkeypatch.setattr(Article, 'methods', Article.methods | {'ATOMIC'})
+    monkeypatch.setattr(Article, 'post', post)
+    monkeypatch.setattr(Article, 'delete', delete)
+    return TestClient(make_app(), raise_server_exceptions=False)
+
+
+def test_atomic_route_is_opt_in(client):
+    assert 'ATOMIC' not in Article.methods
+    response = client.post('/article/atomic', json={'atomic:operations': [remove('1')]})
+    assert response.status_code in (404, 405)
+    assert '1' in DATA['article']
+
+
+def test_atomic_operations(atomic_client):
+    response = atomic_client.post('/article/atomic', json={'atomic:operations': [add('100'), remove('1')]})
+    assert response.status_code == 200
+    results = response.json()['atomic:results']
+    assert results[0]['data']['id'] == '100'
+    assert results[1] == {}
+    assert EVENTS == ['begin', ('post', '100'), ('delete', '1'), 'commit']
+    assert '100' in DATA['article'] and '1' not in DATA['article']
+
+
+def test_atomic_bulk_hook(atomic_client, monkeypatch):
+    async def post_many(self, operations):
+        EVENTS.append(('post_many', [operation.data.id for operation in operations]))
+        return [ArticleModel(id=operation.data.id, title=operation.data.attributes.title) for operation in operations]
+
+    monkeypatch.setattr(Article, 'post_many', post_many)
+    response = atomic_client.post('/article/atomic', json={'atomic:operations': [add('100'), add('101'), remove('1')]})
+    assert response.status_code == 200
+    assert [result.get('data', {}).get('id') for result in response.json()['atomic:results']] == ['100', '101', None]
+    assert EVENTS == ['begin', ('post_many', ['100', '101']), ('delete', '1'), 'commit']
+
+
+def test_atomic_rollback(atomic_client):
+    response = atomic_client.post('/article/atomic', json={'atomic:operations': [remove('1'), add('bad'), remove('2')]})
+    assert response.status_code == 500
+    assert EVENTS == ['begin', ('delete', '1'), 'rollback']  # 失败后的操作不执行，不提交
+
+
+def test_atomic_unknown_type(atomic_client):
+    operation = {'op': 'remove', 'ref': {'type': 'unknown', 'id': '1'}}
+    response = atomic_client.post('/article/atomic', json={'atomic:operations': [operation]})
+    assert response.status_code == 400
+    assert EVENTS == []
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import asyncio
+import base64
+import json
+import math
+import random
+import time
+
+import pytest
+from fastapi.security import SecurityScopes
+from fastapi.testclient import TestClient
+from bitarray import bitarray
+from bitarray.util import ba2base, base2ba
+from treelib import Node, Tree
+
+from fastapi_jsonapi.auth import ScopeTree, SecurityConfig, User
+from fastapi_jsonapi.exception import AuthError
+
+from conftest import Article, Person, Root, Tag, make_app
+
+SCOPES = [{'scope': 'admin', 'name': '管理', 'id': 0, 'pid': None},
+          {'scope': 'article', 'name': '文章', 'id': 1, 'pid': 0},
+          {'scope': 'person', 'name': '人员', 'id': 2, 'pid': 0}]
+
+
+class Security(SecurityConfig):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = 0
+
+    async def auth(self, security_scopes: SecurityScopes, token: str) -> User:
+        self.calls += 1
+        return User(id=token, scope=['article'])
+
+
+def jwt(exp: float) -> str:
+    payload = base64.urlsafe_b64encode(json.dumps({'sub': '1', 'exp': exp}).encode()).decode().rstrip('=')
+    return 'header.%s.signature' % payload
+
+
+def verify(security: SecurityConfig, token: str) -> User:
+    return asyncio.run(security.verify(SecurityScopes(scopes=['article']), token))
+
+
+def test_token_cache_is_off_by_default():
+    security = Security(api_scopes={}, cert='', scopes=SCOPES)
+    token = jwt(time.time() + 3600)
+    for _ in range(3):
+        verify(security, token)
+    assert security.calls == 3
+
+
+def test_token_cache_is_capped_by_exp():
+    security = Security(api_scopes={}, cert='', scopes=SCOPES, token_ttl=60)
+    token = jwt(time.time() + 3600)
+    verify(security, token)
+    verify(security, token)
+    assert security.calls == 1
+    expired = jwt(time.time() - 1)
+    verify(security, expired)
+    verify(security, expired)
+    assert security.calls == 3  # 已过期的token不缓存
+    assert security.token_expires('not-a-jwt') is None
+
+
+def test_token_cache_entry_expires_with_token(monkeypatch):
+    security = Security(api_scopes={}, cert='', scopes=SCOPES, token_ttl=60)
+    now = time.time()
+    token = jwt(now + 5)
+    verify(security, token)
+    monotonic = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: monotonic + 6)
+    verify(security, token)
+    assert security.calls == 2
+
+
+def test_revoke():
+    security = Security(api_scopes={}, cert='', scopes=SCOPES, token_ttl=60)
+    token = jwt(time.time() + 3600)
+    verify(security, token)
+    security.revoke(token)
+    verify(security, token)
+    assert security.calls == 2
+
+
+class ScopeSecurity(SecurityConfig):
+    """token为用户的scope，用'-'分隔。拥有父scope即拥有子scope"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checked = []
+
+    async def auth(self, security_scopes: SecurityScopes, token: str) -> User:
+        self.checked.append(tuple(security_scopes.scopes))
+        granted = self.scope_tree.children(token.split('-'))
+        if security_scopes.scopes and not set(security_scopes.scopes).issubset(granted):
+            raise AuthError(detail='没有权限')
+        return User(id=token, scope=token.split('-'))
+
+
+@pytest.fixture
+def secure_client(monkeypatch):
+    security = ScopeSecurity(api_scopes={'/article': {'GET': ['article']}, '/person': {'GET': ['person']},
+                                         '/tag': {'GET': ['article']}},
+                             cert='', token_url='token', scopes=SCOPES)
+    for resource in (Root, Article, Person, Tag):
+        monkeypatch.setattr(resource, 'Auth', security)
+    client = TestClient(make_app())
+    client.security = security
+    return client
+
+
+def get(client, url, token):
+    return client.get(url, headers={'Authorization': 'Bearer %s' % token})
+
+
+def test_include_auth_verifies_token_once(secure_client):
+    assert get(secure_client, '/article?include=author', 'article').status_code == 200
+    secure_client.security.checked.clear()
+    assert get(secure_client, '/article?include=author.friend,tags', 'article').status_code == 401
+    assert secure_client.security.checked == [('article',)]  # include的scope不再逐个调用auth
+    secure_client.security.checked.clear()
+    assert get(secure_client, '/article?include=author.friend', 'article-person').status_code == 200
+    assert secure_client.security.checked == [('article',)]
+
+
+def test_include_auth_honors_scope_hierarchy(secure_client):
+    # admin是article和person的父scope
+    assert get(secure_client, '/article?include=author.friend,tags', 'admin').status_code == 200
+    assert get(secure_client, '/person?include=friend.friend', 'admin').status_code == 200
+    assert get(secure_client, '/person?include=friend.friend', 'article').status_code == 401
+
+
+def test_unknown_nested_include(secure_client):
+    assert get(secure_client, '/article?include=author.bogus', 'admin').status_code == 400
+
+
+class RecursiveScopeTree:
+    """优化前的scope树：递归求子孙scope，按集合生成位图，用于对照"""
+
+    def __init__(self, project_scopes):
+        self.scope_dict = {scope['scope']: scope['id'] for scope in project_scopes}
+        self.scope_tree = Tree()
+        for scope in project_scopes:
+            node = Node(data=scope['scope'], tag=scope['name'], identifier=scope['id'])
+            self.scope_tree.add_node(node, parent=scope['pid'])
+
+    def sub(self, tag):
+        sub = []
+        for child in self.scope_tree.children(self.scope_dict[tag]):
+            sub.append(child.data)
+            sub = sub + self.sub(child.data)
+        return sub
+
+    def children(self, tags):
+        family = []
+        for node in tags:
+            family.append(node)
+            family = family + self.sub(node)
+        return list(set(family))
+
+    def to_base(self, checked):
+        family = self.children(checked)
+        ba = bitarray(math.ceil(len(self.scope_dict) / 6) * 6)
+        ba.setall(0)
+        for item in self.scope_dict:
+            if item in family:
+                ba[self.scope_dict[item]] = 1
+        return str(ba2base(64, ba))
+
+    def to_sope(self, ba_str):
+        ba = base2ba(64, ba_str)
+        return [item for item, index in self.scope_dict.items() if index <= len(ba) - 1 and ba[index]]
+
+
+def test_scope_tree_matches_recursive_closure():
+    rand = random.Random(19)
+    scopes = [{'scope': 's0', 'name': 's0', 'id': 0, 'pid': None}]
+    for i in range(1, 400):
+        scopes.append({'scope': 's%s' % i, 'name': 's%s' % i, 'id': i, 'pid': rand.randrange(i)})
+    tree, old = ScopeTree(scopes), RecursiveScopeTree(scopes)
+    for scope in scopes:
+        assert tree.sub(scope['scope']) == old.sub(scope['scope'])
+    for _ in range(200):
+        tags = rand.sample([scope['scope'] for scope in scopes], rand.randint(0, 8))
+        assert sorted(tree.children(tags)) == sorted(old.children(tags))
+        ba_str = tree.to_base(tags)
+        assert ba_str == old.to_base(tags)
+        assert tree.to_sope(ba_str) == old.to_sope(ba_str)
+        required = rand.sample([scope['scope'] for scope in scopes], rand.randint(1, 3))
+        assert tree.covers(tree.bits(required, family=False), tags) == set(required).issubset(old.children(tags))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from fastapi_jsonapi import BaseResource, SchemaBase, Relationship
+from fastapi_jsonapi.field import Field
+
+TENANTS = []  # batch_fun中读取的请求头
+
+
+class PetModel(SchemaBase):
+    id: str = Field(None)
+
+
+class KeeperModel(SchemaBase):
+    id: str = Field(None)
+
+
+class ShelfModel(SchemaBase):
+    id: str = Field(None)
+    keeper: str = Field(None, isrel=True)
+
+
+class Pet(BaseResource):
+    model = PetModel
+
+    class Meta:
+        type_ = 'pet'
+        link = '/pet'
+
+    async def get_many(self, *args, **kwargs):
+        return [PetModel(id=id_) for id_ in self.args.get_field_value('id') or []]
+
+
+class Keeper(BaseResource):
+    model = KeeperModel
+
+    class Meta:
+        type_ = 'keeper'
+        link = '/keeper'
+
+    class RelResources:
+        pets = Relationship(rel_resource='Pet', batch_fun='load_pets', one_to_one=False)
+
+    async def get_many(self, *args, **kwargs):
+        return [KeeperModel(id=id_) for id_ in self.args.get_field_value('id') or ['1']]
+
+    async def load_pets(self, datas):
+        TENANTS.append(self.request.headers.get('x-tenant') if self.request else None)
+        return {data.id: ['cat%s' % data.id] for data in datas}
+
+
+class OtherKeeper(Keeper):
+    """与Keeper相同type、相同关系名，batch_fun不同"""
+
+    class Meta:
+        type_ = 'keeper'
+        link = '/other_keeper'
+
+    async def load_pets(self, datas):
+        return {data.id: ['dog%s' % data.id] for data in datas}
+
+
+class Shelf(BaseResource):
+    model = ShelfModel
+
+    class Meta:
+        type_ = 'shelf'
+        link = '/shelf'
+
+    class RelResources:
+        keeper = Relationship(rel_resource='Keeper', mapping_field='keeper')
+        other_keeper = Relationship(rel_resource='OtherKeeper', mapping_field='keeper')
+
+    async def get_many(self, *args, **kwargs):
+        return [ShelfModel(id='1', keeper='7')]
+
+
+class ShelfRoot(BaseResource):
+    childs = [Shelf, Keeper, OtherKeeper, Pet]
+
+
+@pytest.fixture
+def shelf_client() -> TestClient:
+    TENANTS.clear()
+    app = FastAPI()
+    ShelfRoot.register_routes(app)
+    return TestClient(app)
+
+
+def test_batch_ids_are_kept_per_resource(shelf_client):
+    response = shelf_client.get('/shelf?include=keeper.pets,other_keeper.pets')
+    assert response.status_code == 200
+    pets = sorted(item['id'] for item in response.json()['included'] if item['type'] == 'pet')
+    assert pets == ['cat7', 'dog7']
+
+
+def test_nested_batch_fun_sees_the_request(shelf_client):
+    response = shelf_client.get('/shelf?include=keeper.pets', headers={'x-tenant': 'acme'})
+    assert response.status_code == 200
+    assert TENANTS == ['acme']
+    assert [item['id'] for item in response.json()['included'] if item['type'] == 'pet'] == ['cat7']
+
+
+def test_batch_fun_on_main_resource(shelf_client):
+    response = shelf_client.get('/keeper?include=pets')
+    assert response.status_code == 200
+    assert response.json()['data'][0]['relationships']['pets']['data'] == [
+        {'id': 'cat1', 'type': 'pet', 'meta': None}]
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import pytest
+from fastapi.security import SecurityScopes
+from fastapi.testclient import TestClient
+
+from fastapi_jsonapi.auth import SecurityConfig, User
+from fastapi_jsonapi.cache import MemoryCache, cache_backends
+
+from conftest import CALLS, DATA, Article, Person, PersonModel, Root, Tag, make_app
+
+
+class TokenSecurity(SecurityConfig):
+    """token为用户id，全部用户的scope相同"""
+
+    async def auth(self, security_scopes: SecurityScopes, token: str) -> User:
+        return User(id=token, scope=['article'])
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = MemoryCache()
+    for resource in (Article, Person):
+        monkeypatch.setattr(resource, 'response_cache', cache)
+    yield cache
+    cache_backends.remove(cache)
+
+
+def get(client, url, **kwargs):
+    CALLS.clear()
+    response = client.get(url, **kwargs)
+    assert response.status_code == 200
+    return response
+
+
+def test_cache_hit_and_tag_invalidation(client, cache, monkeypatch):
+    async def patch(self, *args, **kwargs):
+        DATA['person']['1']['name'] = 'changed'
+        return PersonModel(**DATA['person']['1'])
+
+    monkeypatch.setattr(Person, 'patch', patch)
+    first = get(client, '/article?include=author&page[limit]=2')
+    assert CALLS == ['article', 'count', 'person']
+    second = get(client, '/article?include=author&page[limit]=2')
+    assert CALLS == []
+    assert second.content == first.content
+    assert cache.info()['hits'] == 1
+    get(client, '/article?include=author&page[limit]=3')
+    assert CALLS  # 查询参数不同
+
+    response = client.patch('/person/3', json={'data': {'type': 'person', 'id': '3', 'attributes': {}}})
+    assert response.status_code == 200
+    get(client, '/article?include=author&page[limit]=2')
+    assert CALLS == []  # 未include person 3
+
+    response = client.patch('/person/1', json={'data': {'type': 'person', 'id': '1', 'attributes': {}}})
+    assert response.status_code == 200
+    response = get(client, '/article?include=author&page[limit]=2')
+    assert CALLS == ['article', 'count', 'person']
+    assert [item['attributes']['name'] for item in response.json()['included']] == ['p0', 'changed']
+
+
+def test_cache_is_per_user(client, cache, monkeypatch):
+    get_many = Article.get_many
+
+    async def own_articles(self, *args, **kwargs):
+        return [data for data in await get_many(self, *args, **kwargs) if data.author == self.user.id]
+
+    security = TokenSecurity(api_scopes={'/article': {'GET': ['article']}}, cert='', token_url='token',
+                             scopes=[{'scope': 'article', 'name': '文章', 'id': 0, 'pid': None}])
+    for resource in (Root, Article, Person, Tag):
+        monkeypatch.setattr(resource, 'Auth', security)
+    monkeypatch.setattr(Article, 'get_many', own_articles)
+    client = TestClient(make_app())
+
+    def ids(token):
+        response = get(client, '/article?page[limit]=30', headers={'Authorization': 'Bearer %s' % token})
+        return {item['id'] for item in response.json()['data']}
+
+    def own(author):
+        return {id_ for id_, row in DATA['article'].items() if row['author'] == author}
+
+    assert ids('1') == own('1')
+    assert ids('2') == own('2')  # scope相同的其他用户
+    assert ids('1') == own('1')
+    assert cache.info()['hits'] == 1
+
+
+def test_cache_is_per_host(client, cache):
+    first = get(client, '/article/1', headers={'host': 'a.example'})
+    second = get(client, '/article/1', headers={'host': 'b.example'})
+    assert '//a.example/' in first.json()['data']['links']['self']
+    assert '//b.example/' in second.json()['data']['links']['self']
+    assert cache.info()['hits'] == 0
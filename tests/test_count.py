@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import asyncio
+
+from fastapi.security import SecurityScopes
+from fastapi.testclient import TestClient
+
+from fastapi_jsonapi.auth import SecurityConfig, User
+
+from conftest import CALLS, DATA, Article, Person, Root, Tag, make_app
+
+
+def test_count_runs_after_get_many_by_default(client, monkeypatch):
+    get_many = Article.get_many
+    seen = []
+
+    async def filtered_get_many(self, *args, **kwargs):
+        self.args.add_filter_to_and('title', 'eq', 'a1')  # get_many修改查询参数
+        return await get_many(self, *args, **kwargs)
+
+    async def count(self):
+        CALLS.append('count')
+        seen.append(self.args.filter_key())
+        return 1
+
+    monkeypatch.setattr(Article, 'get_many', filtered_get_many)
+    monkeypatch.setattr(Article, 'count', count)
+    assert Article.concurrent_count is False
+    response = client.get('/article')
+    assert response.status_code == 200
+    assert CALLS == ['article', 'count']
+    assert seen == [('and', (('title', 'eq', "'a1'"),))]
+
+
+def test_concurrent_count_is_cancelled_on_error(client, monkeypatch):
+    events = []
+
+    async def slow_count(self):
+        events.append('count')
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            events.append('cancelled')
+            raise
+        return 30
+
+    async def handler_many_data(self, data):
+        await asyncio.sleep(0)
+        raise ValueError('序列化出错')
+
+    async def after_request(cls, request=None, extract_params=None):
+        events.append('after_request')
+
+    monkeypatch.setattr(Article, 'concurrent_count', True)
+    monkeypatch.setattr(Article, 'count', slow_count)
+    monkeypatch.setattr(Article, 'handler_many_data', handler_many_data)
+    monkeypatch.setattr(Article, 'after_request', classmethod(after_request))
+    response = client.get('/article')
+    assert response.status_code == 500
+    assert events == ['count', 'cancelled', 'after_request']  # 请求结束前已取消
+
+
+def test_concurrent_count(client, monkeypatch):
+    monkeypatch.setattr(Article, 'concurrent_count', True)
+    response = client.get('/article?page[limit]=2')
+    assert response.status_code == 200
+    assert sorted(CALLS) == ['article', 'count']
+    assert response.json()['meta']['pagination']['total'] == 30
+
+
+class TokenSecurity(SecurityConfig):
+    """token为用户id，全部用户的scope相同"""
+
+    async def auth(self, security_scopes: SecurityScopes, token: str) -> User:
+        return User(id=token, scope=['article'])
+
+
+def test_cached_count_is_per_user(monkeypatch):
+    async def own_count(self):
+        CALLS.append('count')
+        return sum(1 for row in DATA['article'].values() if row['author'] == self.user.id)
+
+    security = TokenSecurity(api_scopes={'/article': {'GET': ['article']}}, cert='', token_url='token',
+                             scopes=[{'scope': 'article', 'name': '文章', 'id': 0, 'pid': None}])
+    for resource in (Root, Article, Person, Tag):
+        monkeypatch.setattr(resource, 'Auth', security)
+    monkeypatch.setattr(Article, 'count', own_count)
+    monkeypatch.setattr(Article, 'count_mode', 'cached')
+    DATA['article']['0']['author'] = '2'  # 用户1有6篇，用户2有8篇
+    DATA['article']['5']['author'] = '2'
+    client = TestClient(make_app())
+
+    def total(token):
+        response = client.get('/article?page[limit]=1', headers={'Authorization': 'Bearer %s' % token})
+        assert response.status_code == 200
+        return response.json()['meta']['pagination']['total']
+
+    assert total('1') == 6
+    assert total('2') == 8
+    assert total('1') == 6
+    assert CALLS.count('count') == 2  # 同一用户第二次使用缓存
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import operator
+from urllib.parse import urlsplit
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from conftest import DATA, CALLS, ArticleModel, count
+from fastapi_jsonapi import BaseResource
+from fastapi_jsonapi.query import FilterAnd, FilterOr
+
+OPS = {'eq': operator.eq, 'gt': operator.gt, 'lt': operator.lt}
+
+
+def match(row: dict, filter_) -> bool:
+    if isinstance(filter_, FilterOr):
+        return any(match(row, item) for item in filter_.filters)
+    if isinstance(filter_, FilterAnd):
+        return all(match(row, item) for item in filter_.filters)
+    return OPS[filter_.op](row[filter_.field], filter_.value)
+
+
+async def get_many(self, *args, **kwargs):
+    CALLS.append('article')
+    cond = self.args.cursor.filter()
+    rows = [row for row in DATA['article'].values() if cond is None or match(row, cond)]
+    for sort in reversed(self.args.sort):
+        rows.sort(key=lambda row: row[sort.field], reverse=not sort.asc)
+    return [ArticleModel(**row) for row in rows[:self.args.limit]]
+
+
+class CursorArticle(BaseResource):
+    """游标分页的文章，get_many按args.cursor.filter()定位"""
+    model = ArticleModel
+    cursor_pagination = True
+    cursor_secret = 'test-secret'
+
+    class Meta:
+        type_ = 'article'
+        link = '/cursor_article'
+
+    get_many = get_many
+    count = count
+
+
+class CursorRoot(BaseResource):
+    childs = [CursorArticle]
+
+
+@pytest.fixture
+def cursor_client() -> TestClient:
+    app = FastAPI()
+    CursorRoot.register_routes(app)
+    return TestClient(app)
+
+
+def follow(link: str) -> str:
+    """链接的路径和查询参数"""
+    url = urlsplit(link)
+    return url.path + '?' + url.query
+
+
+def ids(response) -> list:
+    return [item['id'] for item in response.json()['data']]
+
+
+def test_cursor_walk(cursor_client):
+    response = cursor_client.get('/cursor_article?sort=-views&page[limit]=12')
+    assert response.status_code == 200
+    pages = [ids(response)]
+    assert 'prev' not in response.json()['links']
+    while 'next' in response.json()['links']:
+        response = cursor_client.get(follow(response.json()['links']['next']))
+        assert response.status_code == 200
+        pages.append(ids(response))
+    assert [len(page) for page in pages] == [12, 12, 6]
+    assert sum(pages, []) == [str(i) for i in range(29, -1, -1)]
+
+    response = cursor_client.get(follow(response.json()['links']['prev']))  # 上一页恢复正序
+    assert ids(response) == pages[1]
+
+
+def test_cursor_tampered(cursor_client):
+    token = cursor_client.get('/cursor_article?sort=-views&page[limit]=12').json()['links']['next'].split('page%5Bcursor%5D=')[1]
+    assert cursor_client.get('/cursor_article?sort=-views&page[limit]=12&page[cursor]=' + token).status_code == 200
+    body, sign = token.split('.')
+    for tampered in (body[:-1] + ('A' if body[-1] != 'A' else 'B') + '.' + sign,
+                     body + '.' + sign[:-1] + ('A' if sign[-1] != 'A' else 'B'),
+                     body):
+        response = cursor_client.get('/cursor_article?sort=-views&page[limit]=12&page[cursor]=' + tampered)
+        assert response.status_code == 400
+    # 签名有效但排序参数不一致
+    assert cursor_client.get('/cursor_article?sort=views&page[limit]=12&page[cursor]=' + token).status_code == 400
+
+
+def test_cursor_rejects_offset(cursor_client):
+    assert cursor_client.get('/cursor_article?page[offset]=10').status_code == 400
+
+
+def test_cursor_secret_required(monkeypatch):
+    class NoSecretArticle(BaseResource):
+        model = ArticleModel
+        cursor_pagination = True
+
+        class Meta:
+            type_ = 'article'
+            link = '/no_secret_article'
+
+    class NoSecretRoot(BaseResource):
+        childs = [NoSecretArticle]
+
+    monkeypatch.delenv('JSONAPI_CURSOR_SECRET', raising=False)
+    with pytest.raises(Exception, match='JSONAPI_CURSOR_SECRET'):
+        NoSecretRoot.register_routes(FastAPI())
+    monkeypatch.setenv('JSONAPI_CURSOR_SECRET', 'env-secret')
+    NoSecretRoot.register_routes(FastAPI())  # 环境变量的密钥
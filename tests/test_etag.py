@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import pytest
+
+from conftest import DATA, Article, Person, PersonModel
+
+BODY = {'data': {'type': 'person', 'id': '1', 'attributes': {'name': 'x'}}}
+
+
+@pytest.fixture
+def etag(monkeypatch):
+    async def patch(self, *args, **kwargs):
+        return PersonModel(**DATA['person'][self.request.path_params['id']])
+
+    monkeypatch.setattr(Person, 'patch', patch)
+    monkeypatch.setattr(Person, 'etag', True)
+    monkeypatch.setattr(Article, 'etag', True)
+
+
+@pytest.fixture
+def versions(monkeypatch):
+    versions = {'1': 1}
+    calls = []
+
+    async def data_version(self, id=None):
+        calls.append(id)
+        return versions.get(id, 'all')
+
+    monkeypatch.setattr(Person, 'data_version', data_version)
+    versions['calls'] = calls
+    return versions
+
+
+def test_if_none_match(client, etag):
+    response = client.get('/person/1')
+    assert response.status_code == 200
+    tag = response.headers['etag']
+    assert client.get('/person/1', headers={'If-None-Match': tag}).status_code == 304
+    assert client.get('/person/1', headers={'If-None-Match': 'W/' + tag}).status_code == 304
+    assert client.get('/person/1?fields[person]=name', headers={'If-None-Match': tag}).status_code == 200
+
+
+def test_if_match_without_version_hook(client, etag):
+    tag = client.get('/person/1').headers['etag']
+    assert client.patch('/person/1', json=BODY, headers={'If-Match': tag}).status_code == 200
+    assert client.patch('/person/1', json=BODY, headers={'If-Match': '"other"'}).status_code == 200
+
+
+def test_if_match_with_version_hook(client, etag, versions):
+    tag = client.get('/person/1').headers['etag']
+    assert versions['calls'] == ['1']
+    assert client.patch('/person/1', json=BODY, headers={'If-Match': tag}).status_code == 200
+    assert versions['calls'] == ['1', '1']  # patch时钩子得到路径中的id
+    versions['1'] = 2
+    response = client.patch('/person/1', json=BODY, headers={'If-Match': tag})
+    assert response.status_code == 412
+    assert client.patch('/person/1', json=BODY, headers={'If-Match': '*'}).status_code == 200
+    assert client.patch('/person/1', json=BODY).status_code == 200
+
+
+def test_related_route_version_has_no_parent_id(client, etag, versions):
+    assert client.get('/article/1/author').status_code == 200
+    assert versions['calls'] == [None]
+
+
+def test_api_version_not_shadowed(client, etag, monkeypatch):
+    async def _version(cls, request):
+        return 1
+
+    monkeypatch.setattr(Person, '_version', classmethod(_version))
+    assert Person.version == 1  # 接口版本与data_version钩子互不影响
+    assert client.get('/person/1').status_code == 200
+
+
+
+@pytest.mark.parametrize('enabled', [True, False])
+def test_version_hook_skipped_when_not_overridden(client, etag, monkeypatch, enabled):
+    monkeypatch.setattr(Person, 'etag', enabled)
+    funcs = []
+    connect_data = Person.connect_data
+
+    async def record(self, func, *args, **kwargs):
+        funcs.append(func.__name__)
+        return await connect_data(self, func, *args, **kwargs)
+
+    monkeypatch.setattr(Person, 'connect_data', record)
+    response = client.get('/person/1')
+    assert response.status_code == 200
+    assert ('etag' in response.headers) == enabled  # 没有钩子时ETag按响应内容计算
+    assert client.patch('/person/1', json=BODY, headers={'If-Match': '"other"'}).status_code == 200
+    assert funcs == ['get_many', 'patch']  # 不为data_version获取会话
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+响应与基准一致。golden.json 为实现稀疏字段集、并发include之前的响应文档，
+稀疏字段的响应应等于完整文档去掉未请求的attributes/relationships
+"""
+import copy
+import json
+import os
+
+import pytest
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden.json'), encoding='utf-8') as f:
+    GOLDEN = json.load(f)
+
+
+def sparse(document: dict, fields: dict) -> dict:
+    """按fields {"资源type": [字段]} 裁剪文档中的资源对象"""
+    document = copy.deepcopy(document)
+    data = document['data'] if isinstance(document['data'], list) else [document['data']]
+    for item in data + (document.get('included') or []):
+        for key in ('attributes', 'relationships'):
+            if item['type'] in fields and item.get(key) is not None:
+                item[key] = {name: value for name, value in item[key].items() if name in fields[item['type']]}
+    return document
+
+
+@pytest.mark.parametrize('url', sorted(GOLDEN))
+def test_matches_golden(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.json() == GOLDEN[url]
+
+
+@pytest.mark.parametrize('url, golden, fields', [
+    ('/article?page[limit]=2&fields[article]=title', '/article?page[limit]=2', {'article': ['title']}),
+    ('/article?page[limit]=2&include=author.friend,tags&fields[article]=title,author&fields[person]=name',
+     '/article?page[limit]=2&include=author.friend,tags', {'article': ['title', 'author'], 'person': ['name']}),
+    ('/article/4?include=author,tags&fields[tag]=label&fields[article]=tags', '/article/4?include=author,tags',
+     {'tag': ['label'], 'article': ['tags']}),
+    ('/person?page[limit]=2&include=friend.friend&fields[person]=friend',
+     '/person?page[limit]=2&include=friend.friend', {'person': ['friend']}),
+    ('/article/4/tags?fields[tag]=label', '/article/4/tags', {'tag': ['label']}),
+])
+def test_sparse_matches_golden(client, url, golden, fields):
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.json() == sparse(GOLDEN[golden], fields)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import asyncio
+from typing import List
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from fastapi_jsonapi import BaseResource, SchemaBase, Relationship
+from fastapi_jsonapi.field import Field
+
+from conftest import CALLS, PersonModel, Tag, Person, Article
+
+
+class ReviewModel(SchemaBase):
+    id: str = Field(None)
+    author: str = Field(None, isrel=True)
+
+
+class Editor(BaseResource):
+    """与Person相同type，数据不同：只有偶数id"""
+    model = PersonModel
+
+    class Meta:
+        type_ = 'person'
+        link = '/editor'
+
+    async def get_many(self, *args, **kwargs):
+        CALLS.append('editor')
+        ids = self.args.get_field_value('id') or []
+        return [PersonModel(id=id_, name='editor%s' % id_) for id_ in ids if int(id_) % 2 == 0]
+
+
+class Review(BaseResource):
+    model = ReviewModel
+
+    class Meta:
+        type_ = 'review'
+        link = '/review'
+
+    class RelResources:
+        author = Relationship(rel_resource='Person', mapping_field='author')
+        coauthor = Relationship(rel_resource='Person', mapping_field='author')
+        editor = Relationship(rel_resource='Editor', mapping_field='author')
+
+    async def get_many(self, *args, **kwargs):
+        CALLS.append('review')
+        return [ReviewModel(id=str(i), author=str(i)) for i in range(4)]
+
+
+class ReviewRoot(BaseResource):
+    childs = [Review, Editor]
+
+
+@pytest.fixture
+def review_client() -> TestClient:
+    app = FastAPI()
+    ReviewRoot.register_routes(app)
+    return TestClient(app)
+
+
+def included(response) -> List[tuple]:
+    return [(item['type'], item['id'], item['attributes'].get('name')) for item in response.json()['included']]
+
+
+def test_same_type_resources_query_separately(review_client):
+    response = review_client.get('/review?include=author,editor')
+    assert response.status_code == 200
+    assert CALLS.count('person') == 1
+    assert CALLS.count('editor') == 1  # Person已获取相同的id，Editor仍然查询自己的数据
+    # included按(type, id)去重，先输出的路径优先
+    assert included(response) == [('person', '0', 'p0'), ('person', '1', 'p1'),
+                                  ('person', '2', 'p2'), ('person', '3', 'p3')]
+    response = review_client.get('/review?include=editor,author')
+    assert included(response) == [('person', '0', 'editor0'), ('person', '2', 'editor2'),
+                                  ('person', '1', 'p1'), ('person', '3', 'p3')]
+
+
+def test_same_resource_same_ids_queried_once(review_client):
+    response = review_client.get('/review?include=author,coauthor')
+    assert response.status_code == 200
+    assert CALLS.count('person') == 1
+    assert [id_ for _, id_, _ in included(response)] == ['0', '1', '2', '3']
+
+
+def test_main_rows_are_not_reused_for_include(client):
+    response = client.get('/person?page[limit]=2&include=friend')
+    assert response.status_code == 200
+    assert CALLS.count('person') == 2  # 主资源和include各查询一次
+    assert [item['id'] for item in response.json()['included']] == ['1', '2']
+
+
+def test_included_order_follows_get_many(client, monkeypatch):
+    get_many = Tag.get_many
+
+    async def reversed_get_many(self, *args, **kwargs):
+        return list(reversed(await get_many(self, *args, **kwargs)))
+
+    monkeypatch.setattr(Tag, 'get_many', reversed_get_many)
+    response = client.get('/article?page[limit]=3&include=tags,author')
+    assert [(item['type'], item['id']) for item in response.json()['included']] == [
+        ('tag', '2'), ('tag', '1'), ('tag', '0'), ('person', '0'), ('person', '1')]
+
+
+class SingletonSession:
+    """旧式单例会话：各次get共享同一连接，close关闭连接"""
+
+    def __init__(self):
+        self.conn = None
+
+    def get(self):
+        self.conn = 'open'
+        return self
+
+    def close(self):
+        self.conn = None
+
+
+def test_singleton_session_includes_sequentially(client, monkeypatch):
+    session = SingletonSession()
+
+    def sessioned(get_many):
+        async def wrapper(self, *args, **kwargs):
+            await asyncio.sleep(0.01)
+            assert session.conn == 'open', '连接已被其它取数关闭'
+            return await get_many(self, *args, **kwargs)
+        return wrapper
+
+    for resource in (Article, Person, Tag):
+        monkeypatch.setattr(resource, 'session', session)
+        monkeypatch.setattr(resource, 'get_many', sessioned(resource.get_many))
+    response = client.get('/article?page[limit]=3&include=author.friend,tags')
+    assert response.status_code == 200
+    assert {item['type'] for item in response.json()['included']} == {'person', 'tag'}
+
+
+def test_overlapping_ids_fetch_only_missing_rows(client, monkeypatch):
+    get_many = Person.get_many
+    queried = []
+
+    async def recorded_get_many(self, *args, **kwargs):
+        queried.append(self.args.get_field_value('id'))
+        return await get_many(self, *args, **kwargs)
+
+    monkeypatch.setattr(Person, 'get_many', recorded_get_many)
+    response = client.get('/article?page[limit]=3&include=author,author.friend')
+    assert response.status_code == 200
+    # 文章0,1,10的作者为0,1,0；作者的朋友1,2中只查询缺少的2
+    assert queried == [['0', '1'], ['2']]
+    assert [item['id'] for item in response.json()['included']] == ['0', '1', '2']
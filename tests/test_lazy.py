@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from fastapi_jsonapi.resource import LazyResourceRoute
+from fastapi_jsonapi.util import expand_lazy_routes
+
+from conftest import Article, Person, Tag, Root, make_app
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """记录生成模型和路由的资源"""
+    built = []
+    for resource in (Article, Person, Tag):
+        api = resource._api.__func__
+
+        def _api(cls, api=api, **kwargs):
+            built.append(cls)
+            return api(cls, **kwargs)
+
+        monkeypatch.setattr(resource, '_api', classmethod(_api))
+    return built
+
+
+def lazy_app() -> FastAPI:
+    app = FastAPI()
+    Root.register_routes(app, lazy=True)
+    return app
+
+
+def routes(app) -> list:
+    return [(route.path, tuple(sorted(getattr(route, 'methods', None) or ()))) for route in app.router.routes]
+
+
+def test_lazy_resource_built_on_first_request(builds):
+    app = lazy_app()
+    assert builds == []
+    assert sum(isinstance(route, LazyResourceRoute) for route in app.router.routes) == 3
+    client = TestClient(app)
+    response = client.get('/person/1')
+    assert response.status_code == 200
+    assert response.json()['data']['attributes']['name'] == 'p1'
+    assert builds == [Person]  # 只生成请求的资源
+    assert client.get('/person?page[limit]=2').status_code == 200
+    assert builds == [Person]  # 已替换为真正的路由
+    assert sum(isinstance(route, LazyResourceRoute) for route in app.router.routes) == 2
+
+
+def test_expanded_routes_and_openapi_match_eager(builds):
+    app = lazy_app()
+    app.openapi()  # 生成openapi时展开全部路由
+    assert sorted(builds, key=lambda cls: cls.__name__) == [Article, Person, Tag]
+    assert not any(isinstance(route, LazyResourceRoute) for route in app.router.routes)
+
+    eager = make_app()
+    assert routes(app) == routes(eager)
+    assert app.openapi() == eager.openapi()
+
+    app = lazy_app()
+    expand_lazy_routes(app)
+    assert routes(app) == routes(eager)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+import os
+import subprocess
+import sys
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from fastapi_jsonapi import BaseResource, SchemaBase
+from fastapi_jsonapi.field import Field
+from fastapi_jsonapi.manifest import build_manifest, is_stale, save_manifest, load_manifest, apply_manifest
+from fastapi_jsonapi.resource import LazyResourceRoute
+
+from conftest import Root, make_app
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+
+
+class NoteModel(SchemaBase):
+    id: str = Field(None)
+    title: str = Field(None, mapping=lambda value: value.upper())
+
+
+class Note(BaseResource):
+    model = NoteModel
+
+    class Meta:
+        type_ = 'note'
+        link = '/note'
+
+
+FINGERPRINT = """
+import sys
+sys.path.insert(0, %r)
+import test_manifest
+from fastapi_jsonapi.manifest import build_manifest
+print(build_manifest()['fingerprint'])
+""" % TESTS
+
+
+def test_fingerprint_is_stable_across_processes():
+    fingerprints = {subprocess.run([sys.executable, '-c', FINGERPRINT], capture_output=True, text=True,
+                                   check=True).stdout.strip() for _ in range(2)}
+    assert len(fingerprints) == 1
+
+
+def test_manifest_round_trip(tmp_path):
+    app = make_app()
+    manifest = build_manifest(app)
+    assert set(manifest) == {'version', 'fingerprint', 'openapi'}
+    path = str(tmp_path / 'manifest.json')
+    save_manifest(manifest, path)
+    loaded = load_manifest(path)
+    assert json.loads(json.dumps(loaded)) == loaded
+    assert not is_stale(loaded)
+    app = make_app()
+    assert apply_manifest(app, loaded)
+    assert app.openapi() == manifest['openapi']
+    assert is_stale(dict(loaded, fingerprint='0'))
+
+
+def test_apply_manifest_skips_model_generation():
+    manifest = build_manifest(make_app())
+    app = FastAPI()
+    Root.register_routes(app, lazy=True)
+    assert apply_manifest(app, manifest)
+    assert app.openapi() == manifest['openapi']
+    # openapi取自清单，不展开路由，模型和查询计划在第一次请求时生成
+    assert sum(isinstance(route, LazyResourceRoute) for route in app.router.routes) == 3
+    assert TestClient(app).get('/person/1').status_code == 200
+    assert sum(isinstance(route, LazyResourceRoute) for route in app.router.routes) == 2
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from fastapi_jsonapi import BaseResource, SchemaBase, Relationship
+from fastapi_jsonapi.field import Field
+from fastapi_jsonapi.meta import relationship_graph
+
+from conftest import Article, Person, Tag
+
+
+class PendingModel(SchemaBase):
+    id: str = Field(None)
+    target: str = Field(None, isrel=True)
+
+
+class Pending(BaseResource):
+    """关系资源在之后注册"""
+    model = PendingModel
+
+    class Meta:
+        type_ = 'pending'
+        link = '/pending'
+
+    class RelResources:
+        target = Relationship(rel_resource='PendingTarget', mapping_field='target')
+
+
+def test_relationships_scanned_once(monkeypatch):
+    scans = []
+    scan_rel_resources = Article.scan_rel_resources.__func__
+
+    def scan(cls):
+        scans.append(cls)
+        return scan_rel_resources(cls)
+
+    monkeypatch.setattr(Article, 'scan_rel_resources', classmethod(scan))
+    relationship_graph.clear()
+    rels = Article.rel_resources()
+    assert set(rels) == {'author', 'tags'}
+    assert Article.rel_resources() is rels
+    assert relationship_graph.target(Article, 'tags') is Tag
+    assert scans == [Article]
+
+
+def test_resolve_and_include_paths():
+    assert relationship_graph.resolve(Article, 'author.friend') is Person
+    assert relationship_graph.resolve(Article, 'author.missing') is None
+    assert relationship_graph.include_paths(Person, 2) == {'friend', 'friend.friend'}
+    assert 'author.friend.friend' in relationship_graph.include_paths(Article)
+    assert relationship_graph.include_paths(Article) is relationship_graph.include_paths(Article)
+
+
+def test_registering_resource_clears_graph():
+    assert relationship_graph.target(Pending, 'target') is None  # 关系资源未注册
+
+    class PendingTarget(BaseResource):
+        model = PendingModel
+
+        class Meta:
+            type_ = 'pending_target'
+            link = '/pending_target'
+
+    assert relationship_graph.target(Pending, 'target') is PendingTarget
+    assert relationship_graph.include_paths(Pending, 1) == {'target'}
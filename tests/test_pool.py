@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import asyncio
+import sqlite3
+from collections import defaultdict
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from fastapi_jsonapi import BaseResource, Relationship
+from fastapi_jsonapi.exception import PoolTimeout
+from fastapi_jsonapi.util import SQLiteSessionPool
+
+from conftest import ArticleModel, PersonModel
+
+POOL = SQLiteSessionPool(database='file:jsonapi_pool_test?mode=memory&cache=shared', maxsize=4)
+SESSIONS = defaultdict(set)  # {请求编号: 主资源取数使用的会话}
+PEAK = []  # get_many执行中池的in_use
+
+
+class PoolPerson(BaseResource):
+    model = PersonModel
+    session = POOL
+
+    class Meta:
+        type_ = 'person'
+        link = '/pool_person'
+
+    async def get_many(self, *args, **kwargs):
+        ids = self.args.get_field_value('id') or []
+        rows = self.db.execute('select id, name from person where id in (%s)' % ','.join('?' * len(ids)), ids)
+        return [PersonModel(id=id_, name=name) for id_, name in rows]
+
+
+class PoolArticle(BaseResource):
+    model = ArticleModel
+    session = POOL
+
+    class Meta:
+        type_ = 'article'
+        link = '/pool_article'
+
+    class RelResources:
+        author = Relationship(rel_resource='PoolPerson', mapping_field='author')
+
+    async def get_many(self, *args, **kwargs):
+        SESSIONS[self.request.headers['x-request']].add(id(self.db))
+        PEAK.append(POOL.metrics()['in_use'])
+        await asyncio.sleep(0.01)  # 让并发的请求交错执行
+        rows = self.db.execute('select id, title, author from article order by id limit ?', (self.args.limit,))
+        return [ArticleModel(id=id_, title=title, author=author) for id_, title, author in rows]
+
+    async def count(self):
+        SESSIONS[self.request.headers['x-request']].add(id(self.db))
+        return self.db.execute('select count(*) from article').fetchone()[0]
+
+
+class PoolRoot(BaseResource):
+    childs = [PoolArticle, PoolPerson]
+
+
+@pytest.fixture
+def pool_app():
+    keeper = sqlite3.connect(POOL.database, uri=True)  # 共享内存库在有连接时保留
+    keeper.execute('create table if not exists person (id text primary key, name text)')
+    keeper.execute('create table if not exists article (id text primary key, title text, author text)')
+    keeper.execute('delete from person')
+    keeper.execute('delete from article')
+    keeper.executemany('insert into person values (?, ?)', [(str(i), 'p%s' % i) for i in range(3)])
+    keeper.executemany('insert into article values (?, ?, ?)', [(str(i), 'a%s' % i, str(i % 3)) for i in range(6)])
+    keeper.commit()
+    SESSIONS.clear()
+    PEAK.clear()
+    app = FastAPI()
+    PoolRoot.register_routes(app)
+    yield app
+    keeper.close()
+
+
+def test_concurrent_requests_release_sessions(pool_app):
+    async def run():
+        async with httpx.AsyncClient(app=pool_app, base_url='http://test') as client:
+            return await asyncio.gather(*[
+                client.get('/pool_article?page[limit]=3&include=author', headers={'x-request': str(i)})
+                for i in range(8)])
+
+    responses = asyncio.run(run())
+    assert [response.status_code for response in responses] == [200] * 8
+    assert all(len(response.json()['included']) == 3 for response in responses)
+    assert max(PEAK) > 1  # 请求并发执行
+    assert all(len(sessions) == 1 for sessions in SESSIONS.values())  # 一次请求内get_many和count复用会话
+    metrics = POOL.metrics()
+    assert metrics['in_use'] == 0
+    assert metrics['idle'] == metrics['size'] <= POOL.maxsize
+    assert metrics['created'] <= POOL.maxsize
+    assert metrics['timeouts'] == 0
+
+
+def test_pool_acquire_release_and_timeout():
+    async def run():
+        pool = SQLiteSessionPool(database='file:jsonapi_pool_unit?mode=memory&cache=shared', maxsize=1,
+                                 timeout=0.05)
+        session = await pool.acquire()
+        assert pool.metrics()['in_use'] == 1
+        with pytest.raises(PoolTimeout):
+            await pool.acquire()
+        await pool.release(session)
+        assert await pool.acquire() is session  # 归还的会话被复用
+        await pool.release(session)
+        metrics = pool.metrics()
+        await pool.close()
+        return metrics, pool.metrics()
+
+    metrics, closed = asyncio.run(run())
+    assert metrics == {'maxsize': 1, 'size': 1, 'idle': 1, 'in_use': 0, 'waiting': 0, 'created': 1,
+                       'acquired': 2, 'timeouts': 1}
+    assert closed['size'] == 0 and closed['idle'] == 0
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import fastapi_jsonapi.query
+from fastapi_jsonapi import BaseResource, SchemaBase, Relationship
+from fastapi_jsonapi.field import Field
+from fastapi_jsonapi.query import ArgsCache, ArgsModel, Cursor, Filter, FilterAnd, Sort, get_query_plan
+from fastapi_jsonapi.util import get_default_args
+
+from conftest import CALLS, Article
+
+
+def test_args_copy_does_not_share_containers():
+    args = ArgsModel(filter=FilterAnd(filters=[Filter(field='id', op='in', value=['1'])]),
+                     include=['author'], q_data=['author'], fields={'article': ['title']},
+                     cursor=Cursor(sort=[Sort(field='id', asc=True)], values=['1']))
+    copied = args.copy()
+    copied.include.append('tags')
+    copied.q_data.append('tags')
+    copied.fields['article'].append('views')
+    copied.filter.filters[0].value.append('2')
+    copied.cursor.values.append('2')
+    copied.sort[0].asc = False
+    assert args.include == ['author']
+    assert args.q_data == ['author']
+    assert args.fields == {'article': ['title']}
+    assert args.filter.filters[0].value == ['1']
+    assert args.cursor.values == ['1']
+    assert args.sort[0].asc is True
+
+
+def test_args_cache_template_is_not_mutated():
+    cache = ArgsCache(maxsize=2)
+    cache.put('key', ArgsModel(include=['author']))
+    args = cache.get('key')
+    args.include.append('tags')
+    assert cache.get('key').include == ['author']
+    assert cache.info()['hits'] == 2
+
+
+def test_args_cache_hits_per_query_string(client):
+    Article.args_cache_info()  # 生成查询计划
+    before = Article.args_cache_info()['hits']
+    for _ in range(3):
+        assert client.get('/article?include=author&page[limit]=2').status_code == 200
+    assert Article.args_cache_info()['hits'] - before >= 2
+    assert CALLS.count('person') == 3
+
+
+def test_query_params_precomputed_per_route(client, monkeypatch):
+    endpoints = [route.endpoint for route in Article.route.routes]
+    assert endpoints and all(endpoint.query_params == frozenset(get_default_args(endpoint))
+                             for endpoint in endpoints)
+    assert {'page[limit]', 'page[offset]', 'include'} <= Article.route.routes[0].endpoint.query_params
+
+    def get_query_params(func):
+        raise AssertionError('请求时不应重新计算接口参数')
+
+    monkeypatch.setattr(fastapi_jsonapi.query, 'get_query_params', get_query_params)
+    assert client.get('/article?page[limit]=3&include=tags').status_code == 200
+    response = client.get('/article?page[limit]=3&zzz=1&aaa=2')
+    assert response.status_code == 400
+    assert '[zzz]' in response.text  # 报告请求中第一个未知参数
+
+
+class PlanLabelModel(SchemaBase):
+    id: str = Field(None)
+    name: str = Field(None)
+
+
+class PlanNoteModel(SchemaBase):
+    id: str = Field(None)
+    title: str = Field(None)
+    label: str = Field(None, isrel=True)
+
+
+class PlanLabel(BaseResource):
+    model = PlanLabelModel
+
+    class Meta:
+        type_ = 'label'
+        link = '/plan_label'
+
+
+class PlanNote(BaseResource):
+    model = PlanNoteModel
+
+    class Meta:
+        type_ = 'note'
+        link = '/plan_note'
+
+    class RelResources:
+        label = Relationship(rel_resource='PlanLabel', mapping_field='label')
+
+    async def get_many(self, *args, **kwargs):
+        return [PlanNoteModel(id='1', title='n1')]
+
+
+class PlanRoot(BaseResource):
+    childs = [PlanNote, PlanLabel]
+
+
+def test_add_fields_invalidates_query_plan():
+    app = FastAPI()
+    PlanRoot.register_routes(app)
+    client = TestClient(app)
+    plan = get_query_plan(PlanNote)
+    assert get_query_plan(PlanNote) is plan
+    assert 'body' not in plan.sort_fields
+    assert client.get('/plan_note?sort=body').status_code == 400
+    plan.args_cache.put('key', ArgsModel())
+
+    PlanNoteModel.add_fields(body=(str, Field(None)))
+    new_plan = get_query_plan(PlanNote)
+    assert new_plan is not plan
+    assert 'body' in new_plan.sort_fields
+    assert 'body' in new_plan.type_fields['note']
+    assert new_plan.args_cache.get('key') is None  # 解析后的参数缓存一并失效
+    assert client.get('/plan_note?sort=body').status_code == 200
+
+    # 关系资源的模型修改后，依赖它的计划也失效
+    PlanLabelModel.add_fields(color=(str, Field(None)))
+    label_plan = get_query_plan(PlanNote)
+    assert label_plan is not new_plan
+    assert 'label.color' in label_plan.sort_fields
+    assert 'color' in label_plan.type_fields['label']
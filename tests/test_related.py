@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from fastapi_jsonapi.query import get_query_plan
+
+from conftest import CALLS, DATA, Article, ArticleModel
+
+
+def test_related_ids_cache_is_invalidated_by_writes(client, monkeypatch):
+    async def patch(self, *args, **kwargs):
+        DATA['article']['1']['author'] = '3'
+        return ArticleModel(**DATA['article']['1'])
+
+    monkeypatch.setattr(get_query_plan(Article).related_ids_cache, 'ttl', 60)
+    monkeypatch.setattr(Article, 'patch', patch)
+    assert client.get('/article/1/author').json()['data']['id'] == '1'
+    CALLS.clear()
+    assert client.get('/article/1/author').json()['data']['id'] == '1'
+    assert CALLS == ['person']  # 父资源的关系ids已缓存
+    response = client.patch('/article/1', json={'data': {'type': 'article', 'id': '1', 'attributes': {}}})
+    assert response.status_code == 200
+    CALLS.clear()
+    assert client.get('/article/1/author').json()['data']['id'] == '3'
+    assert CALLS == ['article', 'person']
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import uuid
+from enum import Enum
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+from fastapi_jsonapi.responses import JsonapiResponse, encode_default, fast_encoder, json_dumps
+
+from conftest import Article, Tag
+
+
+class Color(Enum):
+    red = 'red'
+
+
+class Inner(BaseModel):
+    a: int = 1
+    b: int = None
+
+
+class Outer(BaseModel):
+    id: uuid.UUID
+    inner: Inner
+    color: Color = Color.red
+    at: datetime.date = datetime.date(2024, 1, 2)
+
+
+def test_encode_default_matches_jsonable_encoder():
+    value = Outer(id=uuid.UUID(int=1), inner=Inner(b=2))
+    assert json.loads(json_dumps({'value': value})) == jsonable_encoder({'value': value})
+    assert encode_default(Inner(b=2)) == {'a': 1, 'b': 2}
+
+
+def test_stdlib_json_is_the_default():
+    assert JsonapiResponse.encoder is json_dumps
+    with pytest.raises(ValueError):
+        JsonapiResponse(content={'value': float('nan')})
+    assert JsonapiResponse(content={'名称': 1}).body == '{"名称":1}'.encode('utf-8')
+
+
+def test_fast_encoder_is_opt_in(monkeypatch):
+    encoder = fast_encoder()
+    monkeypatch.setattr(JsonapiResponse, 'encoder', staticmethod(encoder))
+    value = {'id': uuid.UUID(int=1), 'inner': Inner(b=2), 'at': datetime.date(2024, 1, 2)}
+    assert json.loads(JsonapiResponse(content=value).body) == jsonable_encoder(value)
+
+
+
+@pytest.mark.parametrize('url', ['/tag/1', '/tag?page[limit]=2', '/article/1?include=author,tags'])
+def test_prerender_matches_response_model(client, monkeypatch, url):
+    documents = []
+    jsonapi = Tag._jsonapi
+
+    async def record(self, *args, **kwargs):
+        document = await jsonapi(self, *args, **kwargs)
+        documents.append(document)
+        return document
+
+    monkeypatch.setattr(Tag, '_jsonapi', record)
+    validated = client.get(url).json()
+    # 经过响应模型时文档不变，由响应模型去掉没有关系的资源的relationships和included
+    for document in documents:
+        data = document['data'] if isinstance(document['data'], list) else [document['data']]
+        assert 'included' in document and all('relationships' in item for item in data)
+    for resource in (Tag, Article):
+        monkeypatch.setattr(resource, 'prerender_response', True)
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.json() == validated
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from typing import List
+
+import pytest
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+import fastapi_jsonapi.schema
+from fastapi_jsonapi import BaseResource, SchemaBase, Relationship
+from fastapi_jsonapi.field import Field
+
+from conftest import Person
+
+
+class Point(BaseModel):
+    x: int
+    y: int
+
+
+class GadgetModel(SchemaBase):
+    id: str = Field(None)
+    display_name: str = Field(None, alias='displayName')
+    points: List[Point] = Field(None)
+    created: datetime = Field(None)
+    secret: str = Field(None, ishide=True)
+    detail: str = Field(None, inmany=False)
+
+
+ROWS = [GadgetModel(id=str(i), displayName='g%s' % i, points=[Point(x=i, y=1)], created=datetime(2020, 1, i + 1),
+                    secret='s', detail='d%s' % i) for i in range(3)]
+
+
+class Gadget(BaseResource):
+    model = GadgetModel
+
+    class Meta:
+        type_ = 'gadget'
+        link = '/gadget'
+
+    async def get_many(self, *args, **kwargs):
+        ids = self.args.get_field_value('id')
+        ids = [ids] if isinstance(ids, str) else ids
+        return [row for row in ROWS if not ids or row.id in ids]
+
+
+class GadgetRoot(BaseResource):
+    childs = [Gadget]
+
+
+@pytest.mark.parametrize('many', [True, False])
+@pytest.mark.parametrize('fields', [None, {'display_name'}, {'points', 'created'}, set()])
+def test_attr_picker_matches_validation(many, fields):
+    attr_model = GadgetModel.response_attr_model(many=many)
+    for row in ROWS:
+        validated = attr_model(**row.dict())
+        expected = jsonable_encoder(validated.dict() if fields is None else validated.dict(include=fields))
+        picked = jsonable_encoder(attr_model.pick(row, fields))
+        assert picked.keys() == expected.keys()
+        # 别名字段验证时按别名取值，得到None，响应模型输出时两种方式都不输出该字段，由响应测试比较
+        assert {key: value for key, value in picked.items() if key != 'display_name'} == \
+               {key: value for key, value in expected.items() if key != 'display_name'}
+
+
+@pytest.mark.parametrize('url', ['/gadget', '/gadget/1', '/gadget?fields[gadget]=display_name,points',
+                                 '/gadget/1?fields[gadget]=detail'])
+def test_trusted_rows_response_matches_validation(monkeypatch, url):
+    app = FastAPI()
+    GadgetRoot.register_routes(app)
+    client = TestClient(app)
+    validated = client.get(url)
+    monkeypatch.setattr(Gadget, 'trusted_rows', True)
+    trusted = client.get(url)
+    assert validated.status_code == trusted.status_code == 200
+    assert trusted.json() == validated.json()
+
+
+def test_attr_model_cached_per_model_class(monkeypatch):
+    class CachedModel(SchemaBase):
+        id: str = Field(None)
+        name: str = Field(None)
+        detail: str = Field(None, inmany=False)
+
+    class CachedChildModel(CachedModel):
+        pass
+
+    single, many = CachedModel.response_attr_model(), CachedModel.response_attr_model(many=True)
+    assert set(single.__fields__) == {'name', 'detail'} and set(many.__fields__) == {'name'}
+    assert CachedChildModel.response_attr_model() is not single  # 子类单独缓存
+
+    def create_model(*args, **kwargs):
+        raise AssertionError('模型已缓存，不应重新生成')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(fastapi_jsonapi.schema, 'create_model', create_model)
+        assert CachedModel.response_attr_model() is single
+        assert CachedModel.response_attr_model(many=True) is many
+    CachedModel.add_fields(extra=(str, Field(None)))
+    assert CachedModel.response_attr_model() is not single  # add_fields后重新生成
+    assert 'extra' in CachedModel.response_attr_model(many=True).__fields__
+
+
+class BadgeModel(SchemaBase):
+    id: str = Field(None)
+    label: str = Field(None)
+
+
+class WriterModel(SchemaBase):
+    id: str = Field(None)
+    name: int = Field(None)
+
+
+class BadgeHolderModel(SchemaBase):
+    id: str = Field(None)
+    author: str = Field(None, isrel=True)
+    writer: str = Field(None, isrel=True)
+    badge: str = Field(None, isrel=True)
+
+
+class Writer(BaseResource):
+    """与Person相同type，name为int，Person的数据不能通过Writer模型验证"""
+    model = WriterModel
+
+    class Meta:
+        type_ = 'person'
+        link = '/writer'
+
+    async def get_many(self, *args, **kwargs):
+        return [WriterModel(id='7', name=7)]
+
+
+class Badge(BaseResource):
+    model = BadgeModel
+
+    class Meta:
+        type_ = 'badge'
+        link = '/badge'
+
+    async def get_many(self, *args, **kwargs):
+        return [BadgeModel(id='1', label='gold')]
+
+
+class BadgeHolder(BaseResource):
+    model = BadgeHolderModel
+
+    class Meta:
+        type_ = 'holder'
+        link = '/holder'
+
+    class RelResources:
+        writer = Relationship(rel_resource='Writer', mapping_field='writer')
+        author = Relationship(rel_resource='Person', mapping_field='author')
+        badge = Relationship(rel_resource='Badge', mapping_field='badge')
+
+    async def get_many(self, *args, **kwargs):
+        return [BadgeHolderModel(id='1', author='1', writer='7', badge='1')]
+
+
+class SoloHolder(BaseResource):
+    model = BadgeHolderModel
+
+    class Meta:
+        type_ = 'solo'
+        link = '/solo'
+
+    class RelResources:
+        author = Relationship(rel_resource='Person', mapping_field='author')
+        badge = Relationship(rel_resource='Badge', mapping_field='badge')
+
+    get_many = BadgeHolder.get_many
+
+
+class HolderRoot(BaseResource):
+    childs = [BadgeHolder, SoloHolder, Writer, Badge, Person]
+
+
+@pytest.fixture
+def holder_client() -> TestClient:
+    app = FastAPI()
+    HolderRoot.register_routes(app)
+    return TestClient(app)
+
+
+def test_included_with_shared_type_falls_back_to_union(holder_client):
+    response = holder_client.get('/holder/1?include=writer,author,badge')
+    assert response.status_code == 200
+    included = {(item['type'], item['id']): item['attributes'] for item in response.json()['included']}
+    assert included == {('person', '7'): {'name': 7}, ('person', '1'): {'name': 'p1'}, ('badge', '1'): {'label': 'gold'}}
+    schemas = holder_client.app.openapi()['components']['schemas']
+    assert 'discriminator' not in schemas['BadgeHolderSingleResponse']['properties']['included']['items']
+
+
+def test_included_discriminated_by_type(holder_client):
+    response = holder_client.get('/solo/1?include=author,badge')
+    assert response.status_code == 200
+    assert {item['type'] for item in response.json()['included']} == {'person', 'badge'}
+    schemas = holder_client.app.openapi()['components']['schemas']
+    included = schemas['SoloHolderSingleResponse']['properties']['included']['items']
+    assert included['discriminator']['propertyName'] == 'type'
+    assert set(included['discriminator']['mapping']) == {'person', 'badge'}
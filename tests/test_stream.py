@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import CALLS, Article, ArticleModel, make_app, make_get_many
+
+URL = '/article?page[limit]=null&include=author,tags&sort=-views'
+
+
+class CountingSession:
+    """记录get/close次数的单例会话"""
+
+    def __init__(self):
+        self.opened = 0
+        self.closed = 0
+
+    def get(self):
+        self.opened += 1
+        return self
+
+    def close(self):
+        self.closed += 1
+
+
+@pytest.fixture
+def stream(monkeypatch):
+    """文章get_many为异步生成器，fail为出错的行号"""
+    get_many = make_get_many('article', ArticleModel)
+    state = {'fail': None, 'session': CountingSession()}
+
+    async def stream_get_many(self, *args, **kwargs):
+        for i, data in enumerate(await get_many(self, *args, **kwargs)):
+            if i == state['fail']:
+                raise RuntimeError('stream failed')
+            yield data
+
+    monkeypatch.setattr(Article, 'stream_chunk_size', 7)
+    monkeypatch.setattr(Article, 'session', state['session'])
+    monkeypatch.setattr(Article, 'get_many', stream_get_many)
+    return state
+
+
+def by_identity(included: list) -> dict:
+    return {(item['type'], item['id']): item for item in included}
+
+
+def test_stream_matches_plain_response(client, monkeypatch):
+    plain = client.get(URL).json()
+    with monkeypatch.context() as patch:
+        get_many = make_get_many('article', ArticleModel)
+
+        async def stream_get_many(self, *args, **kwargs):
+            for data in await get_many(self, *args, **kwargs):
+                yield data
+
+        patch.setattr(Article, 'stream_chunk_size', 7)
+        patch.setattr(Article, 'get_many', stream_get_many)
+        response = client.get(URL)
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('application/vnd.api+json')
+    streamed = json.loads(response.content)  # 拼接的文档是合法json
+    assert streamed['data'] == plain['data']
+    assert streamed['meta'] == plain['meta'] == {'pagination': {'total': 30, 'limit': None, 'offset': 0}}
+    # 各批的included分别输出，顺序可能不同，内容与去重结果相同
+    assert len(streamed['included']) == len(plain['included'])
+    assert by_identity(streamed['included']) == by_identity(plain['included'])
+
+
+def test_stream_ndjson(client, stream):
+    response = client.get(URL, headers={'accept': 'application/x-ndjson'})
+    lines = [json.loads(line) for line in response.content.splitlines()]
+    assert [line['id'] for line in lines if line['type'] == 'article'] == [str(i) for i in range(29, -1, -1)]
+    assert len({(line['type'], line['id']) for line in lines}) == len(lines)  # included不重复
+
+
+def test_stream_error_releases_session(stream):
+    stream['fail'] = 10  # 第二批出错，第一批已输出
+    client = TestClient(make_app())
+    with pytest.raises(Exception) as error:  # 响应已开始，错误中断连接
+        client.get(URL)
+    assert any('stream failed' in str(e) for e in getattr(error.value, 'exceptions', (error.value,)))
+    assert stream['session'].opened == stream['session'].closed > 0
+    assert 'count' not in CALLS  # 出错后不再计算总条数